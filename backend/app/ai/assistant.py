@@ -1,24 +1,58 @@
+import asyncio
+import re
+import threading
+from collections.abc import AsyncGenerator, AsyncIterator
+from contextlib import aclosing
+from dataclasses import replace
+
 from fastapi import HTTPException
-from langchain_core.output_parsers import StrOutputParser
-from langchain_openai import ChatOpenAI
-from openai import OpenAI
-from openai.types.chat import (
-    ChatCompletionAssistantMessageParam,
-    ChatCompletionSystemMessageParam,
-    ChatCompletionUserMessageParam,
-)
-from pydantic.v1.types import SecretStr
-from sqlmodel import Session
+from openai import AsyncOpenAI
+from sqlmodel.ext.asyncio.session import AsyncSession
 
 from app import crud
+from app.ai import clients
+from app.ai.completion_cache import completion_cache, completion_key
+from app.ai.context import (
+    ContextWindow,
+    build_context,
+    build_oldest_context,
+    get_token_counter,
+)
+from app.ai.moderation_cache import content_hash, moderation_cache
+from app.ai.providers import (
+    AsyncOpenAIProvider,
+    AsyncProvider,
+    CompletionRequest,
+    get_async_provider,
+)
+from app.ai.rate_limit import completion_limiter, moderation_limiter
+from app.ai.resilience import (
+    ProviderUnavailable,
+    completion_policy,
+    discard_task,
+    moderation_breaker,
+)
+from app.ai.semantic_cache import first_question, semantic_cache
+from app.core import metrics
 from app.core.config import settings
-from app.exception import ApiDbException
-from app.models import CnvMessage, CnvMessageAssistantCreate, Conversation
+from app.models import (
+    CnvMessage,
+    CnvMessageAssistantCreate,
+    Conversation,
+    ConversationUpdate,
+)
 
 
 class SystemPrompts:
     summary_generator: str = "Podsumuj konwersacje w 5 słowach"
+    summary_update: str = (
+        "Uzupełnij podsumowanie konwersacji o nowe wiadomości, w 5 słowach. "
+        "Dotychczasowe podsumowanie: {summary}"
+    )
     assistant: str = "Jesteś pomocnym asystentem"
+    conversation_summary: str = (
+        "{system_input}\n\nPodsumowanie wcześniejszej części rozmowy: {summary}"
+    )
 
 
 class StaticAnswers:
@@ -42,6 +76,9 @@ print(squares)
 Powyższy kod tworzy trzy różne listy za pomocą list comprehension: listę liczb od 1 do 10, listę liczb parzystych od 1 do 10 oraz listę kwadratów liczb od 1 do 5.
 """
     mock_summary: str = "Mock summary"
+    unavailable: str = (
+        "Asystent jest chwilowo niedostępny. Spróbuj ponownie za kilka minut."
+    )
     unsafe_mes: str = "Hola, hola... jestem od tego żeby Ci pomóc się uczyć także zważaj na słowa i na to o co pytasz."
 
 
@@ -49,95 +86,447 @@ class OpenAIModels:
     gpt_35_turbo = "gpt-3.5-turbo"
 
 
-class LLMController:
-    def __init__(self) -> None:
-        self.openai_client = OpenAI(api_key=settings.OPEN_API_KEY)
-        self.chat_open_ai = ChatOpenAI(api_key=SecretStr(settings.OPEN_API_KEY))
-        self.str_output_parser = StrOutputParser()
+class AsyncLLMController:
+    """
+    Moderation and completions with caching in front of a provider.
+
+    An explicit ``openai_client`` wins over ``AI_PROVIDER``, which is how
+    tests and benchmarks point a controller at a stub server.
+    """
 
-    def moderate_input_is_flagged(self, text_to_validate: str) -> bool:
-        response = self.openai_client.moderations.create(input=text_to_validate)
-        output = response.results[0]
-        return output.flagged
+    def __init__(
+        self,
+        openai_client: AsyncOpenAI | None = None,
+        *,
+        provider: AsyncProvider | None = None,
+    ) -> None:
+        if provider is None:
+            provider = (
+                AsyncOpenAIProvider(openai_client)
+                if openai_client
+                else get_async_provider(
+                    StaticAnswers.mock_ans, StaticAnswers.mock_summary
+                )
+            )
+        self.provider = provider
+
+    async def moderate_input_is_flagged(self, text_to_validate: str) -> bool:
+        key = content_hash(text_to_validate)
+        if moderation_cache.enabled:
+            cached = await moderation_cache.get_async(key)
+            if cached is not None:
+                return cached
+        with moderation_breaker.guard():
+            async with moderation_limiter.limit_async(1):
+                flagged = await self.provider.moderate(text_to_validate)
+        if moderation_cache.enabled:
+            await moderation_cache.set_async(key, flagged)
+        return flagged
 
-    def single_completion(
+    async def single_completion(
         self,
         system_input: str,
         messages_list: list[CnvMessage],
         model: str = OpenAIModels.gpt_35_turbo,
         max_tokens: int = 2000,
+        temperature: float | None = None,
+        summary: bool = False,
+        first_turn: bool | None = None,
     ) -> str | None:
-        typed_messages: list[
-            ChatCompletionSystemMessageParam
-            | ChatCompletionUserMessageParam
-            | ChatCompletionAssistantMessageParam
-        ] = []
-        for msg in messages_list:
-            if msg.role == "user":
-                typed_messages.append(
-                    ChatCompletionUserMessageParam(role="user", content=msg.content)
-                )
-            elif msg.role == "assistant":
-                typed_messages.append(
-                    ChatCompletionAssistantMessageParam(
-                        role="assistant", content=msg.content
-                    )
-                )
-        system_message = ChatCompletionSystemMessageParam(
-            role="system", content=system_input
+        """
+        ``first_turn`` says whether the conversation has no earlier history.
+        By default it is read from ``messages_list``, which callers that trim
+        the history have to override.
+        """
+        if first_turn is None:
+            first_turn = first_question(messages_list) is not None
+        key = None
+        if completion_cache.accepts(
+            model=model, first_turn=first_turn, temperature=temperature
+        ):
+            key = completion_key(
+                model=model,
+                max_tokens=max_tokens,
+                temperature=temperature,
+                system_input=system_input,
+                messages=messages_list,
+            )
+            cached = await completion_cache.get_async(key)
+            if cached is not None:
+                return cached
+        request = CompletionRequest(
+            system_input=system_input,
+            messages=messages_list,
+            model=model,
+            max_tokens=max_tokens,
+            temperature=temperature,
+            summary=summary,
         )
-        typed_messages.insert(0, system_message)
-        chat_completion = self.openai_client.chat.completions.create(
-            model=model, max_tokens=max_tokens, messages=typed_messages
-        )
-        return chat_completion.choices[0].message.content
+        tokens = request_tokens(request)
 
+        async def attempt(timeout: float) -> str | None:
+            return await self.provider.complete(replace(request, timeout=timeout))
 
-def generate_answer(*, session: Session, owner_id: int, conv_id: int) -> CnvMessage:
-    conversation = session.get(Conversation, conv_id)
-    if not conversation or conversation.id is None:
-        raise HTTPException(status_code=404, detail="Conversation not found")
-    if conversation.id is None:
-        raise ApiDbException("Conversation without id")
-    if settings.AI_MOCK_REST_CALLS:
-        return crud.create_cnvmessage(
-            session=session,
-            cnv_in=CnvMessageAssistantCreate(content=StaticAnswers.mock_ans),
-            owner_id=owner_id,
-            conv_id=conversation.id,
+        content = await completion_policy.run_async(
+            attempt, lambda: completion_limiter.limit_async(1, tokens)
         )
-    llm = LLMController()
-    is_flagged = llm.moderate_input_is_flagged(conversation.messages[-1].content)
-    if is_flagged:
-        return crud.create_cnvmessage(
-            session=session,
-            cnv_in=CnvMessageAssistantCreate(content=StaticAnswers.unsafe_mes),
-            owner_id=owner_id,
-            conv_id=conversation.id,
+        if key is not None and content is not None:
+            await completion_cache.set_async(key, model, content)
+        return content
+
+    async def stream_completion(
+        self,
+        system_input: str,
+        messages_list: list[CnvMessage],
+        model: str = OpenAIModels.gpt_35_turbo,
+        max_tokens: int = 2000,
+    ) -> AsyncGenerator[str, None]:
+        request = CompletionRequest(
+            system_input=system_input,
+            messages=messages_list,
+            model=model,
+            max_tokens=max_tokens,
         )
-    generated_answer = llm.single_completion(
-        system_input=SystemPrompts.assistant, messages_list=conversation.messages
+        with completion_policy.breaker.guard():
+            async with completion_limiter.limit_async(1, request_tokens(request)):
+                async for chunk in self.provider.stream(request):
+                    yield chunk
+
+
+def request_tokens(request: CompletionRequest) -> int:
+    """
+    What a completion counts against tokens-per-minute limits: the prompt
+    plus ``max_tokens``, which providers reserve up front.
+    """
+    count_tokens = get_token_counter(request.model)
+    prompt = count_tokens(request.system_input) + sum(
+        count_tokens(message.content) for message in request.messages
+    )
+    return prompt + request.max_tokens
+
+
+def split_into_chunks(text: str) -> list[str]:
+    """
+    Split text into word-sized chunks; joining them gives back the text.
+    """
+    return re.findall(r"\s*\S+\s*", text) or [text]
+
+
+_async_llm_controller: AsyncLLMController | None = None
+_llm_controller_lock = threading.Lock()
+
+
+def get_async_llm_controller() -> AsyncLLMController:
+    """
+    Return the process-wide controller, built on the pooled provider client.
+    """
+    global _async_llm_controller
+    if _async_llm_controller is None:
+        with _llm_controller_lock:
+            if _async_llm_controller is None:
+                _async_llm_controller = AsyncLLMController()
+    return _async_llm_controller
+
+
+async def reset_async_llm_controller() -> None:
+    global _async_llm_controller
+    with _llm_controller_lock:
+        _async_llm_controller = None
+    await clients.aclose_clients()
+
+
+def prepare_context(
+    *,
+    system_input: str,
+    messages: list[CnvMessage],
+    summary: str | None = None,
+    model: str = OpenAIModels.gpt_35_turbo,
+) -> ContextWindow:
+    """
+    Fit messages loaded with ``AI_CONTEXT_MAX_MESSAGES`` into the prompt budget.
+    """
+    return build_context(
+        system_input=system_input,
+        messages=messages,
+        max_tokens=settings.AI_CONTEXT_MAX_TOKENS,
+        count_tokens=get_token_counter(model),
+        summary=summary,
+        summary_template=SystemPrompts.conversation_summary,
+        prefix_dropped=len(messages) >= settings.AI_CONTEXT_MAX_MESSAGES,
     )
-    assistant_msg = CnvMessageAssistantCreate(content=generated_answer)
-    return crud.create_cnvmessage(
+
+
+def summary_is_due(
+    summary: str | None,
+    pending: list[CnvMessage],
+    model: str = OpenAIModels.gpt_35_turbo,
+) -> bool:
+    """
+    Whether the messages after the summary watermark should be folded in.
+
+    A conversation without a summary gets one right away. Later messages
+    are folded in once enough of them, or enough of their tokens, built up.
+    """
+    if not pending:
+        return False
+    if summary is None or len(pending) >= settings.AI_SUMMARY_REFRESH_MESSAGES:
+        return True
+    count_tokens = get_token_counter(model)
+    tokens = sum(count_tokens(message.content) for message in pending)
+    return tokens >= settings.AI_SUMMARY_REFRESH_TOKENS
+
+
+def summary_system_input(summary: str | None) -> str:
+    if summary is None:
+        return SystemPrompts.summary_generator
+    return SystemPrompts.summary_update.format(summary=summary)
+
+
+async def generate_answer_async(
+    *, unit: crud.UnitOfWork, owner_id: int, conv_id: int
+) -> CnvMessage:
+    """
+    Answer the last message of the conversation.
+
+    The session gives its connection back before the provider is called, so
+    a slow completion does not hold a pooled connection idle in transaction.
+    The answer is only added to ``unit``; it gets its id when the caller
+    commits the turn.
+    """
+    session = unit.session
+    conversation = await session.get(Conversation, conv_id)
+    if not conversation or conversation.id is None:
+        raise HTTPException(status_code=404, detail="Conversation not found")
+    messages = await crud.get_last_cnvmessages_async(
         session=session,
-        cnv_in=assistant_msg,
-        owner_id=owner_id,
         conv_id=conversation.id,
+        limit=settings.AI_CONTEXT_MAX_MESSAGES,
+    )
+    context = prepare_context(
+        system_input=SystemPrompts.assistant,
+        messages=messages,
+        summary=conversation.summary,
     )
+    # Unlike commit, close leaves the loaded objects readable
+    await session.close()
+    llm = get_async_llm_controller()
+    first = first_question(messages, summary=conversation.summary)
+    question = first if semantic_cache.enabled else None
+    generated_answer = None
+    try:
+        if question is not None:
+            generated_answer = await semantic_cached_answer(
+                llm, question=question, scope=context.system_input
+            )
+        if generated_answer is None:
+            generated_answer = await moderated_completion_async(
+                llm,
+                system_input=context.system_input,
+                messages_list=context.messages,
+                first_turn=first is not None,
+            )
+            if question is not None and generated_answer is not None:
+                remember_answer(question, generated_answer, scope=context.system_input)
+    except ProviderUnavailable as e:
+        generated_answer = fallback_answer(e)
+    return unit.add_cnvmessage(
+        CnvMessageAssistantCreate(content=generated_answer),
+        owner_id=owner_id,
+        conversation=conversation,
+    )
+
 
+async def generate_summary_async(
+    *, session: AsyncSession, conv_id: int, llm: AsyncLLMController | None = None
+) -> ConversationUpdate | None:
+    """
+    Fold the messages after the summary watermark, as many as fit in the
+    prompt budget, into the summary.
 
-def generate_summary(*, session: Session, conv_id: int) -> str | None:
-    conversation = session.get(Conversation, conv_id)
+    Returns the update to store, or None when no refresh is due. ``llm``
+    lets the job worker use a dedicated controller.
+    """
+    conversation = await session.get(Conversation, conv_id)
     if not conversation or conversation.id is None:
         raise HTTPException(status_code=404, detail="Conversation not found")
-    if conversation.id is None:
-        raise ApiDbException("Conversation without id")
-    if settings.AI_MOCK_REST_CALLS:
-        return StaticAnswers.mock_summary
-    llm = LLMController()
-    return llm.single_completion(
-        system_input=SystemPrompts.summary_generator,
-        messages_list=conversation.messages,
+    pending = await crud.get_cnvmessages_after_async(
+        session=session,
+        conv_id=conversation.id,
+        after_id=conversation.summary_message_id,
+        limit=settings.AI_CONTEXT_MAX_MESSAGES,
+    )
+    if not summary_is_due(conversation.summary, pending):
+        return None
+    # Oldest first: the watermark only passes messages the summary covers,
+    # and whatever does not fit is folded in by a later refresh
+    context = build_oldest_context(
+        system_input=summary_system_input(conversation.summary),
+        messages=pending,
+        max_tokens=settings.AI_CONTEXT_MAX_TOKENS,
+        count_tokens=get_token_counter(OpenAIModels.gpt_35_turbo),
+    )
+    await session.close()
+    llm = llm or get_async_llm_controller()
+    summary = await llm.single_completion(
+        system_input=context.system_input,
+        messages_list=context.messages,
         max_tokens=20,
+        summary=True,
+    )
+    if summary is None:
+        return None
+    return ConversationUpdate(
+        id=conversation.id,
+        summary=summary,
+        summary_message_id=context.messages[-1].id,
     )
+
+
+async def stream_answer_async(
+    *, messages_list: list[CnvMessage], summary: str | None = None
+) -> AsyncIterator[str]:
+    llm = get_async_llm_controller()
+    context = prepare_context(
+        system_input=SystemPrompts.assistant, messages=messages_list, summary=summary
+    )
+    question = (
+        first_question(messages_list, summary=summary)
+        if semantic_cache.enabled
+        else None
+    )
+    if question is not None:
+        try:
+            cached = await semantic_cached_answer(
+                llm, question=question, scope=context.system_input
+            )
+        except ProviderUnavailable as e:
+            yield fallback_answer(e)
+            return
+        if cached is not None:
+            for chunk in split_into_chunks(cached):
+                yield chunk
+            return
+    chunks = []
+    try:
+        async with aclosing(
+            stream_moderated_answer_async(llm, context, messages_list)
+        ) as stream:
+            async for chunk in stream:
+                chunks.append(chunk)
+                yield chunk
+    except ProviderUnavailable as e:
+        if chunks:
+            raise
+        yield fallback_answer(e)
+        return
+    if question is not None:
+        remember_answer(question, "".join(chunks), scope=context.system_input)
+
+
+async def stream_moderated_answer_async(
+    llm: AsyncLLMController, context: ContextWindow, messages_list: list[CnvMessage]
+) -> AsyncGenerator[str, None]:
+    if not settings.AI_CONCURRENT_MODERATION:
+        if await llm.moderate_input_is_flagged(messages_list[-1].content):
+            yield StaticAnswers.unsafe_mes
+            return
+        async for chunk in llm.stream_completion(
+            system_input=context.system_input, messages_list=context.messages
+        ):
+            yield chunk
+        return
+    # Nothing is forwarded before the verdict, so a flagged input never leaks
+    moderation = asyncio.create_task(
+        llm.moderate_input_is_flagged(messages_list[-1].content)
+    )
+    stream = llm.stream_completion(
+        system_input=context.system_input, messages_list=context.messages
+    )
+    try:
+        first_chunk = await anext(stream, None)
+        if await moderation:
+            yield StaticAnswers.unsafe_mes
+            return
+        if first_chunk is not None:
+            yield first_chunk
+        async for chunk in stream:
+            yield chunk
+    finally:
+        discard_task(moderation)
+        await stream.aclose()
+
+
+async def semantic_cached_answer(
+    llm: AsyncLLMController, *, question: str, scope: str
+) -> str | None:
+    """
+    A cached answer to a question worded alike, once the question itself
+    passes moderation.
+    """
+    answer = semantic_cache.lookup(question, scope=scope)
+    if answer is None:
+        return None
+    if await llm.moderate_input_is_flagged(question):
+        return StaticAnswers.unsafe_mes
+    return answer
+
+
+def remember_answer(question: str, answer: str, *, scope: str) -> None:
+    if answer != StaticAnswers.unsafe_mes:
+        semantic_cache.store(question, answer, scope=scope)
+
+
+def fallback_answer(error: ProviderUnavailable) -> str:
+    """
+    The answer to give while the provider is unavailable. Cached answers are
+    looked up before any provider call, so by now only the static one is left;
+    with ``AI_COMPLETION_FALLBACK`` off the error propagates as a 503.
+    """
+    if not settings.AI_COMPLETION_FALLBACK:
+        raise error
+    metrics.increment("completion.fallbacks")
+    return StaticAnswers.unavailable
+
+
+async def moderated_completion_async(
+    llm: AsyncLLMController,
+    *,
+    system_input: str,
+    messages_list: list[CnvMessage],
+    concurrent: bool | None = None,
+    first_turn: bool | None = None,
+) -> str | None:
+    """
+    Complete the conversation unless moderation flags its last message.
+
+    With ``concurrent`` (``AI_CONCURRENT_MODERATION`` by default) both provider
+    calls start together and the completion is cancelled as soon as the input
+    is flagged, so a clean turn costs the slower call instead of the sum.
+    """
+    if concurrent is None:
+        concurrent = settings.AI_CONCURRENT_MODERATION
+    text_to_validate = messages_list[-1].content
+    if not concurrent:
+        if await llm.moderate_input_is_flagged(text_to_validate):
+            return StaticAnswers.unsafe_mes
+        return await llm.single_completion(
+            system_input=system_input,
+            messages_list=messages_list,
+            first_turn=first_turn,
+        )
+    completion = asyncio.create_task(
+        llm.single_completion(
+            system_input=system_input,
+            messages_list=messages_list,
+            first_turn=first_turn,
+        )
+    )
+    try:
+        is_flagged = await llm.moderate_input_is_flagged(text_to_validate)
+    except BaseException:
+        discard_task(completion)
+        raise
+    if is_flagged:
+        discard_task(completion)
+        return StaticAnswers.unsafe_mes
+    return await completion
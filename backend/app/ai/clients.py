@@ -0,0 +1,86 @@
+import threading
+
+import httpx
+from openai import AsyncOpenAI
+
+from app.core.config import settings
+
+DEFAULT_BASE_URL = "https://api.openai.com/v1"
+
+_lock = threading.Lock()
+_async_http_clients: dict[str, httpx.AsyncClient] = {}
+_async_openai_clients: dict[str, AsyncOpenAI] = {}
+
+
+def provider_base_url() -> str:
+    return settings.OPENAI_BASE_URL or DEFAULT_BASE_URL
+
+
+def provider_timeout() -> httpx.Timeout:
+    return httpx.Timeout(
+        settings.OPENAI_READ_TIMEOUT,
+        connect=settings.OPENAI_CONNECT_TIMEOUT,
+        pool=settings.OPENAI_POOL_TIMEOUT,
+    )
+
+
+def provider_limits() -> httpx.Limits:
+    return httpx.Limits(
+        max_connections=settings.OPENAI_MAX_CONNECTIONS,
+        max_keepalive_connections=settings.OPENAI_MAX_KEEPALIVE_CONNECTIONS,
+        keepalive_expiry=settings.OPENAI_KEEPALIVE_EXPIRY,
+    )
+
+
+def get_async_http_client(base_url: str | None = None) -> httpx.AsyncClient:
+    """
+    Return the keep-alive HTTP pool for a provider host.
+
+    One pool is kept per base URL, so the connection limits from settings are
+    applied per provider host and shared by every caller in the process.
+    """
+    base_url = base_url or provider_base_url()
+    client = _async_http_clients.get(base_url)
+    if client is not None:
+        return client
+    with _lock:
+        client = _async_http_clients.get(base_url)
+        if client is None:
+            client = httpx.AsyncClient(
+                limits=provider_limits(),
+                timeout=provider_timeout(),
+            )
+            _async_http_clients[base_url] = client
+        return client
+
+
+def get_async_openai_client(base_url: str | None = None) -> AsyncOpenAI:
+    base_url = base_url or provider_base_url()
+    client = _async_openai_clients.get(base_url)
+    if client is not None:
+        return client
+    http_client = get_async_http_client(base_url)
+    with _lock:
+        client = _async_openai_clients.get(base_url)
+        if client is None:
+            client = AsyncOpenAI(
+                api_key=settings.OPEN_API_KEY,
+                base_url=base_url,
+                timeout=provider_timeout(),
+                max_retries=settings.OPENAI_MAX_RETRIES,
+                http_client=http_client,
+            )
+            _async_openai_clients[base_url] = client
+        return client
+
+
+async def aclose_clients() -> None:
+    """
+    Close the async pools. They are bound to the event loop that used them.
+    """
+    with _lock:
+        async_clients = list(_async_http_clients.values())
+        _async_http_clients.clear()
+        _async_openai_clients.clear()
+    for client in async_clients:
+        await client.aclose()
@@ -0,0 +1,112 @@
+"""
+Cache of completions, keyed by a hash of everything sent to the provider.
+
+Only requests whose answer is reusable are cached: first turns, where the
+prompt is just the system input and one question, and requests at
+temperature 0. Models opt in through ``AI_COMPLETION_CACHE_MODELS``. The
+in-memory LRU/TTL tier serves repeats within a worker; with
+``AI_COMPLETION_CACHE_PERSISTENT`` entries are shared through Postgres.
+"""
+
+import hashlib
+import json
+from collections.abc import Sequence
+from datetime import timedelta
+
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from app import crud
+from app.core import metrics
+from app.core.cache import TTLCache
+from app.core.config import settings
+from app.core.db import async_engine
+from app.models import CnvMessage
+
+
+def completion_key(
+    *,
+    model: str,
+    max_tokens: int,
+    temperature: float | None,
+    system_input: str,
+    messages: Sequence[CnvMessage],
+) -> str:
+    request = [
+        model,
+        max_tokens,
+        temperature,
+        system_input,
+        [[message.role, message.content] for message in messages],
+    ]
+    data = json.dumps(request, ensure_ascii=False, separators=(",", ":"))
+    return hashlib.sha256(data.encode()).hexdigest()
+
+
+class CompletionCache:
+    def __init__(
+        self, *, models: Sequence[str], maxsize: int, ttl: float, persistent: bool
+    ) -> None:
+        self.models = set(models)
+        self.memory: TTLCache[str, str] = TTLCache(maxsize=maxsize, ttl=ttl)
+        self.max_age = timedelta(seconds=ttl)
+        self.persistent = persistent
+
+    def accepts(
+        self, *, model: str, first_turn: bool, temperature: float | None
+    ) -> bool:
+        """
+        Whether the answer may be cached: a first turn, whose question alone
+        decides the answer, or a deterministic request.
+        """
+        if model not in self.models:
+            return False
+        if not (self.memory.maxsize > 0 or self.persistent):
+            return False
+        return first_turn or temperature == 0
+
+    async def get_async(self, key: str) -> str | None:
+        content = self.memory.get(key)
+        if content is None and self.persistent:
+            async with AsyncSession(async_engine) as session:
+                content = await crud.get_cached_completion_async(
+                    session=session, key=key, max_age=self.max_age
+                )
+            self._record_persistent_lookup(key, content)
+        self._record_lookup(content)
+        return content
+
+    async def set_async(self, key: str, model: str, content: str) -> None:
+        self.memory.set(key, content)
+        if self.persistent:
+            async with AsyncSession(async_engine) as session:
+                await crud.save_cached_completion_async(
+                    session=session,
+                    key=key,
+                    model=model,
+                    content=content,
+                    max_age=self.max_age,
+                )
+
+    def _record_persistent_lookup(self, key: str, content: str | None) -> None:
+        if content is not None:
+            self.memory.set(key, content)
+            metrics.increment("completion_cache.persistent_hits")
+
+    def _record_lookup(self, content: str | None) -> None:
+        if content is None:
+            metrics.increment("completion_cache.misses")
+        else:
+            metrics.increment("completion_cache.hits")
+        hits = metrics.get("completion_cache.hits")
+        metrics.set_gauge(
+            "completion_cache.hit_rate",
+            hits / (hits + metrics.get("completion_cache.misses")),
+        )
+
+
+completion_cache = CompletionCache(
+    models=settings.AI_COMPLETION_CACHE_MODELS,
+    maxsize=settings.AI_COMPLETION_CACHE_SIZE,
+    ttl=settings.AI_COMPLETION_CACHE_TTL_SECONDS,
+    persistent=settings.AI_COMPLETION_CACHE_PERSISTENT,
+)
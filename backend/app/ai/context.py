@@ -0,0 +1,125 @@
+"""
+Fit a conversation into a prompt token budget.
+
+The system prompt and the newest turns are kept, older turns are dropped.
+When a stored conversation summary is available it stands in for the dropped
+prefix, appended to the system prompt. Summaries work the other way round,
+through the oldest turns not folded in yet.
+"""
+
+from collections.abc import Callable, Sequence
+from dataclasses import dataclass
+from functools import lru_cache
+
+from app.core.config import settings
+from app.models import CnvMessage
+
+TokenCounter = Callable[[str], int]
+
+# Role markers and separators the chat format adds around every message
+MESSAGE_OVERHEAD_TOKENS = 4
+
+
+def approximate_token_count(text: str) -> int:
+    """
+    Offline estimate, about four characters per token for GPT tokenizers.
+    """
+    return len(text) // 4 + 1
+
+
+@lru_cache
+def tiktoken_counter(model: str) -> TokenCounter:
+    import tiktoken
+
+    encoding = tiktoken.encoding_for_model(model)
+    return lambda text: len(encoding.encode(text))
+
+
+def get_token_counter(model: str) -> TokenCounter:
+    if settings.AI_CONTEXT_TOKENIZER == "tiktoken":
+        return tiktoken_counter(model)
+    return approximate_token_count
+
+
+@dataclass
+class ContextWindow:
+    system_input: str
+    messages: list[CnvMessage]
+    tokens: int
+    trimmed: int
+
+
+def build_context(
+    *,
+    system_input: str,
+    messages: Sequence[CnvMessage],
+    max_tokens: int,
+    count_tokens: TokenCounter = approximate_token_count,
+    summary: str | None = None,
+    summary_template: str = "{system_input}\n\n{summary}",
+    prefix_dropped: bool = False,
+) -> ContextWindow:
+    """
+    Keep the system prompt and the newest messages that fit in ``max_tokens``.
+
+    If the conversation does not fit and ``summary`` is given, the summary is
+    added to the system prompt through ``summary_template`` to stand in for
+    the dropped prefix. Pass ``prefix_dropped`` when ``messages`` is already
+    only the tail of the conversation. The last message is always kept, even
+    when it alone exceeds the budget.
+    """
+
+    def cost(text: str) -> int:
+        return count_tokens(text) + MESSAGE_OVERHEAD_TOKENS
+
+    message_costs = [cost(message.content) for message in messages]
+    used = cost(system_input) + sum(message_costs)
+    if used <= max_tokens and not (prefix_dropped and summary):
+        return ContextWindow(
+            system_input=system_input, messages=list(messages), tokens=used, trimmed=0
+        )
+    if summary:
+        system_input = summary_template.format(
+            system_input=system_input, summary=summary
+        )
+    used = cost(system_input)
+    kept = 0
+    for message_cost in reversed(message_costs):
+        if kept and used + message_cost > max_tokens:
+            break
+        kept += 1
+        used += message_cost
+    return ContextWindow(
+        system_input=system_input,
+        messages=list(messages[len(messages) - kept :]),
+        tokens=used,
+        trimmed=len(messages) - kept,
+    )
+
+
+def build_oldest_context(
+    *,
+    system_input: str,
+    messages: Sequence[CnvMessage],
+    max_tokens: int,
+    count_tokens: TokenCounter = approximate_token_count,
+) -> ContextWindow:
+    """
+    Keep the system prompt and the oldest messages that fit in ``max_tokens``;
+    ``trimmed`` counts the newer ones left for later. The first message is
+    always kept, even when it alone exceeds the budget.
+    """
+    used = count_tokens(system_input) + MESSAGE_OVERHEAD_TOKENS
+    kept = 0
+    for message in messages:
+        message_cost = count_tokens(message.content) + MESSAGE_OVERHEAD_TOKENS
+        if kept and used + message_cost > max_tokens:
+            break
+        kept += 1
+        used += message_cost
+    return ContextWindow(
+        system_input=system_input,
+        messages=list(messages[:kept]),
+        tokens=used,
+        trimmed=len(messages) - kept,
+    )
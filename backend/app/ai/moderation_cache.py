@@ -0,0 +1,78 @@
+"""
+Cache of moderation verdicts, keyed by a hash of the normalized input.
+
+The in-memory LRU/TTL tier serves repeated prompts within a worker. With
+``AI_MODERATION_CACHE_PERSISTENT`` the verdicts are also stored in Postgres,
+so they survive restarts and are shared between workers.
+"""
+
+import hashlib
+import unicodedata
+from datetime import timedelta
+
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from app import crud
+from app.core import metrics
+from app.core.cache import TTLCache
+from app.core.config import settings
+from app.core.db import async_engine
+
+
+def normalize_text(text: str) -> str:
+    return " ".join(unicodedata.normalize("NFKC", text).casefold().split())
+
+
+def content_hash(text: str) -> str:
+    return hashlib.sha256(normalize_text(text).encode()).hexdigest()
+
+
+class ModerationCache:
+    def __init__(self, *, maxsize: int, ttl: float, persistent: bool) -> None:
+        self.memory: TTLCache[str, bool] = TTLCache(maxsize=maxsize, ttl=ttl)
+        self.max_age = timedelta(seconds=ttl)
+        self.persistent = persistent
+
+    @property
+    def enabled(self) -> bool:
+        return self.memory.maxsize > 0 or self.persistent
+
+    async def get_async(self, key: str) -> bool | None:
+        verdict = self.memory.get(key)
+        if verdict is None and self.persistent:
+            async with AsyncSession(async_engine) as session:
+                verdict = await crud.get_moderation_verdict_async(
+                    session=session, content_hash=key, max_age=self.max_age
+                )
+            self._record_persistent_lookup(key, verdict)
+        self._record_lookup(verdict)
+        return verdict
+
+    async def set_async(self, key: str, flagged: bool) -> None:
+        self.memory.set(key, flagged)
+        if self.persistent:
+            async with AsyncSession(async_engine) as session:
+                await crud.save_moderation_verdict_async(
+                    session=session,
+                    content_hash=key,
+                    flagged=flagged,
+                    max_age=self.max_age,
+                )
+
+    def _record_persistent_lookup(self, key: str, verdict: bool | None) -> None:
+        if verdict is not None:
+            self.memory.set(key, verdict)
+            metrics.increment("moderation_cache.persistent_hits")
+
+    def _record_lookup(self, verdict: bool | None) -> None:
+        if verdict is None:
+            metrics.increment("moderation_cache.misses")
+        else:
+            metrics.increment("moderation_cache.hits")
+
+
+moderation_cache = ModerationCache(
+    maxsize=settings.AI_MODERATION_CACHE_SIZE,
+    ttl=settings.AI_MODERATION_CACHE_TTL_SECONDS,
+    persistent=settings.AI_MODERATION_CACHE_PERSISTENT,
+)
@@ -0,0 +1,197 @@
+"""
+Backends the LLM controller sends moderation and completion requests to.
+
+``AI_PROVIDER`` picks one per process:
+
+- ``openai``: the OpenAI API, or any compatible server at ``OPENAI_BASE_URL``.
+- ``mock``: canned answers in-process, without network or latency.
+- ``stub``: the stub HTTP server from ``app.ai.stub_server``, started in the
+  background with the ``AI_STUB_*`` settings. Requests take the same HTTP
+  path as with OpenAI, so the whole chat flow can be load tested offline
+  with realistic latency, token rate, errors and 429s.
+
+Caching and moderation policy stay in the controller; a provider only
+moves a request to a backend and back.
+"""
+
+import re
+import threading
+from collections.abc import AsyncIterator
+from dataclasses import dataclass
+from typing import Protocol
+
+from openai import NOT_GIVEN, AsyncOpenAI
+from openai.types.chat import (
+    ChatCompletionAssistantMessageParam,
+    ChatCompletionSystemMessageParam,
+    ChatCompletionUserMessageParam,
+)
+
+from app.ai import clients
+from app.ai.stub_server import StubProviderServer
+from app.core.config import settings
+from app.models import CnvMessage
+
+
+@dataclass(frozen=True)
+class CompletionRequest:
+    system_input: str
+    messages: list[CnvMessage]
+    model: str
+    max_tokens: int
+    temperature: float | None = None
+    timeout: float | None = None
+    # Tells mock providers to answer with their summary text
+    summary: bool = False
+
+
+class AsyncProvider(Protocol):
+    async def moderate(self, text: str) -> bool:
+        ...
+
+    async def complete(self, request: CompletionRequest) -> str | None:
+        ...
+
+    def stream(self, request: CompletionRequest) -> AsyncIterator[str]:
+        ...
+
+
+def build_typed_messages(
+    system_input: str, messages_list: list[CnvMessage]
+) -> list[
+    ChatCompletionSystemMessageParam
+    | ChatCompletionUserMessageParam
+    | ChatCompletionAssistantMessageParam
+]:
+    typed_messages: list[
+        ChatCompletionSystemMessageParam
+        | ChatCompletionUserMessageParam
+        | ChatCompletionAssistantMessageParam
+    ] = []
+    for msg in messages_list:
+        if msg.role == "user":
+            typed_messages.append(
+                ChatCompletionUserMessageParam(role="user", content=msg.content)
+            )
+        elif msg.role == "assistant":
+            typed_messages.append(
+                ChatCompletionAssistantMessageParam(
+                    role="assistant", content=msg.content
+                )
+            )
+    system_message = ChatCompletionSystemMessageParam(
+        role="system", content=system_input
+    )
+    typed_messages.insert(0, system_message)
+    return typed_messages
+
+
+class AsyncOpenAIProvider:
+    """
+    Single completions are not retried by the SDK; ``CompletionPolicy`` owns
+    their retries and deadline.
+    """
+
+    def __init__(self, client: AsyncOpenAI) -> None:
+        self.client = client
+        self.completions = client.with_options(max_retries=0).chat.completions
+
+    async def moderate(self, text: str) -> bool:
+        response = await self.client.moderations.create(input=text)
+        return response.results[0].flagged
+
+    async def complete(self, request: CompletionRequest) -> str | None:
+        chat_completion = await self.completions.create(
+            model=request.model,
+            max_tokens=request.max_tokens,
+            messages=build_typed_messages(request.system_input, request.messages),
+            temperature=NOT_GIVEN
+            if request.temperature is None
+            else request.temperature,
+            timeout=NOT_GIVEN if request.timeout is None else request.timeout,
+        )
+        return chat_completion.choices[0].message.content
+
+    async def stream(self, request: CompletionRequest) -> AsyncIterator[str]:
+        stream = await self.client.chat.completions.create(
+            model=request.model,
+            max_tokens=request.max_tokens,
+            messages=build_typed_messages(request.system_input, request.messages),
+            stream=True,
+        )
+        async for chunk in stream:
+            if chunk.choices and chunk.choices[0].delta.content:
+                yield chunk.choices[0].delta.content
+
+
+class AsyncMockProvider:
+    """
+    Answers every completion with ``answer``, or summary requests with
+    ``summary`` when given, cut to ``max_tokens`` words, and flags text
+    containing any of ``flagged_words``.
+    """
+
+    def __init__(
+        self,
+        answer: str,
+        flagged_words: tuple[str, ...] = (),
+        summary: str | None = None,
+    ) -> None:
+        self.answer = answer
+        self.flagged_words = flagged_words
+        self.summary = summary
+
+    def chunks(self, request: CompletionRequest) -> list[str]:
+        text = self.answer
+        if request.summary and self.summary is not None:
+            text = self.summary
+        chunks = re.findall(r"\s*\S+\s*", text) or [text]
+        return chunks[: request.max_tokens]
+
+    async def moderate(self, text: str) -> bool:
+        text = text.lower()
+        return any(word in text for word in self.flagged_words)
+
+    async def complete(self, request: CompletionRequest) -> str | None:
+        return "".join(self.chunks(request))
+
+    async def stream(self, request: CompletionRequest) -> AsyncIterator[str]:
+        for chunk in self.chunks(request):
+            yield chunk
+
+
+_stub_server: StubProviderServer | None = None
+_stub_server_lock = threading.Lock()
+
+
+def get_stub_server() -> StubProviderServer:
+    """
+    Start the in-process stub provider on first use.
+    """
+    global _stub_server
+    if _stub_server is None:
+        with _stub_server_lock:
+            if _stub_server is None:
+                _stub_server = StubProviderServer(
+                    port=settings.AI_STUB_PORT,
+                    answer=settings.AI_STUB_ANSWER,
+                    completion_latency=settings.AI_STUB_COMPLETION_LATENCY,
+                    moderation_latency=settings.AI_STUB_MODERATION_LATENCY,
+                    tokens_per_second=settings.AI_STUB_TOKENS_PER_SECOND,
+                    error_rate=settings.AI_STUB_ERROR_RATE,
+                    rate_limit_rate=settings.AI_STUB_RATE_LIMIT_RATE,
+                    requests_per_minute=settings.AI_STUB_REQUESTS_PER_MINUTE,
+                ).start()
+    return _stub_server
+
+
+def provider_base_url() -> str | None:
+    if settings.AI_PROVIDER == "stub":
+        return get_stub_server().base_url
+    return None
+
+
+def get_async_provider(mock_answer: str, mock_summary: str) -> AsyncProvider:
+    if settings.AI_PROVIDER == "mock":
+        return AsyncMockProvider(mock_answer, summary=mock_summary)
+    return AsyncOpenAIProvider(clients.get_async_openai_client(provider_base_url()))
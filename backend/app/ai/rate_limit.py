@@ -0,0 +1,330 @@
+"""
+Client-side limits on provider calls: requests and tokens per minute, and
+calls in flight.
+
+Every moderation and completion first draws from token buckets (one unit of
+the RPM bucket, and the estimated prompt plus ``max_tokens`` from the TPM
+bucket), then takes an in-flight slot for the duration of the call. A caller
+that would exceed a limit waits rather than fails, up to
+``AI_RATE_LIMIT_WAIT_SECONDS``; past that deadline it gets
+:class:`RateLimitTimeout`, which the API answers with 503 and ``Retry-After``.
+
+``AI_RATE_LIMIT_BACKEND`` keeps the state either in the process (``memory``)
+or in Postgres (``postgres``), where buckets and leases are rows shared by
+every worker, so the limits hold for the deployment as a whole.
+"""
+
+import asyncio
+import threading
+import time
+from collections.abc import AsyncIterator, Sequence
+from contextlib import asynccontextmanager
+from dataclasses import dataclass
+from datetime import timedelta
+from functools import partial
+from itertools import count
+from typing import Protocol
+
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from app import crud
+from app.core import metrics
+from app.core.config import settings
+from app.core.db import async_engine
+from app.models import RateLimitBucket
+
+
+class RateLimitTimeout(Exception):
+    def __init__(self, retry_after: float) -> None:
+        super().__init__(f"Provider rate limit, retry in {retry_after:.1f}s")
+        self.retry_after = retry_after
+
+
+@dataclass(frozen=True)
+class Bucket:
+    """
+    ``per_minute`` units, refilled evenly; up to ``burst_seconds`` worth of
+    them can be spent at once.
+    """
+
+    name: str
+    per_minute: float
+    burst_seconds: float
+
+    @property
+    def rate(self) -> float:
+        return self.per_minute / 60
+
+    @property
+    def capacity(self) -> float:
+        return self.rate * self.burst_seconds
+
+
+class Backend(Protocol):
+    async def acquire_async(
+        self, costs: dict[Bucket, float], name: str, limit: int
+    ) -> tuple[float, int | None]:
+        """
+        Take the costs, and one of ``limit`` slots for ``name`` if the costs
+        are covered right away. Returns how long to wait until they are
+        covered, and the lease when a slot was taken.
+        """
+        ...
+
+    async def refund_async(self, costs: dict[Bucket, float]) -> None:
+        ...
+
+    async def release_async(self, lease: int) -> None:
+        ...
+
+
+class MemoryBackend:
+    """
+    Buckets and slots of this process only.
+    """
+
+    def __init__(self) -> None:
+        self.tokens: dict[str, tuple[float, float]] = {}
+        self.leases: dict[int, str] = {}
+        self._ids = count(1)
+        self._lock = threading.Lock()
+
+    async def acquire_async(
+        self, costs: dict[Bucket, float], name: str, limit: int
+    ) -> tuple[float, int | None]:
+        wait = 0.0
+        now = time.monotonic()
+        with self._lock:
+            for bucket, cost in costs.items():
+                tokens, updated = self.tokens.get(bucket.name, (bucket.capacity, now))
+                tokens = min(bucket.capacity, tokens + (now - updated) * bucket.rate)
+                tokens -= cost
+                self.tokens[bucket.name] = (tokens, now)
+                wait = max(wait, -tokens / bucket.rate)
+            if wait > 0 or sum(held == name for held in self.leases.values()) >= limit:
+                return wait, None
+            lease = next(self._ids)
+            self.leases[lease] = name
+            return wait, lease
+
+    async def refund_async(self, costs: dict[Bucket, float]) -> None:
+        with self._lock:
+            for bucket, cost in costs.items():
+                tokens, updated = self.tokens[bucket.name]
+                self.tokens[bucket.name] = (tokens + cost, updated)
+
+    async def release_async(self, lease: int) -> None:
+        with self._lock:
+            self.leases.pop(lease, None)
+
+
+class PostgresBackend:
+    """
+    Buckets and slots shared by every process using the database.
+
+    Time is taken from the database clock, so hosts with drifting clocks
+    still refill the same bucket at the same rate.
+    """
+
+    def __init__(self, lease_ttl: timedelta) -> None:
+        self.lease_ttl = lease_ttl
+
+    @staticmethod
+    def _buckets(costs: dict[Bucket, float]) -> list[RateLimitBucket]:
+        return [
+            RateLimitBucket(
+                name=bucket.name,
+                capacity=bucket.capacity,
+                rate=bucket.rate,
+                tokens=bucket.capacity - cost,
+            )
+            for bucket, cost in costs.items()
+        ]
+
+    @staticmethod
+    def _wait(buckets: Sequence[RateLimitBucket]) -> float:
+        return max([0.0] + [-bucket.tokens / bucket.rate for bucket in buckets])
+
+    @staticmethod
+    def _by_name(costs: dict[Bucket, float]) -> dict[str, float]:
+        return {bucket.name: cost for bucket, cost in costs.items()}
+
+    async def acquire_async(
+        self, costs: dict[Bucket, float], name: str, limit: int
+    ) -> tuple[float, int | None]:
+        async with AsyncSession(async_engine, expire_on_commit=False) as session:
+            buckets, lease = await crud.acquire_rate_limit_async(
+                session=session,
+                buckets=self._buckets(costs),
+                name=name,
+                limit=limit,
+                ttl=self.lease_ttl,
+            )
+        return self._wait(buckets), lease
+
+    async def refund_async(self, costs: dict[Bucket, float]) -> None:
+        async with AsyncSession(async_engine) as session:
+            await crud.refund_rate_limit_tokens_async(
+                session=session, costs=self._by_name(costs)
+            )
+
+    async def release_async(self, lease: int) -> None:
+        async with AsyncSession(async_engine) as session:
+            await crud.release_rate_limit_lease_async(session=session, lease_id=lease)
+
+
+class ProviderLimiter:
+    """
+    Token buckets plus a pool of in-flight slots, entered with
+    :meth:`limit_async`.
+
+    Limiters that name the same ``pool`` share its ``max_in_flight`` slots.
+    Without a backend every call goes straight through.
+    """
+
+    poll_interval = 0.01
+    max_poll_interval = 0.25
+
+    def __init__(
+        self,
+        *,
+        backend: Backend | None,
+        buckets: Sequence[Bucket],
+        pool: str,
+        max_in_flight: int,
+        max_wait: float,
+    ) -> None:
+        self.backend = backend
+        self.buckets = buckets
+        self.pool = pool
+        self.max_in_flight = max_in_flight
+        self.max_wait = max_wait
+        self._releases: set[asyncio.Future[None]] = set()
+
+    def _costs(self, costs: Sequence[float]) -> dict[Bucket, float]:
+        return {
+            bucket: cost
+            for bucket, cost in zip(self.buckets, costs, strict=True)
+            if bucket.per_minute > 0
+        }
+
+    def _record_wait(self, started: float) -> None:
+        waited = time.monotonic() - started
+        if waited > 0.001:
+            metrics.increment("rate_limit.waits")
+            metrics.increment("rate_limit.wait_seconds", waited)
+
+    def _timeout(self, retry_after: float) -> RateLimitTimeout:
+        metrics.increment("rate_limit.timeouts")
+        return RateLimitTimeout(retry_after)
+
+    async def _acquire(
+        self, backend: Backend, costs: dict[Bucket, float]
+    ) -> tuple[float, int | None]:
+        """
+        Ask the backend for ``costs`` and a slot. Cancelling the caller does
+        not cancel the request, which may already have committed a lease;
+        once it finishes, that lease is given back.
+        """
+        request = asyncio.ensure_future(
+            backend.acquire_async(costs, self.pool, self.max_in_flight)
+        )
+        try:
+            return await asyncio.shield(request)
+        except asyncio.CancelledError:
+            request.add_done_callback(partial(self._give_back, backend))
+            raise
+
+    def _give_back(
+        self, backend: Backend, request: "asyncio.Future[tuple[float, int | None]]"
+    ) -> None:
+        if request.cancelled() or request.exception() is not None:
+            return
+        _, lease = request.result()
+        if lease is not None:
+            release = asyncio.ensure_future(backend.release_async(lease))
+            self._releases.add(release)
+            release.add_done_callback(self._releases.discard)
+
+    @asynccontextmanager
+    async def limit_async(self, *costs: float) -> AsyncIterator[None]:
+        """
+        Hold a slot for the body, after paying ``costs``, one per bucket.
+
+        When nothing is owed and a slot is free, that takes one round trip to
+        the backend, and giving the slot back another.
+        """
+        backend = self.backend
+        if backend is None:
+            yield
+            return
+        started = time.monotonic()
+        deadline = started + self.max_wait
+        spent = self._costs(costs)
+        wait, lease = await self._acquire(backend, spent)
+        if lease is None:
+            if started + wait > deadline:
+                await backend.refund_async(spent)
+                raise self._timeout(wait)
+            if wait > 0:
+                await asyncio.sleep(wait)
+            interval = self.poll_interval
+            while (lease := (await self._acquire(backend, {}))[1]) is None:
+                if time.monotonic() + interval > deadline:
+                    await backend.refund_async(spent)
+                    raise self._timeout(interval)
+                await asyncio.sleep(interval)
+                interval = min(interval * 2, self.max_poll_interval)
+        self._record_wait(started)
+        try:
+            yield
+        finally:
+            # Shielded, so a call cancelled by a hedge, a timeout or a
+            # discarded moderation still frees its slot right away
+            await asyncio.shield(backend.release_async(lease))
+
+
+def get_backend() -> Backend | None:
+    if settings.AI_RATE_LIMIT_BACKEND == "memory":
+        return MemoryBackend()
+    if settings.AI_RATE_LIMIT_BACKEND == "postgres":
+        return PostgresBackend(
+            lease_ttl=timedelta(seconds=settings.AI_RATE_LIMIT_LEASE_SECONDS)
+        )
+    return None
+
+
+_backend = get_backend()
+
+completion_limiter = ProviderLimiter(
+    backend=_backend,
+    buckets=[
+        Bucket(
+            "completion:rpm",
+            settings.AI_RATE_LIMIT_COMPLETION_RPM,
+            settings.AI_RATE_LIMIT_BURST_SECONDS,
+        ),
+        Bucket(
+            "completion:tpm",
+            settings.AI_RATE_LIMIT_COMPLETION_TPM,
+            settings.AI_RATE_LIMIT_BURST_SECONDS,
+        ),
+    ],
+    pool="provider",
+    max_in_flight=settings.AI_RATE_LIMIT_MAX_IN_FLIGHT,
+    max_wait=settings.AI_RATE_LIMIT_WAIT_SECONDS,
+)
+
+moderation_limiter = ProviderLimiter(
+    backend=_backend,
+    buckets=[
+        Bucket(
+            "moderation:rpm",
+            settings.AI_RATE_LIMIT_MODERATION_RPM,
+            settings.AI_RATE_LIMIT_BURST_SECONDS,
+        )
+    ],
+    pool="provider",
+    max_in_flight=settings.AI_RATE_LIMIT_MAX_IN_FLIGHT,
+    max_wait=settings.AI_RATE_LIMIT_WAIT_SECONDS,
+)
@@ -0,0 +1,349 @@
+"""
+Deadlines, retries, hedging and a circuit breaker for completion calls.
+
+A completion gets ``AI_COMPLETION_TIMEOUT_SECONDS`` of provider time in
+total; waiting for the client-side rate limiter is not counted. Timeouts,
+connection errors, 429s and 5xx are retried with jittered exponential
+backoff, honouring ``Retry-After``, while the deadline allows. With
+``AI_COMPLETION_HEDGE_PERCENTILE`` set, an attempt still running past that
+percentile of recent latencies gets a second request in parallel, and the
+first answer wins.
+
+Every attempt reports to a per-process circuit breaker, and moderation calls
+to one of their own. After ``AI_CIRCUIT_FAILURE_THRESHOLD`` failures in a
+row a breaker opens, and calls fail fast with :class:`ProviderUnavailable`
+for ``AI_CIRCUIT_RESET_SECONDS``. Then a single trial call decides whether
+it closes again. The chat flow turns ``ProviderUnavailable`` into a cached
+or static answer.
+"""
+
+import asyncio
+import random
+import threading
+import time
+from collections import deque
+from collections.abc import Awaitable, Callable, Iterator
+from contextlib import AbstractAsyncContextManager, contextmanager, nullcontext
+from typing import Any, Literal, TypeVar
+
+import openai
+
+from app.core import metrics
+from app.core.config import settings
+
+T = TypeVar("T")
+
+# Before Python 3.11, asyncio.wait_for raises asyncio.TimeoutError, which is
+# not the builtin TimeoutError
+TIMEOUT_ERRORS = (TimeoutError, asyncio.TimeoutError, openai.APITimeoutError)
+
+RETRYABLE_ERRORS = (
+    openai.APIConnectionError,
+    openai.RateLimitError,
+    openai.InternalServerError,
+    TimeoutError,
+    asyncio.TimeoutError,
+)
+
+CIRCUIT_STATES = {"closed": 0, "half_open": 1, "open": 2}
+
+
+class ProviderUnavailable(Exception):
+    pass
+
+
+class CircuitBreaker:
+    def __init__(
+        self,
+        *,
+        failure_threshold: int,
+        reset_timeout: float,
+        clock: Callable[[], float] = time.monotonic,
+        metrics_prefix: str = "circuit",
+    ) -> None:
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.clock = clock
+        self.metrics_prefix = metrics_prefix
+        self.state: Literal["closed", "half_open", "open"] = "closed"
+        self.failures = 0
+        self.opened_at = 0.0
+        self._trial = False
+        self._lock = threading.Lock()
+
+    def _set_state(self, state: Literal["closed", "half_open", "open"]) -> None:
+        self.state = state
+        metrics.set_gauge(f"{self.metrics_prefix}.state", CIRCUIT_STATES[state])
+
+    def allow(self) -> bool:
+        """
+        Whether a call may go out now. In half-open state only one may.
+        """
+        with self._lock:
+            if (
+                self.state == "open"
+                and self.clock() - self.opened_at >= self.reset_timeout
+            ):
+                self._set_state("half_open")
+                self._trial = False
+            if self.state == "closed":
+                return True
+            if self.state == "half_open" and not self._trial:
+                self._trial = True
+                return True
+        metrics.increment(f"{self.metrics_prefix}.short_circuited")
+        return False
+
+    def record_success(self) -> None:
+        with self._lock:
+            self.failures = 0
+            self._trial = False
+            if self.state != "closed":
+                self._set_state("closed")
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self.failures += 1
+            self._trial = False
+            if self.state == "half_open" or (
+                self.state == "closed" and self.failures >= self.failure_threshold
+            ):
+                self._set_state("open")
+                self.opened_at = self.clock()
+                metrics.increment(f"{self.metrics_prefix}.opened")
+
+    def retry_after(self) -> float:
+        """
+        Seconds until an open breaker lets a trial call through.
+        """
+        with self._lock:
+            if self.state != "open":
+                return 0.0
+            return max(0.0, self.opened_at + self.reset_timeout - self.clock())
+
+    def release(self) -> None:
+        """
+        End a call that says nothing about provider health.
+        """
+        with self._lock:
+            self._trial = False
+
+    @contextmanager
+    def guard(self) -> Iterator[None]:
+        """
+        Run one call under the breaker, for calls that are not retried, such
+        as streams.
+        """
+        if not self.allow():
+            raise ProviderUnavailable("Circuit open")
+        try:
+            yield
+        except RETRYABLE_ERRORS as e:
+            self.record_failure()
+            raise ProviderUnavailable(repr(e)) from e
+        except BaseException:
+            self.release()
+            raise
+        self.record_success()
+
+
+class LatencyWindow:
+    """
+    Latencies of the last ``size`` successful attempts.
+    """
+
+    def __init__(self, size: int = 200) -> None:
+        self.samples: deque[float] = deque(maxlen=size)
+        self._lock = threading.Lock()
+
+    def add(self, seconds: float) -> None:
+        with self._lock:
+            self.samples.append(seconds)
+
+    def percentile(self, percentile: float, min_samples: int) -> float | None:
+        with self._lock:
+            if len(self.samples) < max(min_samples, 1):
+                return None
+            ordered = sorted(self.samples)
+        index = min(int(len(ordered) * percentile / 100), len(ordered) - 1)
+        return ordered[index]
+
+
+def retry_after(error: Exception) -> float | None:
+    if not isinstance(error, openai.RateLimitError):
+        return None
+    try:
+        return float(error.response.headers.get("retry-after", ""))
+    except ValueError:
+        return None
+
+
+def discard_task(task: "asyncio.Future[Any]") -> None:
+    """
+    Cancel a task whose result is no longer needed, without leaving an
+    unretrieved exception behind.
+    """
+    task.cancel()
+    task.add_done_callback(lambda done: done.cancelled() or done.exception())
+
+
+class CompletionPolicy:
+    def __init__(
+        self,
+        *,
+        breaker: CircuitBreaker,
+        timeout: float,
+        max_attempts: int,
+        retry_base: float,
+        retry_max: float,
+        hedge_percentile: float | None = None,
+        hedge_min_samples: int = 20,
+    ) -> None:
+        self.breaker = breaker
+        self.timeout = timeout
+        self.max_attempts = max_attempts
+        self.retry_base = retry_base
+        self.retry_max = retry_max
+        self.hedge_percentile = hedge_percentile
+        self.hedge_min_samples = hedge_min_samples
+        self.latencies = LatencyWindow()
+
+    def retry_delay(self, attempt: int, error: Exception) -> float:
+        delay = retry_after(error)
+        if delay is None:
+            delay = min(self.retry_base * 2.0 ** (attempt - 1), self.retry_max)
+            delay *= random.uniform(0.5, 1.0)
+        return delay
+
+    def hedge_delay(self) -> float | None:
+        if self.hedge_percentile is None:
+            return None
+        return self.latencies.percentile(self.hedge_percentile, self.hedge_min_samples)
+
+    async def run_async(
+        self,
+        attempt: Callable[[float], Awaitable[T]],
+        admit: Callable[[], AbstractAsyncContextManager[Any]] = nullcontext,
+    ) -> T:
+        """
+        Call ``attempt(seconds_left)`` until it succeeds or the policy gives up.
+
+        Each request to the provider first enters ``admit()``, the client-side
+        rate limiter. Time spent queued there is not provider time, so it does
+        not count against the deadline. A limiter that gives up is not a
+        provider failure either: its error propagates without touching the
+        breaker.
+        """
+        deadline = time.monotonic() + self.timeout
+        error: Exception | None = None
+        for number in range(1, self.max_attempts + 1):
+            if deadline - time.monotonic() <= 0:
+                break
+            if not self.breaker.allow():
+                raise ProviderUnavailable("Circuit open") from error
+            try:
+                queued = time.monotonic()
+                async with admit():
+                    deadline += time.monotonic() - queued
+                    metrics.increment("completion.attempts")
+                    started = time.monotonic()
+                    result = await self._hedged(attempt, deadline - started, admit)
+            except RETRYABLE_ERRORS as e:
+                error = e
+                self._record_failure(e)
+                delay = self.retry_delay(number, e)
+                if number == self.max_attempts or time.monotonic() + delay >= deadline:
+                    break
+                metrics.increment("completion.retries")
+                await asyncio.sleep(delay)
+                continue
+            except BaseException:
+                self.breaker.release()
+                raise
+            self._record_success(time.monotonic() - started)
+            return result
+        metrics.increment("completion.failures")
+        raise ProviderUnavailable(repr(error)) from error
+
+    async def _hedged(
+        self,
+        attempt: Callable[[float], Awaitable[T]],
+        remaining: float,
+        admit: Callable[[], AbstractAsyncContextManager[Any]],
+    ) -> T:
+        """
+        One admitted attempt, backed by a second request once the first runs
+        longer than the hedge percentile. Returns the first success.
+        """
+        first = asyncio.ensure_future(asyncio.wait_for(attempt(remaining), remaining))
+        delay = self.hedge_delay()
+        if delay is None or delay >= remaining:
+            return await first
+        pending: set[asyncio.Future[T]] = {first}
+        try:
+            done, pending = await asyncio.wait(pending, timeout=delay)
+            if done:
+                return first.result()
+            metrics.increment("completion.hedges")
+            second = asyncio.ensure_future(
+                self._admitted(attempt, remaining - delay, admit)
+            )
+            pending.add(second)
+            error: BaseException | None = None
+            while pending:
+                done, pending = await asyncio.wait(
+                    pending, return_when=asyncio.FIRST_COMPLETED
+                )
+                for task in done:
+                    error = task.exception()
+                    if error is None:
+                        if task is second:
+                            metrics.increment("completion.hedge_wins")
+                        return task.result()
+            assert error is not None
+            raise error
+        finally:
+            for task in pending:
+                discard_task(task)
+
+    @staticmethod
+    async def _admitted(
+        attempt: Callable[[float], Awaitable[T]],
+        timeout: float,
+        admit: Callable[[], AbstractAsyncContextManager[Any]],
+    ) -> T:
+        async with admit():
+            return await asyncio.wait_for(attempt(timeout), timeout)
+
+    def _record_success(self, seconds: float) -> None:
+        self.breaker.record_success()
+        self.latencies.add(seconds)
+
+    def _record_failure(self, error: Exception) -> None:
+        self.breaker.record_failure()
+        if isinstance(error, TIMEOUT_ERRORS):
+            metrics.increment("completion.timeouts")
+
+
+breaker = CircuitBreaker(
+    failure_threshold=settings.AI_CIRCUIT_FAILURE_THRESHOLD,
+    reset_timeout=settings.AI_CIRCUIT_RESET_SECONDS,
+)
+
+# Moderation is a separate endpoint, so its failures neither open nor are
+# blocked by the completion breaker
+moderation_breaker = CircuitBreaker(
+    failure_threshold=settings.AI_CIRCUIT_FAILURE_THRESHOLD,
+    reset_timeout=settings.AI_CIRCUIT_RESET_SECONDS,
+    metrics_prefix="moderation_circuit",
+)
+
+completion_policy = CompletionPolicy(
+    breaker=breaker,
+    timeout=settings.AI_COMPLETION_TIMEOUT_SECONDS,
+    max_attempts=settings.AI_COMPLETION_MAX_ATTEMPTS,
+    retry_base=settings.AI_COMPLETION_RETRY_BASE_SECONDS,
+    retry_max=settings.AI_COMPLETION_RETRY_MAX_SECONDS,
+    hedge_percentile=settings.AI_COMPLETION_HEDGE_PERCENTILE,
+    hedge_min_samples=settings.AI_COMPLETION_HEDGE_MIN_SAMPLES,
+)
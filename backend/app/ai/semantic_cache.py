@@ -0,0 +1,176 @@
+"""
+Answer cache for first-turn questions that are worded differently but mean the
+same thing.
+
+Questions are embedded into unit vectors, and a cached answer is returned
+when the closest stored question scores at least ``threshold`` in cosine
+similarity. The embedder and the index are pluggable. The defaults are a
+deterministic hashing embedder that needs no model or network, and a NumPy
+brute-force index. An approximate nearest-neighbour index can replace it
+behind the same ``VectorIndex`` interface.
+"""
+
+import hashlib
+import re
+import threading
+from collections import OrderedDict
+from collections.abc import Callable, Sequence
+from typing import Protocol
+
+import numpy as np
+import numpy.typing as npt
+
+from app.ai.moderation_cache import normalize_text
+from app.core import metrics
+from app.core.config import settings
+from app.models import CnvMessage
+
+Vector = npt.NDArray[np.float32]
+
+
+class Embedder(Protocol):
+    dimensions: int
+
+    def embed(self, text: str) -> Vector:
+        ...
+
+
+class VectorIndex(Protocol):
+    def add(self, vector: Vector, value: str) -> None:
+        ...
+
+    def search(self, vector: Vector) -> tuple[float, str] | None:
+        ...
+
+
+class HashingEmbedder:
+    """
+    Bag of words and character trigrams, hashed into a fixed-size vector.
+
+    Trigrams make inflected forms such as "listy" and "listach" land close to
+    each other, which matters for Polish questions.
+    """
+
+    def __init__(self, dimensions: int = 512) -> None:
+        self.dimensions = dimensions
+
+    def features(self, text: str) -> list[str]:
+        words = re.findall(r"\w+", normalize_text(text))
+        features = [f"w:{word}" for word in words]
+        for word in words:
+            padded = f"<{word}>"
+            features.extend(f"c:{padded[i:i + 3]}" for i in range(len(padded) - 2))
+        return features
+
+    def embed(self, text: str) -> Vector:
+        vector = np.zeros(self.dimensions, dtype=np.float32)
+        for feature in self.features(text):
+            digest = hashlib.blake2b(feature.encode(), digest_size=8).digest()
+            bucket = int.from_bytes(digest[:4], "little") % self.dimensions
+            vector[bucket] += 1.0 if digest[4] & 1 else -1.0
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+
+class BruteForceIndex:
+    """
+    Exact search over a fixed-capacity matrix; the oldest entry is replaced
+    once it is full.
+    """
+
+    def __init__(self, dimensions: int, capacity: int) -> None:
+        self.vectors = np.zeros((capacity, dimensions), dtype=np.float32)
+        self.values: list[str] = []
+        self.capacity = capacity
+        self._next = 0
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self.values)
+
+    def add(self, vector: Vector, value: str) -> None:
+        with self._lock:
+            if len(self.values) < self.capacity:
+                self.values.append(value)
+            else:
+                self.values[self._next] = value
+            self.vectors[self._next] = vector
+            self._next = (self._next + 1) % self.capacity
+
+    def search(self, vector: Vector) -> tuple[float, str] | None:
+        with self._lock:
+            if not self.values:
+                return None
+            scores = self.vectors[: len(self.values)] @ vector
+            best = int(np.argmax(scores))
+            return float(scores[best]), self.values[best]
+
+
+class SemanticCache:
+    """
+    One index per scope, e.g. per system prompt, so answers given under
+    different instructions are never mixed. Only the ``max_scopes`` most
+    recently used indexes are kept.
+    """
+
+    def __init__(
+        self,
+        *,
+        embedder: Embedder,
+        index_factory: Callable[[], VectorIndex],
+        threshold: float,
+        enabled: bool = True,
+        max_scopes: int = 16,
+    ) -> None:
+        self.embedder = embedder
+        self.index_factory = index_factory
+        self.threshold = threshold
+        self.enabled = enabled
+        self.max_scopes = max_scopes
+        self.indexes: OrderedDict[str, VectorIndex] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _index(self, scope: str) -> VectorIndex:
+        with self._lock:
+            if scope not in self.indexes:
+                self.indexes[scope] = self.index_factory()
+                while len(self.indexes) > self.max_scopes:
+                    self.indexes.popitem(last=False)
+            self.indexes.move_to_end(scope)
+            return self.indexes[scope]
+
+    def lookup(self, question: str, *, scope: str) -> str | None:
+        match = self._index(scope).search(self.embedder.embed(question))
+        if match is None or match[0] < self.threshold:
+            metrics.increment("semantic_cache.misses")
+            return None
+        metrics.increment("semantic_cache.hits")
+        return match[1]
+
+    def store(self, question: str, answer: str, *, scope: str) -> None:
+        self._index(scope).add(self.embedder.embed(question), answer)
+
+
+def first_question(
+    messages: Sequence[CnvMessage], *, summary: str | None = None
+) -> str | None:
+    """
+    The question of a first turn, or None when there is earlier history.
+
+    Pass the messages as loaded, not the context trimmed to the prompt
+    budget, which may hold only the last one. A summary means earlier
+    history too.
+    """
+    if summary is None and len(messages) == 1 and messages[0].role == "user":
+        return messages[0].content
+    return None
+
+
+semantic_cache = SemanticCache(
+    embedder=HashingEmbedder(settings.AI_SEMANTIC_CACHE_DIMENSIONS),
+    index_factory=lambda: BruteForceIndex(
+        settings.AI_SEMANTIC_CACHE_DIMENSIONS, settings.AI_SEMANTIC_CACHE_SIZE
+    ),
+    threshold=settings.AI_SEMANTIC_CACHE_THRESHOLD,
+    enabled=settings.AI_SEMANTIC_CACHE_ENABLED,
+)
@@ -0,0 +1,380 @@
+"""
+Local stand-in for the OpenAI HTTP API.
+
+It answers ``/moderations`` and ``/chat/completions`` with canned payloads so
+the provider path (HTTP pool, SDK, parsing) can be exercised in tests and
+benchmarks without network access.
+
+To look like a real provider under load it can also sample latencies from a
+distribution, emit completion tokens at a fixed rate, fail a share of
+requests with 500s, and answer 429 with ``Retry-After`` either at random or
+once a requests-per-minute budget runs out. Run it standalone with
+``python -m app.ai.stub_server --help``.
+"""
+
+import argparse
+import json
+import math
+import random
+import sys
+import threading
+import time
+from dataclasses import dataclass
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from types import TracebackType
+from typing import Any, Literal
+
+
+@dataclass(frozen=True)
+class Latency:
+    """
+    Delay distribution in seconds.
+
+    ``fixed`` always waits ``value``; ``uniform`` draws from
+    ``[value, spread]``; ``lognormal`` has median ``value`` and shape
+    ``spread``, which gives the long tail real providers show.
+    """
+
+    kind: Literal["fixed", "uniform", "lognormal"] = "fixed"
+    value: float = 0.0
+    spread: float = 0.0
+
+    def __post_init__(self) -> None:
+        if self.kind == "lognormal" and self.value <= 0:
+            raise ValueError(f"Lognormal latency needs a positive median: {self}")
+
+    @classmethod
+    def parse(cls, spec: "str | float | Latency") -> "Latency":
+        """
+        Accept ``0.2``, ``"fixed:0.2"``, ``"uniform:0.1,0.5"`` or
+        ``"lognormal:0.3,0.6"``.
+        """
+        if isinstance(spec, Latency):
+            return spec
+        if isinstance(spec, int | float):
+            return cls(value=float(spec))
+        kind, _, args = spec.partition(":")
+        if not args:
+            return cls(value=float(kind))
+        if kind not in ("fixed", "uniform", "lognormal"):
+            raise ValueError(f"Unknown latency distribution {kind!r}")
+        values = [float(arg) for arg in args.split(",")]
+        return cls(kind, *values)  # type: ignore[arg-type]
+
+    def sample(self, rng: random.Random) -> float:
+        if self.kind == "uniform":
+            return rng.uniform(self.value, self.spread)
+        if self.kind == "lognormal":
+            return rng.lognormvariate(math.log(self.value), self.spread)
+        return self.value
+
+
+class StubProviderHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+    server: "_StubHTTPServer"
+
+    def setup(self) -> None:
+        super().setup()
+        self.server.stub.record_connection()
+
+    def log_message(self, format: str, *args: Any) -> None:
+        pass
+
+    def do_POST(self) -> None:
+        length = int(self.headers.get("Content-Length", 0))
+        body = json.loads(self.rfile.read(length) or b"{}")
+        stub = self.server.stub
+        stub.record_request()
+        if not self.path.endswith(("/moderations", "/chat/completions")):
+            self._send_json({"error": {"message": "Not found"}}, status=404)
+            return
+        retry_after = stub.rate_limit()
+        if retry_after is not None:
+            self._send_json(
+                {
+                    "error": {
+                        "message": "Rate limit reached",
+                        "type": "requests",
+                        "code": "rate_limit_exceeded",
+                    }
+                },
+                status=429,
+                headers={"Retry-After": f"{retry_after:.3f}"},
+            )
+            return
+        if stub.should_fail():
+            self._send_json(
+                {"error": {"message": "Injected failure", "type": "server_error"}},
+                status=500,
+            )
+            return
+        if self.path.endswith("/moderations"):
+            time.sleep(stub.sample(stub.moderation_latency))
+            self._send_json(stub.moderation_payload(body))
+        elif body.get("stream"):
+            time.sleep(stub.sample(stub.completion_latency))
+            self._send_event_stream(stub.completion_chunks(body))
+        else:
+            payload = stub.completion_payload(body)
+            tokens = payload["usage"]["completion_tokens"]
+            time.sleep(stub.sample(stub.completion_latency) + stub.token_time(tokens))
+            self._send_json(payload)
+
+    def _send_json(
+        self,
+        payload: dict[str, Any],
+        status: int = 200,
+        headers: dict[str, str] | None = None,
+    ) -> None:
+        data = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _send_event_stream(self, events: list[dict[str, Any]]) -> None:
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        lines = [f"data: {json.dumps(event)}\n\n" for event in events]
+        lines.append("data: [DONE]\n\n")
+        token_time = self.server.stub.token_time(1)
+        for i, line in enumerate(lines):
+            if i and token_time:
+                time.sleep(token_time)
+            data = line.encode()
+            self.wfile.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+            self.wfile.flush()
+        self.wfile.write(b"0\r\n\r\n")
+
+
+class _StubHTTPServer(ThreadingHTTPServer):
+    daemon_threads = True
+    stub: "StubProviderServer"
+
+    def handle_error(self, request: Any, client_address: Any) -> None:
+        # Clients hang up on purpose, e.g. when a completion gets cancelled
+        if isinstance(sys.exc_info()[1], ConnectionError):
+            return
+        super().handle_error(request, client_address)
+
+
+class StubProviderServer:
+    """
+    ``tokens_per_second`` of 0 sends the whole answer at once.
+    ``error_rate`` and ``rate_limit_rate`` are the shares of requests answered
+    with 500 and 429. ``requests_per_minute`` also answers 429 once the
+    budget is spent, refilling it evenly over the minute.
+    """
+
+    def __init__(
+        self,
+        *,
+        host: str = "127.0.0.1",
+        port: int = 0,
+        answer: str = "Stub answer",
+        completion_latency: float | str | Latency = 0.0,
+        moderation_latency: float | str | Latency = 0.0,
+        tokens_per_second: float = 0.0,
+        error_rate: float = 0.0,
+        rate_limit_rate: float = 0.0,
+        requests_per_minute: int | None = None,
+        flagged_words: tuple[str, ...] = ("unsafe",),
+        seed: int | None = None,
+    ) -> None:
+        self.answer = answer
+        self.completion_latency = Latency.parse(completion_latency)
+        self.moderation_latency = Latency.parse(moderation_latency)
+        self.tokens_per_second = tokens_per_second
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.requests_per_minute = requests_per_minute
+        self.flagged_words = flagged_words
+        self.connections = 0
+        self.requests = 0
+        self.failed = 0
+        self.rate_limited = 0
+        self._counter_lock = threading.Lock()
+        self._rng = random.Random(seed)
+        self._budget = float(requests_per_minute or 0)
+        self._budget_updated = time.monotonic()
+        self._httpd = _StubHTTPServer((host, port), StubProviderHandler)
+        self._httpd.stub = self
+        self._thread: threading.Thread | None = None
+
+    @property
+    def base_url(self) -> str:
+        host, port = self._httpd.server_address[:2]
+        return f"http://{host!s}:{port}/v1"
+
+    def record_connection(self) -> None:
+        with self._counter_lock:
+            self.connections += 1
+
+    def record_request(self) -> None:
+        with self._counter_lock:
+            self.requests += 1
+
+    def sample(self, latency: Latency) -> float:
+        with self._counter_lock:
+            return max(latency.sample(self._rng), 0.0)
+
+    def token_time(self, tokens: int) -> float:
+        return tokens / self.tokens_per_second if self.tokens_per_second else 0.0
+
+    def rate_limit(self) -> float | None:
+        """
+        Seconds the client should wait, or None when the request may go on.
+        """
+        with self._counter_lock:
+            retry_after = None
+            if self.requests_per_minute:
+                now = time.monotonic()
+                refill = (now - self._budget_updated) * self.requests_per_minute / 60
+                self._budget = min(self._budget + refill, self.requests_per_minute)
+                self._budget_updated = now
+                if self._budget >= 1:
+                    self._budget -= 1
+                else:
+                    retry_after = (1 - self._budget) * 60 / self.requests_per_minute
+            if retry_after is None and self._rng.random() < self.rate_limit_rate:
+                retry_after = 1.0
+            if retry_after is not None:
+                self.rate_limited += 1
+            return retry_after
+
+    def should_fail(self) -> bool:
+        with self._counter_lock:
+            if self._rng.random() < self.error_rate:
+                self.failed += 1
+                return True
+            return False
+
+    def answer_words(self, body: dict[str, Any]) -> list[str]:
+        """
+        The answer split into word tokens, cut at ``max_tokens`` like a real
+        provider would.
+        """
+        words = self.answer.split(" ")
+        pieces = [word + " " for word in words[:-1]] + words[-1:]
+        max_tokens = body.get("max_tokens")
+        return pieces[:max_tokens] if max_tokens else pieces
+
+    def moderation_payload(self, body: dict[str, Any]) -> dict[str, Any]:
+        text = str(body.get("input", "")).lower()
+        flagged = any(word in text for word in self.flagged_words)
+        return {
+            "id": "modr-stub",
+            "model": "text-moderation-stub",
+            "results": [{"flagged": flagged, "categories": {}, "category_scores": {}}],
+        }
+
+    def completion_payload(self, body: dict[str, Any]) -> dict[str, Any]:
+        pieces = self.answer_words(body)
+        return {
+            "id": "chatcmpl-stub",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": body.get("model", "stub"),
+            "choices": [
+                {
+                    "index": 0,
+                    "finish_reason": "stop",
+                    "message": {"role": "assistant", "content": "".join(pieces)},
+                }
+            ],
+            "usage": {
+                "prompt_tokens": 0,
+                "completion_tokens": len(pieces),
+                "total_tokens": len(pieces),
+            },
+        }
+
+    def completion_chunks(self, body: dict[str, Any]) -> list[dict[str, Any]]:
+        return [
+            {
+                "id": "chatcmpl-stub",
+                "object": "chat.completion.chunk",
+                "created": int(time.time()),
+                "model": body.get("model", "stub"),
+                "choices": [
+                    {
+                        "index": 0,
+                        "finish_reason": None,
+                        "delta": {"role": "assistant", "content": piece},
+                    }
+                ],
+            }
+            for piece in self.answer_words(body)
+        ]
+
+    def start(self) -> "StubProviderServer":
+        self._thread = threading.Thread(
+            target=self._httpd.serve_forever, name="stub-provider", daemon=True
+        )
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._httpd.shutdown()
+        self._httpd.server_close()
+        if self._thread is not None:
+            self._thread.join()
+
+    def __enter__(self) -> "StubProviderServer":
+        return self.start()
+
+    def __exit__(
+        self,
+        exc_type: type[BaseException] | None,
+        exc: BaseException | None,
+        tb: TracebackType | None,
+    ) -> None:
+        self.stop()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8091)
+    parser.add_argument("--answer", default="Stub answer")
+    parser.add_argument(
+        "--completion-latency", default="0", help="e.g. 0.5 or lognormal:0.8,0.5"
+    )
+    parser.add_argument("--moderation-latency", default="0")
+    parser.add_argument("--tokens-per-second", type=float, default=0.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0)
+    parser.add_argument("--requests-per-minute", type=int, default=None)
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args()
+
+    server = StubProviderServer(
+        host=args.host,
+        port=args.port,
+        answer=args.answer,
+        completion_latency=args.completion_latency,
+        moderation_latency=args.moderation_latency,
+        tokens_per_second=args.tokens_per_second,
+        error_rate=args.error_rate,
+        rate_limit_rate=args.rate_limit_rate,
+        requests_per_minute=args.requests_per_minute,
+        seed=args.seed,
+    )
+    with server:
+        print(f"Stub provider listening on {server.base_url}")
+        try:
+            threading.Event().wait()
+        except KeyboardInterrupt:
+            pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+"""Changed timestamps to timestamptz
+
+Revision ID: 4011c67188f3
+Revises: d3195362dd0f
+Create Date: 2026-10-18 12:26:45.782261
+
+"""
+from alembic import op
+import sqlalchemy as sa
+import sqlmodel.sql.sqltypes
+from sqlalchemy.dialects import postgresql
+
+# revision identifiers, used by Alembic.
+revision = '4011c67188f3'
+down_revision = 'd3195362dd0f'
+branch_labels = None
+depends_on = None
+
+
+BATCH_SIZE = 10_000
+
+# (table, column, index that has to be rebuilt after the column swap)
+COLUMNS = [
+    ("conversation", "created_at", None),
+    ("conversation", "modified_at", ("ix_conversation_owner_id_modified_at", ["owner_id", "modified_at", "id"])),
+    ("cnvmessage", "created_at", ("ix_cnvmessage_conversation_id_created_at", ["conversation_id", "created_at", "id"])),
+]
+
+
+def backfill(table, column, where):
+    # Old rows hold naive UTC ISO strings written by datetime.utcnow().isoformat()
+    return sa.text(
+        f"UPDATE {table} SET {column}_tz = {column}::timestamp AT TIME ZONE 'UTC' "
+        f"WHERE {column}_tz IS NULL AND {where}"
+    )
+
+
+def upgrade():
+    # Online conversion: add a shadow column, fill it in small committed
+    # batches while the app keeps writing, then swap it in with a short lock.
+    for table, column, _ in COLUMNS:
+        op.add_column(table, sa.Column(f"{column}_tz", sa.DateTime(timezone=True), nullable=True))
+
+    with op.get_context().autocommit_block():
+        connection = op.get_bind()
+        for table, column, _ in COLUMNS:
+            max_id = connection.execute(sa.text(f"SELECT max(id) FROM {table}")).scalar() or 0
+            for low in range(0, max_id + 1, BATCH_SIZE):
+                connection.execute(
+                    backfill(table, column, "id >= :low AND id < :high"),
+                    {"low": low, "high": low + BATCH_SIZE},
+                )
+
+    # Until the migration commits, the app may still read but not write, so
+    # no row written by the old code can slip in between the last backfill
+    # and SET NOT NULL. Parent table first, in the order the app inserts.
+    for table in dict.fromkeys(table for table, _, _ in COLUMNS):
+        op.execute(f"LOCK TABLE {table} IN SHARE ROW EXCLUSIVE MODE")
+    for table, column, _ in COLUMNS:
+        # Rows written since the batch pass
+        op.execute(backfill(table, column, "true"))
+        op.drop_column(table, column)
+        op.alter_column(table, f"{column}_tz", new_column_name=column, nullable=False, server_default=sa.text("now()"))
+
+    op.alter_column('moderationverdict', 'created_at',
+               existing_type=postgresql.TIMESTAMP(),
+               type_=sa.DateTime(timezone=True),
+               existing_nullable=False,
+               server_default=sa.text("now()"),
+               postgresql_using="created_at AT TIME ZONE 'UTC'")
+
+    with op.get_context().autocommit_block():
+        for table, _, index in COLUMNS:
+            if index:
+                name, columns = index
+                op.create_index(name, table, columns, unique=False, postgresql_concurrently=True, if_not_exists=True)
+
+
+def isoformat(column):
+    # What datetime.utcnow().isoformat() wrote: microseconds only when not zero
+    local = f"{column} AT TIME ZONE 'UTC'"
+    return (
+        f"to_char({local}, 'YYYY-MM-DD\"T\"HH24:MI:SS') || "
+        f"CASE to_char({local}, 'US') WHEN '000000' THEN '' ELSE to_char({local}, '.US') END"
+    )
+
+
+def downgrade():
+    op.alter_column('moderationverdict', 'created_at',
+               existing_type=sa.DateTime(timezone=True),
+               type_=postgresql.TIMESTAMP(),
+               existing_nullable=False,
+               server_default=None,
+               postgresql_using="created_at AT TIME ZONE 'UTC'")
+    for table, column, _ in COLUMNS:
+        op.alter_column(table, column,
+               existing_type=sa.DateTime(timezone=True),
+               type_=sqlmodel.sql.sqltypes.AutoString(),
+               existing_nullable=False,
+               server_default=None,
+               postgresql_using=isoformat(column))
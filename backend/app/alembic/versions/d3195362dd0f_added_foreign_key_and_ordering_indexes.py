@@ -0,0 +1,34 @@
+"""Added foreign key and ordering indexes
+
+Revision ID: d3195362dd0f
+Revises: cd35820d16d5
+Create Date: 2026-10-18 12:25:24.052723
+
+"""
+from alembic import op
+import sqlalchemy as sa
+import sqlmodel.sql.sqltypes
+
+
+# revision identifiers, used by Alembic.
+revision = 'd3195362dd0f'
+down_revision = 'cd35820d16d5'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Built concurrently so the tables stay writable during the migration
+    with op.get_context().autocommit_block():
+        op.create_index('ix_cnvmessage_conversation_id_created_at', 'cnvmessage', ['conversation_id', 'created_at', 'id'], unique=False, postgresql_concurrently=True, if_not_exists=True)
+        op.create_index('ix_cnvmessage_owner_id', 'cnvmessage', ['owner_id'], unique=False, postgresql_concurrently=True, if_not_exists=True)
+        op.create_index('ix_conversation_owner_id_modified_at', 'conversation', ['owner_id', 'modified_at', 'id'], unique=False, postgresql_concurrently=True, if_not_exists=True)
+        op.create_index('ix_item_owner_id_id', 'item', ['owner_id', 'id'], unique=False, postgresql_concurrently=True, if_not_exists=True)
+
+
+def downgrade():
+    with op.get_context().autocommit_block():
+        op.drop_index('ix_item_owner_id_id', table_name='item', postgresql_concurrently=True)
+        op.drop_index('ix_conversation_owner_id_modified_at', table_name='conversation', postgresql_concurrently=True)
+        op.drop_index('ix_cnvmessage_owner_id', table_name='cnvmessage', postgresql_concurrently=True)
+        op.drop_index('ix_cnvmessage_conversation_id_created_at', table_name='cnvmessage', postgresql_concurrently=True)
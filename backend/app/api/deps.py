@@ -1,15 +1,23 @@
-from collections.abc import Generator
+from collections.abc import AsyncGenerator, Generator
 from typing import Annotated
 
-from fastapi import Depends, HTTPException, status
+from fastapi import Depends, HTTPException, Request, status
 from fastapi.security import OAuth2PasswordBearer
 from jose import JWTError, jwt
 from pydantic import ValidationError
 from sqlmodel import Session
+from sqlmodel.ext.asyncio.session import AsyncSession
 
 from app.core import security
 from app.core.config import settings
-from app.core.db import engine
+from app.core.db import async_engine, engine
+from app.core.replicas import (
+    WRITE_COOKIE,
+    parse_write_time,
+    replica_router,
+    writer_key,
+)
+from app.core.user_cache import user_cache
 from app.models import TokenPayload, User
 
 reusable_oauth2 = OAuth2PasswordBearer(
@@ -22,22 +30,70 @@ def get_db() -> Generator[Session, None, None]:
         yield session
 
 
+async def get_async_db() -> AsyncGenerator[AsyncSession, None]:
+    async with AsyncSession(async_engine, expire_on_commit=False) as session:
+        yield session
+
+
+def get_read_db(request: Request) -> Generator[Session, None, None]:
+    """
+    A session for handlers that only read: on a replica when one is set up
+    and the client has not written recently, on the primary otherwise.
+    """
+    writer = writer_key(request.headers.get("authorization"))
+    last_write = parse_write_time(request.cookies.get(WRITE_COOKIE))
+    with replica_router.connect(writer, last_write) as connection, Session(
+        bind=connection
+    ) as session:
+        yield session
+
+
 SessionDep = Annotated[Session, Depends(get_db)]
+AsyncSessionDep = Annotated[AsyncSession, Depends(get_async_db)]
+ReadSessionDep = Annotated[Session, Depends(get_read_db)]
 TokenDep = Annotated[str, Depends(reusable_oauth2)]
 
 
-def get_current_user(session: SessionDep, token: TokenDep) -> User:
-    try:
-        payload = jwt.decode(
-            token, settings.SECRET_KEY, algorithms=[security.ALGORITHM]
-        )
-        token_data = TokenPayload(**payload)
-    except (JWTError, ValidationError):
-        raise HTTPException(
-            status_code=status.HTTP_403_FORBIDDEN,
-            detail="Could not validate credentials",
-        )
-    user = session.get(User, token_data.sub)
+def get_current_user(token: TokenDep) -> User:
+    """
+    Looks the user up in a session of its own, closed right away, so that no
+    connection is held while the handler runs; for chat that spans the
+    provider call. Handlers that change the user load it from their session.
+    """
+    with Session(engine) as session:
+        return load_current_user(session, token)
+
+
+def get_current_user_for_read(session: ReadSessionDep, token: TokenDep) -> User:
+    return load_current_user(session, token)
+
+
+def load_current_user(session: Session, token: str) -> User:
+    """
+    The user the token belongs to. Tokens seen before and users looked up
+    recently come from ``user_cache``, as copies that are not attached to
+    ``session``.
+    """
+    user_id = user_cache.get_user_id(token)
+    if user_id is None:
+        try:
+            payload = jwt.decode(
+                token, settings.SECRET_KEY, algorithms=[security.ALGORITHM]
+            )
+            token_data = TokenPayload(**payload)
+        except (JWTError, ValidationError):
+            raise HTTPException(
+                status_code=status.HTTP_403_FORBIDDEN,
+                detail="Could not validate credentials",
+            )
+        if token_data.sub is not None and "exp" in payload:
+            user_cache.set_user_id(token, token_data.sub, payload["exp"])
+        user_id = token_data.sub
+    user = user_cache.get_user(user_id) if user_id is not None else None
+    if user is None:
+        user = session.get(User, user_id)
+        if user:
+            user_cache.set_user(user)
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
     if not user.is_active:
@@ -46,6 +102,7 @@ def get_current_user(session: SessionDep, token: TokenDep) -> User:
 
 
 CurrentUser = Annotated[User, Depends(get_current_user)]
+ReadCurrentUser = Annotated[User, Depends(get_current_user_for_read)]
 
 
 def get_current_active_superuser(current_user: CurrentUser) -> User:
@@ -0,0 +1,114 @@
+"""
+Opaque cursors for keyset pagination.
+
+A cursor holds the sort key of the last row on a page. The next page starts
+right after that key, so the database seeks through the index instead of
+scanning and discarding ``skip`` rows.
+
+``fetch_page`` runs the page query for all list endpoints, and the count
+query only when the total is asked for and the page does not tell it.
+"""
+
+import base64
+import binascii
+import json
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Any, Generic, TypeVar
+
+from fastapi import HTTPException
+from sqlalchemy import ColumnElement
+from sqlmodel import Session, SQLModel, func, select
+from sqlmodel.sql.expression import SelectOfScalar
+
+from app.core.count_cache import count_cache
+
+T = TypeVar("T")
+
+
+def encode_cursor(*key: Any) -> str:
+    values = [
+        value.isoformat() if isinstance(value, datetime) else value for value in key
+    ]
+    data = json.dumps(values, separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(data).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str, *types: type) -> tuple[Any, ...]:
+    """
+    Decode a cursor made by ``encode_cursor`` into values of ``types``.
+
+    Raises a 400 for anything that was not produced by ``encode_cursor`` for
+    the same key shape.
+    """
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        values = json.loads(base64.urlsafe_b64decode(padded))
+        if not isinstance(values, list) or len(values) != len(types):
+            raise ValueError(cursor)
+        key: list[Any] = []
+        for value, type_ in zip(values, types, strict=True):
+            if type_ is datetime:
+                key.append(datetime.fromisoformat(value))
+            elif type(value) is type_:
+                key.append(value)
+            else:
+                raise ValueError(cursor)
+    except (binascii.Error, TypeError, ValueError):
+        raise HTTPException(status_code=400, detail="Invalid cursor") from None
+    return tuple(key)
+
+
+def include_count(requested: bool | None, cursor: str | None) -> bool:
+    """
+    Offset pages keep their exact count by default, cursor pages skip it.
+    """
+    if requested is None:
+        return cursor is None
+    return requested
+
+
+@dataclass
+class Page(Generic[T]):
+    rows: list[T]
+    count: int | None
+    has_more: bool
+
+
+def fetch_page(
+    session: Session,
+    statement: SelectOfScalar[T],
+    *,
+    after: ColumnElement[bool] | bool | None,
+    skip: int,
+    limit: int,
+    with_count: bool,
+    model: type[SQLModel],
+    owner_id: int | None = None,
+) -> Page[T]:
+    """
+    A page of ``statement``, with the total number of its rows if
+    ``with_count`` is set.
+
+    ``statement`` holds the filters and the order. The cursor condition
+    ``after``, offset and limit are added here, so that the total covers the
+    whole list. The total comes from ``count_cache`` under ``model`` and
+    ``owner_id``. Failing that, a first page with no row past ``limit`` holds
+    the whole list, so its length is the total; any other page needs a count
+    query of its own.
+    """
+    count = count_cache.get(model, owner_id) if with_count else None
+    counted = count is None and with_count
+    page = statement if after is None else statement.where(after)
+    # One row more than asked for tells whether another page follows
+    rows = list(session.exec(page.offset(skip).limit(limit + 1)).all())
+    if counted:
+        if after is None and skip == 0 and len(rows) <= limit:
+            count = len(rows)
+        else:
+            count_statement = select(func.count()).select_from(
+                statement.order_by(None).subquery()
+            )
+            count = session.exec(count_statement).one()
+        count_cache.set(model, owner_id, count)
+    return Page(rows=rows[:limit], count=count, has_more=len(rows) > limit)
@@ -1,17 +1,28 @@
+import json
 import logging
+from collections.abc import AsyncIterator
 from typing import Any
 
-from fastapi import APIRouter, BackgroundTasks, HTTPException
+from fastapi import APIRouter, HTTPException
+from fastapi.responses import StreamingResponse
+from openai import OpenAIError
+from sqlmodel.ext.asyncio.session import AsyncSession
 
-from app import crud
+from app import crud, jobs
 from app.ai import assistant
-from app.api.deps import CurrentUser, SessionDep
+from app.ai.resilience import ProviderUnavailable
+from app.api.deps import AsyncSessionDep, CurrentUser
+from app.core import metrics
+from app.core.config import settings
+from app.core.db import async_engine
+from app.exception import ApiDbException
 from app.models import (
     ChatPublic,
+    CnvMessage,
+    CnvMessageAssistantCreate,
     CnvMessageUserCreate,
     Conversation,
     ConversationBase,
-    ConversationUpdate,
 )
 
 router = APIRouter()
@@ -20,9 +31,8 @@ logger = logging.getLogger(__name__)
 
 
 @router.post("/", response_model=ChatPublic)
-def chat_new_conversation(
-    background_tasks: BackgroundTasks,
-    session: SessionDep,
+async def chat_new_conversation(
+    session: AsyncSessionDep,
     current_user: CurrentUser,
     chat_in: CnvMessageUserCreate,
 ) -> Any:
@@ -35,34 +45,52 @@ def chat_new_conversation(
         raise HTTPException(
             status_code=403, detail="You are not allowed to perform this action"
         )
-    conversation = crud.create_conversation(
-        session=session, conversation_in=ConversationBase(), owner_id=current_user.id
+    unit = crud.UnitOfWork(session)
+    conversation = unit.add_conversation(ConversationBase(), owner_id=current_user.id)
+    question = unit.add_cnvmessage(
+        chat_in, owner_id=current_user.id, conversation=conversation
     )
-    if not conversation or not conversation.id:
-        raise HTTPException(status_code=404, detail="Conversation not found")
-    question = crud.create_cnvmessage(
-        session=session,
-        cnv_in=chat_in,
-        owner_id=current_user.id,
-        conv_id=conversation.id,
+    await unit.commit()
+    return await answer_turn(
+        unit, conversation=conversation, question=question, owner_id=current_user.id
     )
-    assistant_message = assistant.generate_answer(
-        session=session, owner_id=current_user.id, conv_id=conversation.id
-    )
-    background_tasks.add_task(
-        update_conversation_summary, session=session, conv_id=conversation.id
+
+
+@router.post("/stream", response_class=StreamingResponse)
+async def chat_new_conversation_stream(
+    session: AsyncSessionDep,
+    current_user: CurrentUser,
+    chat_in: CnvMessageUserCreate,
+) -> Any:
+    """
+    Start a conversation, streaming the answer as Server-Sent Events.
+    """
+    if chat_in.role != "user":
+        raise HTTPException(status_code=400, detail="Misconfigured chat role")
+    if current_user.id is None:
+        raise HTTPException(
+            status_code=403, detail="You are not allowed to perform this action"
+        )
+    unit = crud.UnitOfWork(session)
+    conversation = unit.add_conversation(ConversationBase(), owner_id=current_user.id)
+    question = unit.add_cnvmessage(
+        chat_in, owner_id=current_user.id, conversation=conversation
     )
-    return ChatPublic(
-        conversation_id=conversation.id,
-        content=assistant_message.content,
-        question_id=question.id,
-        answer_id=assistant_message.id,
+    await unit.commit()
+    return StreamingResponse(
+        stream_chat_events(
+            conversation=conversation,
+            question=question,
+            owner_id=current_user.id,
+            messages_list=[question],
+        ),
+        media_type="text/event-stream",
     )
 
 
 @router.post("/{conversation_id}", response_model=ChatPublic)
-def chat_continue_conversation(
-    session: SessionDep,
+async def chat_continue_conversation(
+    session: AsyncSessionDep,
     current_user: CurrentUser,
     chat_in: CnvMessageUserCreate,
     conversation_id: int,
@@ -70,7 +98,38 @@ def chat_continue_conversation(
     """
     Continue a conversation.
     """
-    conversation = session.get(Conversation, conversation_id)
+    conversation = await session.get(Conversation, conversation_id)
+    if not conversation or not conversation.id:
+        raise HTTPException(status_code=404, detail="Conversation not found")
+    if conversation.owner_id != current_user.id:
+        raise HTTPException(
+            status_code=403, detail="You are not allowed to perform this action"
+        )
+    if chat_in.role != "user":
+        raise HTTPException(
+            status_code=403, detail="You are not allowed to perform this action"
+        )
+    unit = crud.UnitOfWork(session)
+    question = unit.add_cnvmessage(
+        chat_in, owner_id=current_user.id, conversation=conversation
+    )
+    await unit.commit()
+    return await answer_turn(
+        unit, conversation=conversation, question=question, owner_id=current_user.id
+    )
+
+
+@router.post("/{conversation_id}/stream", response_class=StreamingResponse)
+async def chat_continue_conversation_stream(
+    session: AsyncSessionDep,
+    current_user: CurrentUser,
+    chat_in: CnvMessageUserCreate,
+    conversation_id: int,
+) -> Any:
+    """
+    Continue a conversation, streaming the answer as Server-Sent Events.
+    """
+    conversation = await session.get(Conversation, conversation_id)
     if not conversation or not conversation.id:
         raise HTTPException(status_code=404, detail="Conversation not found")
     if conversation.owner_id != current_user.id:
@@ -81,27 +140,135 @@ def chat_continue_conversation(
         raise HTTPException(
             status_code=403, detail="You are not allowed to perform this action"
         )
-    question = crud.create_cnvmessage(
+    unit = crud.UnitOfWork(session)
+    question = unit.add_cnvmessage(
+        chat_in, owner_id=current_user.id, conversation=conversation
+    )
+    await unit.commit()
+    messages = await crud.get_last_cnvmessages_async(
         session=session,
-        cnv_in=chat_in,
-        owner_id=current_user.id,
         conv_id=conversation.id,
+        limit=settings.AI_CONTEXT_MAX_MESSAGES,
+    )
+    return StreamingResponse(
+        stream_chat_events(
+            conversation=conversation,
+            question=question,
+            owner_id=current_user.id,
+            messages_list=messages,
+        ),
+        media_type="text/event-stream",
     )
-    assistant_message = assistant.generate_answer(
-        session=session, owner_id=current_user.id, conv_id=conversation.id
+
+
+async def answer_turn(
+    unit: crud.UnitOfWork,
+    *,
+    conversation: Conversation,
+    question: CnvMessage,
+    owner_id: int,
+) -> ChatPublic:
+    """
+    Answer a stored question, then store the answer and any summary job in
+    one transaction.
+    """
+    if conversation.id is None or question.id is None:
+        raise ApiDbException("Message without id")
+    answer = await assistant.generate_answer_async(
+        unit=unit, owner_id=owner_id, conv_id=conversation.id
     )
-    print(assistant_message.content)
+    await jobs.enqueue_summary_if_due(unit=unit, conversation=conversation)
+    await unit.commit()
+    if answer.id is None:
+        raise ApiDbException("Message without id")
     return ChatPublic(
         conversation_id=conversation.id,
-        content=assistant_message.content,
+        content=answer.content,
         question_id=question.id,
-        answer_id=assistant_message.id,
+        answer_id=answer.id,
     )
 
 
-async def update_conversation_summary(session: SessionDep, conv_id: int) -> None:
-    summary = assistant.generate_summary(session=session, conv_id=conv_id)
-    crud.update_conversation(
-        session=session,
-        conversation_in=ConversationUpdate(id=conv_id, summary=summary),
+def format_sse(event: str, data: dict[str, Any]) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+async def stream_chat_events(
+    *,
+    conversation: Conversation,
+    question: CnvMessage,
+    owner_id: int,
+    messages_list: list[CnvMessage],
+) -> AsyncIterator[str]:
+    """
+    Forward answer chunks as they arrive and store the answer once at the end.
+
+    The request session is already closed while the body streams, so the
+    answer is written with a short-lived session of its own, in one
+    transaction with a summary refresh when one is due.
+
+    The status code is sent with the first event, so a provider that fails
+    midway ends the stream with an ``error`` event instead of ``done``. The
+    text received until then is stored as the answer, and its id is part of
+    the event; without any text the question stays unanswered.
+    """
+    if conversation.id is None or question.id is None:
+        raise ApiDbException("Message without id")
+    yield format_sse(
+        "conversation",
+        {"conversation_id": conversation.id, "question_id": question.id},
     )
+    chunks = []
+    try:
+        async for chunk in assistant.stream_answer_async(
+            messages_list=messages_list, summary=conversation.summary
+        ):
+            chunks.append(chunk)
+            yield format_sse("token", {"content": chunk})
+    except (ProviderUnavailable, OpenAIError):
+        logger.exception("Answer stream failed after %d chunks", len(chunks))
+        metrics.increment("chat.stream_failures")
+        answer_id = None
+        if chunks:
+            answer = await store_answer(
+                conversation=conversation, content="".join(chunks), owner_id=owner_id
+            )
+            answer_id = answer.id
+        yield format_sse(
+            "error",
+            {
+                "detail": "The answer could not be completed",
+                "conversation_id": conversation.id,
+                "question_id": question.id,
+                "answer_id": answer_id,
+                "content": "".join(chunks),
+            },
+        )
+        return
+    answer = await store_answer(
+        conversation=conversation, content="".join(chunks), owner_id=owner_id
+    )
+    if answer.id is None:
+        raise ApiDbException("Message without id")
+    chat_public = ChatPublic(
+        conversation_id=conversation.id,
+        content=answer.content,
+        question_id=question.id,
+        answer_id=answer.id,
+    )
+    yield format_sse("done", chat_public.model_dump())
+
+
+async def store_answer(
+    *, conversation: Conversation, content: str, owner_id: int
+) -> CnvMessage:
+    async with AsyncSession(async_engine, expire_on_commit=False) as session:
+        unit = crud.UnitOfWork(session)
+        answer = unit.add_cnvmessage(
+            CnvMessageAssistantCreate(content=content),
+            owner_id=owner_id,
+            conversation=conversation,
+        )
+        await jobs.enqueue_summary_if_due(unit=unit, conversation=conversation)
+        await unit.commit()
+    return answer
@@ -1,9 +1,18 @@
+from datetime import datetime
 from typing import Any
 
 from fastapi import APIRouter, HTTPException
-from sqlmodel import func, select
+from sqlmodel import col, select, tuple_
 
-from app.api.deps import CurrentUser, SessionDep
+from app import crud
+from app.api.deps import CurrentUser, ReadCurrentUser, ReadSessionDep, SessionDep
+from app.api.pagination import (
+    decode_cursor,
+    encode_cursor,
+    fetch_page,
+    include_count,
+)
+from app.core.count_cache import count_cache
 from app.models import (
     Conversation,
     ConversationDetailPublic,
@@ -16,40 +25,82 @@ router = APIRouter()
 
 @router.get("/", response_model=ConversationsPublic)
 def read_conversations(
-    session: SessionDep, current_user: CurrentUser, skip: int = 0, limit: int = 100
+    session: ReadSessionDep,
+    current_user: ReadCurrentUser,
+    skip: int = 0,
+    limit: int = 100,
+    cursor: str | None = None,
+    with_count: bool | None = None,
 ) -> Any:
     """
-    Retrieve conversations.
+    Retrieve conversations, most recently modified first.
+
+    Pass the ``next_cursor`` of a page as ``cursor`` to get the next one.
+    The cursor is the last row's ``modified_at`` and id, and every answer
+    moves ``modified_at``. A conversation that gets a message while a client
+    walks the pages jumps ahead of the cursor: the walk never repeats it, but
+    skips it if it was not on a page yet. Start again from the first page to
+    see it.
     """
-    count_statement = (
-        select(func.count())
-        .select_from(Conversation)
-        .where(Conversation.owner_id == current_user.id)
-    )
-    count = session.exec(count_statement).one()
     statement = (
         select(Conversation)
         .where(Conversation.owner_id == current_user.id)
-        .offset(skip)
-        .limit(limit)
+        .order_by(col(Conversation.modified_at).desc(), col(Conversation.id).desc())
+    )
+    after = None
+    if cursor is not None:
+        after_key = decode_cursor(cursor, datetime, int)
+        after = tuple_(col(Conversation.modified_at), col(Conversation.id)) < after_key
+    page = fetch_page(
+        session,
+        statement,
+        after=after,
+        skip=skip,
+        limit=limit,
+        with_count=include_count(with_count, cursor),
+        model=Conversation,
+        owner_id=current_user.id,
     )
-    conversations = session.exec(statement).all()
 
-    return ConversationsPublic(data=conversations, count=count)
+    next_cursor = None
+    if page.has_more:
+        last = page.rows[-1]
+        next_cursor = encode_cursor(last.modified_at, last.id)
+    return ConversationsPublic(
+        data=page.rows, count=page.count, next_cursor=next_cursor
+    )
 
 
 @router.get("/{id}", response_model=ConversationDetailPublic)
-def read_conversation(session: SessionDep, current_user: CurrentUser, id: int) -> Any:
+def read_conversation(
+    session: ReadSessionDep,
+    current_user: ReadCurrentUser,
+    id: int,
+    limit: int | None = None,
+    after_id: int | None = None,
+) -> Any:
     """
     Get conversation by ID.
+
+    By default all messages are returned. ``limit`` returns only the newest
+    messages; with ``after_id`` it pages forward from that message instead.
     """
     conversation = session.get(Conversation, id)
     if not conversation:
         raise HTTPException(status_code=404, detail="Conversation not found")
     if conversation.owner_id != current_user.id:
         raise HTTPException(status_code=403, detail="Not enough permissions")
-    conversation.messages.sort(key=lambda message: message.created_at)
-    return conversation
+    if after_id is not None:
+        messages = crud.get_cnvmessages_after(
+            session=session, conv_id=id, after_id=after_id, limit=limit
+        )
+    elif limit is not None:
+        messages = crud.get_last_cnvmessages(session=session, conv_id=id, limit=limit)
+    else:
+        messages = crud.get_cnvmessages(session=session, conv_id=id)
+    return ConversationDetailPublic.model_validate(
+        conversation, update={"messages": messages}
+    )
 
 
 @router.delete("/{id}")
@@ -68,4 +119,5 @@ def delete_conversation(
         session.delete(message)
     session.delete(conversation)
     session.commit()
+    count_cache.invalidate(Conversation, conversation.owner_id)
     return Message(message="Conversation deleted successfully")
@@ -1,9 +1,16 @@
 from typing import Any
 
 from fastapi import APIRouter, HTTPException
-from sqlmodel import func, select
+from sqlmodel import col, select
 
-from app.api.deps import CurrentUser, SessionDep
+from app.api.deps import CurrentUser, ReadCurrentUser, ReadSessionDep, SessionDep
+from app.api.pagination import (
+    decode_cursor,
+    encode_cursor,
+    fetch_page,
+    include_count,
+)
+from app.core.count_cache import count_cache
 from app.models import Item, ItemCreate, ItemPublic, ItemsPublic, ItemUpdate, Message
 
 router = APIRouter()
@@ -11,33 +18,43 @@ router = APIRouter()
 
 @router.get("/", response_model=ItemsPublic)
 def read_items(
-    session: SessionDep, current_user: CurrentUser, skip: int = 0, limit: int = 100
+    session: ReadSessionDep,
+    current_user: ReadCurrentUser,
+    skip: int = 0,
+    limit: int = 100,
+    cursor: str | None = None,
+    with_count: bool | None = None,
 ) -> Any:
     """
     Retrieve items.
+
+    Pass the ``next_cursor`` of a page as ``cursor`` to get the next one.
     """
 
-    if current_user.is_superuser:
-        count_statement = select(func.count()).select_from(Item)
-        count = session.exec(count_statement).one()
-        statement = select(Item).offset(skip).limit(limit)
-        items = session.exec(statement).all()
-    else:
-        count_statement = (
-            select(func.count())
-            .select_from(Item)
-            .where(Item.owner_id == current_user.id)
-        )
-        count = session.exec(count_statement).one()
-        statement = (
-            select(Item)
-            .where(Item.owner_id == current_user.id)
-            .offset(skip)
-            .limit(limit)
-        )
-        items = session.exec(statement).all()
-
-    return ItemsPublic(data=items, count=count)
+    statement = select(Item).order_by(col(Item.id))
+    owner_id = None
+    if not current_user.is_superuser:
+        owner_id = current_user.id
+        statement = statement.where(Item.owner_id == owner_id)
+    after = None
+    if cursor is not None:
+        (after_id,) = decode_cursor(cursor, int)
+        after = col(Item.id) > after_id
+    page = fetch_page(
+        session,
+        statement,
+        after=after,
+        skip=skip,
+        limit=limit,
+        with_count=include_count(with_count, cursor),
+        model=Item,
+        owner_id=owner_id,
+    )
+
+    next_cursor = None
+    if page.has_more:
+        next_cursor = encode_cursor(page.rows[-1].id)
+    return ItemsPublic(data=page.rows, count=page.count, next_cursor=next_cursor)
 
 
 @router.get("/{id}", response_model=ItemPublic)
@@ -64,6 +81,7 @@ def create_item(
     session.add(item)
     session.commit()
     session.refresh(item)
+    count_cache.invalidate(Item, item.owner_id)
     return item
 
 
@@ -99,4 +117,5 @@ def delete_item(session: SessionDep, current_user: CurrentUser, id: int) -> Mess
         raise HTTPException(status_code=400, detail="Not enough permissions")
     session.delete(item)
     session.commit()
+    count_cache.invalidate(Item, item.owner_id)
     return Message(message="Item deleted successfully")
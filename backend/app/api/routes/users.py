@@ -1,16 +1,28 @@
 from typing import Any
 
 from fastapi import APIRouter, Depends, HTTPException
-from sqlmodel import col, delete, func, select
+from sqlmodel import col, delete, select
+from starlette.concurrency import run_in_threadpool
 
 from app import crud
 from app.api.deps import (
+    AsyncSessionDep,
     CurrentUser,
+    ReadCurrentUser,
+    ReadSessionDep,
     SessionDep,
     get_current_active_superuser,
 )
+from app.api.pagination import (
+    decode_cursor,
+    encode_cursor,
+    fetch_page,
+    include_count,
+)
 from app.core.config import settings
-from app.core.security import get_password_hash, verify_password
+from app.core.count_cache import count_cache
+from app.core.security import get_password_hash_async, verify_password_async
+from app.core.user_cache import user_cache
 from app.models import (
     Item,
     Message,
@@ -33,40 +45,61 @@ router = APIRouter()
     dependencies=[Depends(get_current_active_superuser)],
     response_model=UsersPublic,
 )
-def read_users(session: SessionDep, skip: int = 0, limit: int = 100) -> Any:
+def read_users(
+    session: ReadSessionDep,
+    skip: int = 0,
+    limit: int = 100,
+    cursor: str | None = None,
+    with_count: bool | None = None,
+) -> Any:
     """
     Retrieve users.
-    """
 
-    count_statement = select(func.count()).select_from(User)
-    count = session.exec(count_statement).one()
+    Pass the ``next_cursor`` of a page as ``cursor`` to get the next one.
+    """
 
-    statement = select(User).offset(skip).limit(limit)
-    users = session.exec(statement).all()
+    statement = select(User).order_by(col(User.id))
+    after = None
+    if cursor is not None:
+        (after_id,) = decode_cursor(cursor, int)
+        after = col(User.id) > after_id
+    page = fetch_page(
+        session,
+        statement,
+        after=after,
+        skip=skip,
+        limit=limit,
+        with_count=include_count(with_count, cursor),
+        model=User,
+    )
 
-    return UsersPublic(data=users, count=count)
+    next_cursor = None
+    if page.has_more:
+        next_cursor = encode_cursor(page.rows[-1].id)
+    return UsersPublic(data=page.rows, count=page.count, next_cursor=next_cursor)
 
 
 @router.post(
     "/", dependencies=[Depends(get_current_active_superuser)], response_model=UserPublic
 )
-def create_user(*, session: SessionDep, user_in: UserCreate) -> Any:
+async def create_user(*, session: AsyncSessionDep, user_in: UserCreate) -> Any:
     """
     Create new user.
     """
-    user = crud.get_user_by_email(session=session, email=user_in.email)
+    user = await crud.get_user_by_email_async(session=session, email=user_in.email)
     if user:
         raise HTTPException(
             status_code=400,
             detail="The user with this email already exists in the system.",
         )
 
-    user = crud.create_user(session=session, user_create=user_in)
+    user = await crud.create_user_async(session=session, user_create=user_in)
     if settings.emails_enabled and user_in.email:
         email_data = generate_new_account_email(
             email_to=user_in.email, username=user_in.email, password=user_in.password
         )
-        send_email(
+        await run_in_threadpool(
+            send_email,
             email_to=user_in.email,
             subject=email_data.subject,
             html_content=email_data.html_content,
@@ -89,35 +122,44 @@ def update_user_me(
                 status_code=409, detail="User with this email already exists"
             )
     user_data = user_in.model_dump(exclude_unset=True)
-    current_user.sqlmodel_update(user_data)
-    session.add(current_user)
+    db_user = session.get(User, current_user.id)
+    if not db_user:
+        raise HTTPException(status_code=404, detail="User not found")
+    db_user.sqlmodel_update(user_data)
+    session.add(db_user)
     session.commit()
-    session.refresh(current_user)
-    return current_user
+    session.refresh(db_user)
+    user_cache.invalidate(db_user.id)
+    return db_user
 
 
 @router.patch("/me/password", response_model=Message)
-def update_password_me(
-    *, session: SessionDep, body: UpdatePassword, current_user: CurrentUser
+async def update_password_me(
+    *, session: AsyncSessionDep, body: UpdatePassword, current_user: CurrentUser
 ) -> Any:
     """
     Update own password.
     """
-    if not verify_password(body.current_password, current_user.hashed_password):
+    if not await verify_password_async(
+        body.current_password, current_user.hashed_password
+    ):
         raise HTTPException(status_code=400, detail="Incorrect password")
     if body.current_password == body.new_password:
         raise HTTPException(
             status_code=400, detail="New password cannot be the same as the current one"
         )
-    hashed_password = get_password_hash(body.new_password)
-    current_user.hashed_password = hashed_password
-    session.add(current_user)
-    session.commit()
+    db_user = await session.get(User, current_user.id)
+    if not db_user:
+        raise HTTPException(status_code=404, detail="User not found")
+    db_user.hashed_password = await get_password_hash_async(body.new_password)
+    session.add(db_user)
+    await session.commit()
+    user_cache.invalidate(db_user.id)
     return Message(message="Password updated successfully")
 
 
 @router.get("/me", response_model=UserPublic)
-def read_user_me(current_user: CurrentUser) -> Any:
+def read_user_me(current_user: ReadCurrentUser) -> Any:
     """
     Get current user.
     """
@@ -125,7 +167,7 @@ def read_user_me(current_user: CurrentUser) -> Any:
 
 
 @router.post("/signup", response_model=UserPublic)
-def register_user(session: SessionDep, user_in: UserRegister) -> Any:
+async def register_user(session: AsyncSessionDep, user_in: UserRegister) -> Any:
     """
     Create new user without the need to be logged in.
     """
@@ -134,14 +176,14 @@ def register_user(session: SessionDep, user_in: UserRegister) -> Any:
             status_code=403,
             detail="Open user registration is forbidden on this server",
         )
-    user = crud.get_user_by_email(session=session, email=user_in.email)
+    user = await crud.get_user_by_email_async(session=session, email=user_in.email)
     if user:
         raise HTTPException(
             status_code=400,
             detail="The user with this email already exists in the system",
         )
     user_create = UserCreate.model_validate(user_in)
-    user = crud.create_user(session=session, user_create=user_create)
+    user = await crud.create_user_async(session=session, user_create=user_create)
     return user
 
 
@@ -153,7 +195,7 @@ def read_user_by_id(
     Get a specific user by id.
     """
     user = session.get(User, user_id)
-    if user == current_user:
+    if user and user.id == current_user.id:
         return user
     if not current_user.is_superuser:
         raise HTTPException(
@@ -168,9 +210,9 @@ def read_user_by_id(
     dependencies=[Depends(get_current_active_superuser)],
     response_model=UserPublic,
 )
-def update_user(
+async def update_user(
     *,
-    session: SessionDep,
+    session: AsyncSessionDep,
     user_id: int,
     user_in: UserUpdate,
 ) -> Any:
@@ -178,20 +220,25 @@ def update_user(
     Update a user.
     """
 
-    db_user = session.get(User, user_id)
+    db_user = await session.get(User, user_id)
     if not db_user:
         raise HTTPException(
             status_code=404,
             detail="The user with this id does not exist in the system",
         )
     if user_in.email:
-        existing_user = crud.get_user_by_email(session=session, email=user_in.email)
+        existing_user = await crud.get_user_by_email_async(
+            session=session, email=user_in.email
+        )
         if existing_user and existing_user.id != user_id:
             raise HTTPException(
                 status_code=409, detail="User with this email already exists"
             )
 
-    db_user = crud.update_user(session=session, db_user=db_user, user_in=user_in)
+    db_user = await crud.update_user_async(
+        session=session, db_user=db_user, user_in=user_in
+    )
+    user_cache.invalidate(user_id)
     return db_user
 
 
@@ -205,11 +252,11 @@ def delete_user(
     user = session.get(User, user_id)
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
-    elif user != current_user and not current_user.is_superuser:
+    elif user.id != current_user.id and not current_user.is_superuser:
         raise HTTPException(
             status_code=403, detail="The user doesn't have enough privileges"
         )
-    elif user == current_user and current_user.is_superuser:
+    elif user.id == current_user.id and current_user.is_superuser:
         raise HTTPException(
             status_code=403, detail="Super users are not allowed to delete themselves"
         )
@@ -218,4 +265,7 @@ def delete_user(
     session.exec(statement)  # type: ignore
     session.delete(user)
     session.commit()
+    user_cache.invalidate(user_id)
+    count_cache.invalidate(User)
+    count_cache.invalidate(Item, user_id)
     return Message(message="User deleted successfully")
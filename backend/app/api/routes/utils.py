@@ -2,6 +2,7 @@ from fastapi import APIRouter, Depends
 from pydantic.networks import EmailStr
 
 from app.api.deps import get_current_active_superuser
+from app.core import metrics
 from app.models import Message
 from app.utils import generate_test_email, send_email
 
@@ -24,3 +25,11 @@ def test_email(email_to: EmailStr) -> Message:
         html_content=email_data.html_content,
     )
     return Message(message="Test email sent")
+
+
+@router.get("/metrics/", dependencies=[Depends(get_current_active_superuser)])
+def read_metrics() -> dict[str, float]:
+    """
+    Counters of the worker process that served the request.
+    """
+    return metrics.snapshot()
@@ -0,0 +1,234 @@
+"""
+Generate summaries for conversations that have none.
+
+Conversations are read in id order, one chunk at a time, and summarized with
+bounded concurrency under a request rate limit. Each chunk is written back
+in a single statement, and the last id covered is saved to a checkpoint
+file, so an interrupted run picks up where it stopped.
+
+``--dry-run`` points the summarizer at the local stub provider and writes
+nothing, which makes it a benchmark for the whole pipeline:
+
+    python app/backfill_summaries.py --dry-run --stub-latency 0.2
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import time
+from dataclasses import dataclass
+from pathlib import Path
+
+from sqlmodel import col, select
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from app import crud
+from app.ai import clients
+from app.ai.assistant import (
+    AsyncLLMController,
+    generate_summary_async,
+    get_async_llm_controller,
+)
+from app.ai.stub_server import StubProviderServer
+from app.core.config import settings
+from app.core.db import async_engine
+from app.models import Conversation, ConversationUpdate
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+class RateLimiter:
+    """
+    Space calls at least ``1 / rate`` seconds apart.
+    """
+
+    def __init__(self, rate: float) -> None:
+        self.interval = 1 / rate if rate > 0 else 0.0
+        self._next = 0.0
+        self._lock = asyncio.Lock()
+
+    async def wait(self) -> None:
+        async with self._lock:
+            now = time.monotonic()
+            delay = self._next - now
+            self._next = max(now, self._next) + self.interval
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+
+@dataclass
+class BackfillStats:
+    conversations: int = 0
+    updated: int = 0
+    skipped: int = 0
+    failed: int = 0
+    seconds: float = 0.0
+
+
+def read_checkpoint(path: Path) -> int:
+    if not path.exists():
+        return 0
+    return int(json.loads(path.read_text())["last_id"])
+
+
+def write_checkpoint(path: Path, last_id: int) -> None:
+    tmp = path.with_suffix(path.suffix + ".tmp")
+    tmp.write_text(json.dumps({"last_id": last_id}))
+    os.replace(tmp, path)
+
+
+async def next_chunk(after_id: int, size: int) -> list[int]:
+    statement = (
+        select(Conversation.id)
+        .where(col(Conversation.summary).is_(None))
+        .where(col(Conversation.id) > after_id)
+        .order_by(col(Conversation.id))
+        .limit(size)
+    )
+    async with AsyncSession(async_engine) as session:
+        return [id for id in (await session.exec(statement)).all() if id is not None]
+
+
+async def summarize(
+    conv_id: int,
+    *,
+    llm: AsyncLLMController,
+    semaphore: asyncio.Semaphore,
+    limiter: RateLimiter,
+    stats: BackfillStats,
+) -> ConversationUpdate | None:
+    async with semaphore:
+        await limiter.wait()
+        try:
+            async with AsyncSession(async_engine) as session:
+                return await generate_summary_async(
+                    session=session, conv_id=conv_id, llm=llm
+                )
+        except Exception:
+            logger.exception("Could not summarize conversation %s", conv_id)
+            stats.failed += 1
+            return None
+
+
+async def backfill(
+    *,
+    llm: AsyncLLMController,
+    checkpoint: Path | None,
+    chunk_size: int = 500,
+    concurrency: int = 8,
+    rate: float = 10.0,
+    limit: int | None = None,
+    dry_run: bool = False,
+) -> BackfillStats:
+    """
+    Summarize conversations without a summary, starting after the checkpoint.
+
+    Conversations whose summary fails stay empty and are not retried within
+    the run; start over without the checkpoint to pick them up again. Ones
+    without messages, or summarized meanwhile by the worker, are skipped.
+    """
+    stats = BackfillStats()
+    semaphore = asyncio.Semaphore(concurrency)
+    limiter = RateLimiter(rate)
+    last_id = read_checkpoint(checkpoint) if checkpoint else 0
+    start = time.perf_counter()
+    while limit is None or stats.conversations < limit:
+        size = (
+            chunk_size
+            if limit is None
+            else min(chunk_size, limit - stats.conversations)
+        )
+        ids = await next_chunk(last_id, size)
+        if not ids:
+            break
+        results = await asyncio.gather(
+            *(
+                summarize(
+                    id, llm=llm, semaphore=semaphore, limiter=limiter, stats=stats
+                )
+                for id in ids
+            )
+        )
+        conversations_in = [result for result in results if result is not None]
+        stats.conversations += len(ids)
+        last_id = ids[-1]
+        if dry_run:
+            stats.updated += len(conversations_in)
+        else:
+            async with AsyncSession(async_engine) as session:
+                stats.updated += await crud.fill_conversation_summaries_async(
+                    session=session, conversations_in=conversations_in
+                )
+            if checkpoint:
+                write_checkpoint(checkpoint, last_id)
+            logger.info("Summarized up to conversation %s", last_id)
+        stats.skipped = stats.conversations - stats.updated - stats.failed
+    stats.seconds = time.perf_counter() - start
+    return stats
+
+
+async def run(args: argparse.Namespace) -> BackfillStats:
+    stub = None
+    if args.dry_run:
+        stub = StubProviderServer(completion_latency=args.stub_latency).start()
+        llm = AsyncLLMController(
+            openai_client=clients.get_async_openai_client(stub.base_url)
+        )
+    else:
+        llm = get_async_llm_controller()
+    try:
+        return await backfill(
+            llm=llm,
+            checkpoint=None if args.dry_run else args.checkpoint,
+            chunk_size=args.chunk_size,
+            concurrency=args.concurrency,
+            rate=args.rate,
+            limit=args.limit,
+            dry_run=args.dry_run,
+        )
+    finally:
+        await clients.aclose_clients()
+        await async_engine.dispose()
+        if stub is not None:
+            stub.stop()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--chunk-size", type=int, default=500)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument(
+        "--rate", type=float, default=10.0, help="provider requests per second"
+    )
+    parser.add_argument("--limit", type=int, default=None)
+    parser.add_argument(
+        "--checkpoint", type=Path, default=Path("backfill_summaries.checkpoint")
+    )
+    parser.add_argument("--dry-run", action="store_true")
+    parser.add_argument("--stub-latency", type=float, default=0.0)
+    args = parser.parse_args()
+    if settings.AI_PROVIDER == "mock" and not args.dry_run:
+        parser.error("AI_PROVIDER is mock, summaries would be placeholders")
+
+    logger.info("Backfilling conversation summaries")
+    stats = asyncio.run(run(args))
+    rate = stats.conversations / stats.seconds if stats.seconds else 0.0
+    logger.info(
+        "Done: %s conversations, %s summarized, %s skipped, %s failed "
+        "in %.1fs (%.1f/s)",
+        stats.conversations,
+        stats.updated,
+        stats.skipped,
+        stats.failed,
+        stats.seconds,
+        rate,
+    )
+
+
+if __name__ == "__main__":
+    main()
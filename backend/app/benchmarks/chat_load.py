@@ -0,0 +1,115 @@
+"""
+Load test of the whole chat path against the in-process stub provider.
+
+Concurrent users post first questions to ``/chat/`` through the ASGI app, so
+every turn goes through auth, the database, moderation and a completion over
+HTTP. The stub's latency distribution, token rate, error rate and 429s come
+from the flags. Run with ``python -m app.benchmarks.chat_load``, e.g.
+
+    python -m app.benchmarks.chat_load --users 32 --turns 20 \\
+        --completion-latency lognormal:0.8,0.5 --tokens-per-second 50
+"""
+
+import argparse
+import asyncio
+import statistics
+import time
+from collections import Counter
+
+import httpx
+from sqlmodel import Session
+
+from app.ai import clients, providers
+from app.core.config import settings
+from app.core.db import async_engine, engine, init_db
+from app.main import app
+
+API = f"http://test{settings.API_V1_STR}"
+
+
+async def user(
+    client: httpx.AsyncClient,
+    headers: dict[str, str],
+    *,
+    turns: int,
+    timings: list[float],
+    statuses: Counter[int],
+) -> None:
+    for _ in range(turns):
+        start = time.perf_counter()
+        response = await client.post(
+            f"{API}/chat/",
+            headers=headers,
+            json={"content": "Explain list comprehension"},
+        )
+        timings.append((time.perf_counter() - start) * 1000)
+        statuses[response.status_code] += 1
+
+
+async def run(users: int, turns: int) -> None:
+    # httpx 0.25, as locked, types app narrower than FastAPI; newer ones do not
+    transport = httpx.ASGITransport(app=app, raise_app_exceptions=False)  # type: ignore[arg-type,unused-ignore]
+    async with httpx.AsyncClient(transport=transport, timeout=None) as client:
+        response = await client.post(
+            f"{API}/login/access-token",
+            data={
+                "username": settings.FIRST_SUPERUSER,
+                "password": settings.FIRST_SUPERUSER_PASSWORD,
+            },
+        )
+        headers = {"Authorization": f"Bearer {response.json()['access_token']}"}
+        timings: list[float] = []
+        statuses: Counter[int] = Counter()
+        start = time.perf_counter()
+        await asyncio.gather(
+            *(
+                user(client, headers, turns=turns, timings=timings, statuses=statuses)
+                for _ in range(users)
+            )
+        )
+        elapsed = time.perf_counter() - start
+    await clients.aclose_clients()
+    await async_engine.dispose()
+
+    ordered = sorted(timings)
+    stub = providers.get_stub_server()
+    print(
+        f"users={users} turns={len(timings)} {len(timings) / elapsed:.1f} turns/s "
+        f"p50={statistics.median(ordered):.0f}ms "
+        f"p95={ordered[int(len(ordered) * 0.95) - 1]:.0f}ms "
+        f"p99={ordered[int(len(ordered) * 0.99) - 1]:.0f}ms"
+    )
+    print(
+        f"statuses={dict(statuses)} provider requests={stub.requests} "
+        f"500s={stub.failed} 429s={stub.rate_limited}"
+    )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--users", type=int, default=16)
+    parser.add_argument("--turns", type=int, default=10)
+    parser.add_argument("--completion-latency", default="lognormal:0.5,0.5")
+    parser.add_argument("--moderation-latency", default="lognormal:0.1,0.3")
+    parser.add_argument("--tokens-per-second", type=float, default=0.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0)
+    parser.add_argument("--requests-per-minute", type=int, default=None)
+    args = parser.parse_args()
+
+    settings.AI_PROVIDER = "stub"
+    settings.AI_STUB_COMPLETION_LATENCY = args.completion_latency
+    settings.AI_STUB_MODERATION_LATENCY = args.moderation_latency
+    settings.AI_STUB_TOKENS_PER_SECOND = args.tokens_per_second
+    settings.AI_STUB_ERROR_RATE = args.error_rate
+    settings.AI_STUB_RATE_LIMIT_RATE = args.rate_limit_rate
+    settings.AI_STUB_REQUESTS_PER_MINUTE = args.requests_per_minute
+    with Session(engine) as session:
+        init_db(session)
+    asyncio.run(run(args.users, args.turns))
+
+
+if __name__ == "__main__":
+    main()
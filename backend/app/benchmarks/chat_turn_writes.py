@@ -0,0 +1,126 @@
+"""
+Database round trips of one chat turn.
+
+Runs chat turns one after another through the ASGI app with the mock
+provider and counts what each turn sends to Postgres over the async engine:
+statements by kind, and commits, each of which waits for a WAL flush. Auth
+runs on the sync engine and is left out. Run with
+``python -m app.benchmarks.chat_turn_writes``, e.g.
+
+    python -m app.benchmarks.chat_turn_writes --turns 50
+"""
+
+import argparse
+import asyncio
+import statistics
+import time
+import uuid
+from collections import Counter
+from typing import Any
+
+import httpx
+from sqlalchemy import event
+from sqlmodel import Session
+
+from app.core.config import settings
+from app.core.db import async_engine, engine, init_db
+from app.main import app
+
+API = f"http://test{settings.API_V1_STR}"
+
+
+class RoundTrips:
+    def __init__(self) -> None:
+        self.statements: Counter[str] = Counter()
+        self.commits = 0
+
+    def statement(self, _conn: Any, _cursor: Any, statement: str, *_: Any) -> None:
+        self.statements[statement.split(None, 1)[0].upper()] += 1
+
+    def commit(self, _conn: Any) -> None:
+        self.commits += 1
+
+
+async def turn(
+    client: httpx.AsyncClient,
+    headers: dict[str, str],
+    path: str,
+) -> Any:
+    json = {"content": f"Question {uuid.uuid4()}"}
+    if not path.endswith("stream"):
+        response = await client.post(f"{API}{path}", headers=headers, json=json)
+        return response.json()
+    async with client.stream(
+        "POST", f"{API}{path}", headers=headers, json=json
+    ) as response:
+        async for _ in response.aiter_lines():
+            pass
+    return None
+
+
+async def measure(
+    client: httpx.AsyncClient, headers: dict[str, str], flow: str, turns: int
+) -> None:
+    trips = RoundTrips()
+    timings: list[float] = []
+    conversation_id = (await turn(client, headers, "/chat/"))["conversation_id"]
+    sync_engine = async_engine.sync_engine
+    event.listen(sync_engine, "before_cursor_execute", trips.statement)
+    event.listen(sync_engine, "commit", trips.commit)
+    try:
+        for _ in range(turns):
+            path = {
+                "new": "/chat/",
+                "new-stream": "/chat/stream",
+                "continue": f"/chat/{conversation_id}",
+                "continue-stream": f"/chat/{conversation_id}/stream",
+            }[flow]
+            start = time.perf_counter()
+            await turn(client, headers, path)
+            timings.append((time.perf_counter() - start) * 1000)
+    finally:
+        event.remove(sync_engine, "before_cursor_execute", trips.statement)
+        event.remove(sync_engine, "commit", trips.commit)
+    kinds = " ".join(
+        f"{kind.lower()}={count / turns:.1f}"
+        for kind, count in sorted(trips.statements.items())
+    )
+    print(
+        f"{flow:16s} statements/turn={sum(trips.statements.values()) / turns:4.1f} "
+        f"({kinds}) commits/turn={trips.commits / turns:.1f} "
+        f"p50={statistics.median(timings):.1f}ms"
+    )
+
+
+async def run(turns: int) -> None:
+    # httpx 0.25, as locked, types app narrower than FastAPI; newer ones do not
+    transport = httpx.ASGITransport(app=app)  # type: ignore[arg-type,unused-ignore]
+    async with httpx.AsyncClient(transport=transport, timeout=None) as client:
+        response = await client.post(
+            f"{API}/login/access-token",
+            data={
+                "username": settings.FIRST_SUPERUSER,
+                "password": settings.FIRST_SUPERUSER_PASSWORD,
+            },
+        )
+        headers = {"Authorization": f"Bearer {response.json()['access_token']}"}
+        for flow in ("new", "new-stream", "continue", "continue-stream"):
+            await measure(client, headers, flow, turns)
+    await async_engine.dispose()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--turns", type=int, default=20)
+    args = parser.parse_args()
+
+    settings.AI_PROVIDER = "mock"
+    with Session(engine) as session:
+        init_db(session)
+    asyncio.run(run(args.turns))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+"""
+Where the sync connection pool saturates.
+
+Each level runs that many threads, like the request threadpool, and each
+request holds a session for ``--hold`` seconds, the way a handler holds one
+across a slow call. Throughput grows with concurrency until it reaches
+``POSTGRES_POOL_SIZE + POSTGRES_MAX_OVERFLOW`` connections. Past that point
+requests queue on checkout, and once the wait exceeds
+``POSTGRES_POOL_TIMEOUT_SECONDS`` they fail. Run with
+``python -m app.benchmarks.db_pool_load``, e.g.
+
+    python -m app.benchmarks.db_pool_load --levels 10,20,40,60 --hold 0.2
+"""
+
+import argparse
+import statistics
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from sqlalchemy import text
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from sqlmodel import Session
+
+from app.core import metrics
+from app.core.config import settings
+from app.core.db import engine
+
+
+def request(hold: float) -> float | None:
+    """
+    One request: wait for a connection, hold it for ``hold`` seconds.
+
+    Returns the checkout wait, or None when the pool timed out.
+    """
+    start = time.perf_counter()
+    try:
+        with Session(engine) as session:
+            session.connection()
+            waited = time.perf_counter() - start
+            session.execute(text("SELECT pg_sleep(:hold)"), {"hold": hold})
+    except PoolTimeoutError:
+        return None
+    return waited
+
+
+def run_level(threads: int, requests: int, hold: float) -> None:
+    checkouts = metrics.get("db.pool.checkouts")
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        results = list(executor.map(request, [hold] * requests))
+    elapsed = time.perf_counter() - start
+    waits = sorted(wait * 1000 for wait in results if wait is not None)
+    timeouts = results.count(None)
+    p95 = waits[max(int(len(waits) * 0.95) - 1, 0)] if waits else 0.0
+    print(
+        f"threads={threads:3d} {len(waits) / elapsed:7.1f} req/s "
+        f"checkout wait p50={statistics.median(waits) if waits else 0:6.0f}ms "
+        f"p95={p95:6.0f}ms timeouts={timeouts} "
+        f"checkouts={metrics.get('db.pool.checkouts') - checkouts:.0f}"
+    )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--levels", default="5,10,20,40,60,80")
+    parser.add_argument("--requests-per-thread", type=int, default=5)
+    parser.add_argument("--hold", type=float, default=0.1)
+    args = parser.parse_args()
+
+    print(
+        f"pool_size={settings.POSTGRES_POOL_SIZE} "
+        f"max_overflow={settings.POSTGRES_MAX_OVERFLOW} "
+        f"pool_timeout={settings.POSTGRES_POOL_TIMEOUT_SECONDS}s hold={args.hold}s"
+    )
+    for threads in (int(level) for level in args.levels.split(",")):
+        run_level(threads, threads * args.requests_per_thread, args.hold)
+    engine.dispose()
+
+
+if __name__ == "__main__":
+    main()
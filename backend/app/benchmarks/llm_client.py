@@ -0,0 +1,95 @@
+"""
+Per-turn latency of the provider path, fresh client vs pooled client.
+
+A chat turn is one moderation call followed by one completion, both sent to a
+local stub provider. Run with ``python -m app.benchmarks.llm_client``.
+"""
+
+import argparse
+import asyncio
+import statistics
+import time
+from collections.abc import AsyncIterator, Callable
+from contextlib import AbstractAsyncContextManager, asynccontextmanager
+
+from openai import AsyncOpenAI
+
+from app.ai import clients
+from app.ai.assistant import AsyncLLMController, SystemPrompts
+from app.ai.stub_server import StubProviderServer
+from app.core.config import settings
+from app.models import CnvMessage
+
+
+async def run_turn(llm: AsyncLLMController, messages: list[CnvMessage]) -> None:
+    await llm.moderate_input_is_flagged(messages[-1].content)
+    await llm.single_completion(
+        system_input=SystemPrompts.assistant, messages_list=messages
+    )
+
+
+async def measure(
+    controller: Callable[[], AbstractAsyncContextManager[AsyncLLMController]],
+    turns: int,
+) -> list[float]:
+    messages = [CnvMessage(role="user", content="Explain list comprehension")]
+    timings = []
+    for _ in range(turns):
+        start = time.perf_counter()
+        async with controller() as llm:
+            await run_turn(llm, messages)
+        timings.append((time.perf_counter() - start) * 1000)
+    return timings
+
+
+def report(name: str, timings: list[float], connections: int) -> None:
+    ordered = sorted(timings)
+    p95 = ordered[int(len(ordered) * 0.95) - 1]
+    print(
+        f"{name:<8} mean={statistics.mean(timings):7.2f}ms "
+        f"p50={statistics.median(timings):7.2f}ms p95={p95:7.2f}ms "
+        f"connections={connections}"
+    )
+
+
+async def run(stub: StubProviderServer, turns: int) -> None:
+    @asynccontextmanager
+    async def fresh() -> AsyncIterator[AsyncLLMController]:
+        # What every request did before: a new SDK client and HTTP pool
+        client = AsyncOpenAI(api_key=settings.OPEN_API_KEY, base_url=stub.base_url)
+        try:
+            yield AsyncLLMController(openai_client=client)
+        finally:
+            await client.close()
+
+    timings = await measure(fresh, turns)
+    report("fresh", timings, stub.connections)
+
+    stub.connections = 0
+    pooled_controller = AsyncLLMController(
+        openai_client=clients.get_async_openai_client(stub.base_url)
+    )
+
+    @asynccontextmanager
+    async def pooled() -> AsyncIterator[AsyncLLMController]:
+        yield pooled_controller
+
+    timings = await measure(pooled, turns)
+    report("pooled", timings, stub.connections)
+    await clients.aclose_clients()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--turns", type=int, default=200)
+    parser.add_argument("--latency", type=float, default=0.0)
+    args = parser.parse_args()
+
+    with StubProviderServer(
+        completion_latency=args.latency, moderation_latency=args.latency
+    ) as stub:
+        asyncio.run(run(stub, args.turns))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,132 @@
+"""
+Login throughput under concurrency, and what it does to other requests.
+
+Concurrent clients post to ``/login/access-token`` through the ASGI app
+while a probe keeps calling a cheap authenticated endpoint that runs on the
+request threadpool. bcrypt runs on the ``PASSWORD_HASH_WORKERS`` threads, so
+the probe latency should stay flat however many logins queue up; logins past
+``PASSWORD_HASH_MAX_QUEUE`` are answered with 503. Run with
+``python -m app.benchmarks.login_load``, e.g.
+
+    python -m app.benchmarks.login_load --clients 64 --logins 10 --workers 2
+"""
+
+import argparse
+import asyncio
+import statistics
+import time
+from collections import Counter
+
+import httpx
+from sqlmodel import Session
+
+from app.core import security
+from app.core.config import settings
+from app.core.db import async_engine, engine, init_db
+from app.main import app
+
+API = f"http://test{settings.API_V1_STR}"
+
+CREDENTIALS = {
+    "username": settings.FIRST_SUPERUSER,
+    "password": settings.FIRST_SUPERUSER_PASSWORD,
+}
+
+
+def percentiles(timings: list[float]) -> str:
+    if not timings:
+        return "n/a"
+    ordered = sorted(timings)
+    return (
+        f"p50={statistics.median(ordered):.0f}ms "
+        f"p95={ordered[max(int(len(ordered) * 0.95) - 1, 0)]:.0f}ms"
+    )
+
+
+async def login_client(
+    client: httpx.AsyncClient,
+    *,
+    logins: int,
+    timings: list[float],
+    statuses: Counter[int],
+) -> None:
+    for _ in range(logins):
+        start = time.perf_counter()
+        response = await client.post(f"{API}/login/access-token", data=CREDENTIALS)
+        timings.append((time.perf_counter() - start) * 1000)
+        statuses[response.status_code] += 1
+
+
+async def probe(
+    client: httpx.AsyncClient,
+    headers: dict[str, str],
+    *,
+    timings: list[float],
+    stop: asyncio.Event,
+) -> None:
+    while not stop.is_set():
+        start = time.perf_counter()
+        await client.post(f"{API}/login/test-token", headers=headers)
+        timings.append((time.perf_counter() - start) * 1000)
+        await asyncio.sleep(0.01)
+
+
+async def run(clients: int, logins: int) -> None:
+    # httpx 0.25, as locked, types app narrower than FastAPI; newer ones do not
+    transport = httpx.ASGITransport(app=app)  # type: ignore[arg-type,unused-ignore]
+    async with httpx.AsyncClient(transport=transport, timeout=None) as client:
+        response = await client.post(f"{API}/login/access-token", data=CREDENTIALS)
+        headers = {"Authorization": f"Bearer {response.json()['access_token']}"}
+        login_timings: list[float] = []
+        probe_timings: list[float] = []
+        statuses: Counter[int] = Counter()
+        stop = asyncio.Event()
+        probing = asyncio.create_task(
+            probe(client, headers, timings=probe_timings, stop=stop)
+        )
+        start = time.perf_counter()
+        await asyncio.gather(
+            *(
+                login_client(
+                    client, logins=logins, timings=login_timings, statuses=statuses
+                )
+                for _ in range(clients)
+            )
+        )
+        elapsed = time.perf_counter() - start
+        stop.set()
+        await probing
+    await async_engine.dispose()
+
+    succeeded = statuses[200]
+    print(
+        f"clients={clients} workers={settings.PASSWORD_HASH_WORKERS} "
+        f"{succeeded / elapsed:.1f} logins/s login {percentiles(login_timings)}"
+    )
+    print(f"statuses={dict(statuses)} probe {percentiles(probe_timings)}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--clients", type=int, default=32)
+    parser.add_argument("--logins", type=int, default=5)
+    parser.add_argument("--workers", type=int, default=settings.PASSWORD_HASH_WORKERS)
+    parser.add_argument(
+        "--max-queue", type=int, default=settings.PASSWORD_HASH_MAX_QUEUE
+    )
+    args = parser.parse_args()
+
+    settings.PASSWORD_HASH_WORKERS = args.workers
+    settings.PASSWORD_HASH_MAX_QUEUE = args.max_queue
+    security.password_hasher = security.PasswordHasher(
+        workers=args.workers, max_queue=args.max_queue
+    )
+    with Session(engine) as session:
+        init_db(session)
+    asyncio.run(run(args.clients, args.logins))
+
+
+if __name__ == "__main__":
+    main()
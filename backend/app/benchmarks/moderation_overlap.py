@@ -0,0 +1,73 @@
+"""
+Per-turn latency with moderation before vs alongside the completion.
+
+The stub provider injects a fixed delay into each endpoint, so the expected
+turn time is ``moderation + completion`` sequentially and roughly
+``max(moderation, completion)`` concurrently. Run with
+``python -m app.benchmarks.moderation_overlap``.
+"""
+
+import argparse
+import asyncio
+import statistics
+import time
+
+from app.ai import clients
+from app.ai.assistant import (
+    AsyncLLMController,
+    SystemPrompts,
+    moderated_completion_async,
+)
+from app.ai.stub_server import StubProviderServer
+from app.models import CnvMessage
+
+
+async def measure(
+    llm: AsyncLLMController, *, concurrent: bool, turns: int, content: str
+) -> list[float]:
+    messages = [CnvMessage(role="user", content=content)]
+    timings = []
+    for _ in range(turns):
+        start = time.perf_counter()
+        await moderated_completion_async(
+            llm,
+            system_input=SystemPrompts.assistant,
+            messages_list=messages,
+            concurrent=concurrent,
+        )
+        timings.append((time.perf_counter() - start) * 1000)
+    return timings
+
+
+async def run(base_url: str, turns: int) -> None:
+    llm = AsyncLLMController(openai_client=clients.get_async_openai_client(base_url))
+    for content in ("Explain list comprehension", "something unsafe"):
+        for concurrent in (False, True):
+            timings = await measure(
+                llm, concurrent=concurrent, turns=turns, content=content
+            )
+            mode = "concurrent" if concurrent else "sequential"
+            print(
+                f"{content[:16]:<16} {mode:<10} "
+                f"mean={statistics.mean(timings):7.2f}ms "
+                f"p50={statistics.median(timings):7.2f}ms"
+            )
+    await clients.aclose_clients()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--turns", type=int, default=20)
+    parser.add_argument("--moderation-latency", type=float, default=0.15)
+    parser.add_argument("--completion-latency", type=float, default=0.4)
+    args = parser.parse_args()
+
+    with StubProviderServer(
+        moderation_latency=args.moderation_latency,
+        completion_latency=args.completion_latency,
+    ) as stub:
+        asyncio.run(run(stub.base_url, args.turns))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,3 +1,4 @@
+import json
 import secrets
 import warnings
 from typing import Annotated, Any, Literal
@@ -23,6 +24,20 @@ def parse_cors(v: Any) -> list[str] | str:
     raise ValueError(v)
 
 
+def parse_replica_uris(v: Any) -> list[str]:
+    """
+    Replica DSNs, as a JSON list or separated by commas. A multi-host DSN has
+    commas of its own, so it has to come in a JSON list.
+    """
+    if isinstance(v, str):
+        if not v.startswith("["):
+            return [uri.strip() for uri in v.split(",") if uri.strip()]
+        v = json.loads(v)
+    if isinstance(v, list) and all(isinstance(uri, str) for uri in v):
+        return v
+    raise ValueError(v)
+
+
 class Settings(BaseSettings):
     model_config = SettingsConfigDict(
         env_file=".env", env_ignore_empty=True, extra="ignore"
@@ -31,6 +46,18 @@ class Settings(BaseSettings):
     SECRET_KEY: str = secrets.token_urlsafe(32)
     # 60 minutes * 24 hours * 8 days = 8 days
     ACCESS_TOKEN_EXPIRE_MINUTES: int = 60 * 24 * 8
+    # Decoded tokens and user snapshots kept per process; a change made by
+    # another process shows up once the snapshot expires
+    AUTH_CACHE_SIZE: int = 10_000
+    AUTH_CACHE_TTL_SECONDS: int = 30
+    # Totals of list endpoints kept per owner and process; a create or delete
+    # in another process shows up once the count expires
+    LIST_COUNT_CACHE_SIZE: int = 10_000
+    LIST_COUNT_CACHE_TTL_SECONDS: int = 60
+    # bcrypt runs on its own threads, so a login storm cannot take the ones
+    # serving other requests; past the queue limit logins get a 503
+    PASSWORD_HASH_WORKERS: int = 4
+    PASSWORD_HASH_MAX_QUEUE: int = 64
     DOMAIN: str = "localhost"
     ENVIRONMENT: Literal["local", "staging", "production"] = "local"
 
@@ -53,6 +80,33 @@ class Settings(BaseSettings):
     POSTGRES_USER: str
     POSTGRES_PASSWORD: str
     POSTGRES_DB: str = ""
+    # Each backend process has a sync pool, for the request threadpool, and an
+    # async pool, for the chat routes and jobs. One process can open up to
+    # POOL_SIZE + MAX_OVERFLOW + ASYNC_POOL_SIZE + ASYNC_MAX_OVERFLOW
+    # connections (30 by default), plus the same again per replica for the
+    # sync pool. Multiply by the number of gunicorn workers (one per core by
+    # default) and add the job workers; the sum must stay below the server's
+    # max_connections, 100 on a stock Postgres. Threads past the sync pool wait
+    # up to POSTGRES_POOL_TIMEOUT_SECONDS for a connection.
+    POSTGRES_POOL_SIZE: int = 5
+    POSTGRES_MAX_OVERFLOW: int = 10
+    POSTGRES_ASYNC_POOL_SIZE: int = 5
+    POSTGRES_ASYNC_MAX_OVERFLOW: int = 10
+    POSTGRES_POOL_TIMEOUT_SECONDS: float = 10.0
+    POSTGRES_POOL_RECYCLE_SECONDS: int = 30 * 60
+    POSTGRES_POOL_PRE_PING: bool = True
+    # Server-side limits per connection; 0 turns a limit off
+    POSTGRES_STATEMENT_TIMEOUT_MS: int = 30_000
+    POSTGRES_IDLE_IN_TRANSACTION_TIMEOUT_MS: int = 60_000
+    POSTGRES_APPLICATION_NAME: str = "study-genius-backend"
+    # Read-only endpoints go to these, except for a client that wrote within
+    # the read-your-writes window; a replica that fails to connect is skipped
+    # for POSTGRES_REPLICA_RETRY_SECONDS
+    POSTGRES_REPLICA_URIS: Annotated[
+        list[str] | str, BeforeValidator(parse_replica_uris)
+    ] = []
+    POSTGRES_READ_YOUR_WRITES_SECONDS: float = 5.0
+    POSTGRES_REPLICA_RETRY_SECONDS: float = 30.0
 
     @computed_field  # type: ignore[misc]
     @property
@@ -96,8 +150,88 @@ class Settings(BaseSettings):
     FIRST_SUPERUSER_PASSWORD: str
     USERS_OPEN_REGISTRATION: bool = False
 
+    # Where LLM requests go, see app/ai/providers.py; unset follows the older
+    # AI_MOCK_REST_CALLS switch
+    AI_PROVIDER: Literal["openai", "mock", "stub"] | None = None
     AI_MOCK_REST_CALLS: bool = True
+
+    @model_validator(mode="after")
+    def _set_default_ai_provider(self) -> Self:
+        if self.AI_PROVIDER is None:
+            self.AI_PROVIDER = "mock" if self.AI_MOCK_REST_CALLS else "openai"
+        return self
+
+    # In-process stub provider; latencies take e.g. "0.5" or "lognormal:0.8,0.5"
+    AI_STUB_PORT: int = 0
+    AI_STUB_ANSWER: str = "Stub answer"
+    AI_STUB_COMPLETION_LATENCY: str = "0"
+    AI_STUB_MODERATION_LATENCY: str = "0"
+    AI_STUB_TOKENS_PER_SECOND: float = 0.0
+    AI_STUB_ERROR_RATE: float = 0.0
+    AI_STUB_RATE_LIMIT_RATE: float = 0.0
+    AI_STUB_REQUESTS_PER_MINUTE: int | None = None
     OPEN_API_KEY: str = "NoKey"
+    # Provider HTTP pool, shared by every LLM call in the process
+    OPENAI_BASE_URL: str | None = None
+    OPENAI_MAX_CONNECTIONS: int = 100
+    OPENAI_MAX_KEEPALIVE_CONNECTIONS: int = 20
+    OPENAI_KEEPALIVE_EXPIRY: float = 30.0
+    OPENAI_CONNECT_TIMEOUT: float = 5.0
+    OPENAI_READ_TIMEOUT: float = 60.0
+    OPENAI_POOL_TIMEOUT: float = 10.0
+    OPENAI_MAX_RETRIES: int = 2
+    # Client-side provider limits; "postgres" shares them across processes
+    AI_RATE_LIMIT_BACKEND: Literal["none", "memory", "postgres"] = "none"
+    AI_RATE_LIMIT_COMPLETION_RPM: int = 3500
+    AI_RATE_LIMIT_COMPLETION_TPM: int = 90_000
+    AI_RATE_LIMIT_MODERATION_RPM: int = 1000
+    AI_RATE_LIMIT_BURST_SECONDS: float = 10.0
+    AI_RATE_LIMIT_MAX_IN_FLIGHT: int = 64
+    AI_RATE_LIMIT_WAIT_SECONDS: float = 30.0
+    AI_RATE_LIMIT_LEASE_SECONDS: float = 300.0
+    # Completion deadline, retries, hedging, and the breaker that fails fast or
+    # falls back to a cached or static answer while the provider is down
+    AI_COMPLETION_TIMEOUT_SECONDS: float = 60.0
+    AI_COMPLETION_MAX_ATTEMPTS: int = 3
+    AI_COMPLETION_RETRY_BASE_SECONDS: float = 0.5
+    AI_COMPLETION_RETRY_MAX_SECONDS: float = 8.0
+    AI_COMPLETION_HEDGE_PERCENTILE: float | None = None
+    AI_COMPLETION_HEDGE_MIN_SAMPLES: int = 20
+    AI_CIRCUIT_FAILURE_THRESHOLD: int = 5
+    AI_CIRCUIT_RESET_SECONDS: float = 30.0
+    AI_COMPLETION_FALLBACK: bool = True
+    # Start moderation and completion together instead of one after the other
+    AI_CONCURRENT_MODERATION: bool = False
+    # Moderation verdict cache; size 0 disables it
+    AI_MODERATION_CACHE_SIZE: int = 10_000
+    AI_MODERATION_CACHE_TTL_SECONDS: int = 60 * 60 * 24
+    AI_MODERATION_CACHE_PERSISTENT: bool = False
+    # Completion cache for first turns and temperature 0; empty models disables it
+    AI_COMPLETION_CACHE_MODELS: list[str] = []
+    AI_COMPLETION_CACHE_SIZE: int = 1000
+    AI_COMPLETION_CACHE_TTL_SECONDS: int = 60 * 60 * 24
+    AI_COMPLETION_CACHE_PERSISTENT: bool = False
+    # Reuse answers to first questions that mean the same, by cosine similarity
+    AI_SEMANTIC_CACHE_ENABLED: bool = False
+    AI_SEMANTIC_CACHE_THRESHOLD: float = 0.9
+    AI_SEMANTIC_CACHE_SIZE: int = 10_000
+    AI_SEMANTIC_CACHE_DIMENSIONS: int = 512
+    # Prompt budget for conversation history; "tiktoken" needs its BPE files
+    AI_CONTEXT_MAX_TOKENS: int = 6000
+    AI_CONTEXT_MAX_MESSAGES: int = 50
+    AI_CONTEXT_TOKENIZER: Literal["approximate", "tiktoken"] = "approximate"
+    # Fold new messages into the summary once this many have built up
+    AI_SUMMARY_REFRESH_MESSAGES: int = 10
+    AI_SUMMARY_REFRESH_TOKENS: int = 1500
+    # Background job worker, see app/worker.py
+    JOBS_WORKER_CONCURRENCY: int = 4
+    JOBS_POLL_INTERVAL_SECONDS: float = 1.0
+    JOBS_LEASE_SECONDS: int = 5 * 60
+    JOBS_MAX_ATTEMPTS: int = 5
+    JOBS_RETRY_BASE_SECONDS: float = 2.0
+    JOBS_RETRY_MAX_SECONDS: float = 5 * 60
+    # Done and failed jobs are kept this long, for inspection
+    JOBS_RETENTION_SECONDS: int = 7 * 24 * 60 * 60
 
     def _check_default_secret(self, var_name: str, value: str | None) -> None:
         if value == "changethis":
@@ -0,0 +1,42 @@
+"""
+Row counts of list endpoints, kept for a short while so that paging through
+a list does not count it again on every page.
+
+Counts are kept per model and owner, and under owner ``None`` for lists
+across all owners. Creating or deleting a row drops its owner's count and
+the overall one in this process; other processes pick the change up once
+their count expires after ``LIST_COUNT_CACHE_TTL_SECONDS``.
+"""
+
+from sqlmodel import SQLModel
+
+from app.core import metrics
+from app.core.cache import TTLCache
+from app.core.config import settings
+
+
+class CountCache:
+    def __init__(self, *, maxsize: int, ttl: float) -> None:
+        self.counts: TTLCache[tuple[str, int | None], int] = TTLCache(
+            maxsize=maxsize, ttl=ttl
+        )
+
+    def get(self, model: type[SQLModel], owner_id: int | None = None) -> int | None:
+        count = self.counts.get((model.__name__, owner_id))
+        metrics.increment("count_cache.misses" if count is None else "count_cache.hits")
+        return count
+
+    def set(self, model: type[SQLModel], owner_id: int | None, count: int) -> None:
+        self.counts.set((model.__name__, owner_id), count)
+
+    def invalidate(self, model: type[SQLModel], owner_id: int | None = None) -> None:
+        self.counts.pop((model.__name__, owner_id))
+        self.counts.pop((model.__name__, None))
+
+    def clear(self) -> None:
+        self.counts.clear()
+
+
+count_cache = CountCache(
+    maxsize=settings.LIST_COUNT_CACHE_SIZE, ttl=settings.LIST_COUNT_CACHE_TTL_SECONDS
+)
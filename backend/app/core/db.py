@@ -1,10 +1,92 @@
+import time
+from collections.abc import Callable
+from typing import Any
+
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from sqlalchemy.ext.asyncio import create_async_engine
+from sqlalchemy.pool import AsyncAdaptedQueuePool, ConnectionPoolEntry, QueuePool
 from sqlmodel import Session, create_engine, select
 
 from app import crud
+from app.core import metrics
 from app.core.config import settings
 from app.models import User, UserCreate
 
-engine = create_engine(str(settings.SQLALCHEMY_DATABASE_URI))
+
+def timed_checkout(
+    prefix: str, get: Callable[[], ConnectionPoolEntry]
+) -> ConnectionPoolEntry:
+    """
+    Take a connection from a pool, counting checkouts, the time spent waiting
+    for one, and checkouts that gave up after the pool timeout.
+    """
+    started = time.perf_counter()
+    try:
+        connection = get()
+    except PoolTimeoutError:
+        metrics.increment(f"{prefix}.checkout_timeouts")
+        raise
+    metrics.increment(f"{prefix}.checkouts")
+    metrics.increment(f"{prefix}.checkout_wait_seconds", time.perf_counter() - started)
+    return connection
+
+
+class MeteredQueuePool(QueuePool):
+    metrics_prefix = "db.pool"
+
+    def _do_get(self) -> ConnectionPoolEntry:
+        connection = timed_checkout(self.metrics_prefix, super()._do_get)
+        metrics.set_gauge(f"{self.metrics_prefix}.checked_out", self.checkedout())
+        return connection
+
+
+class MeteredReplicaQueuePool(MeteredQueuePool):
+    metrics_prefix = "db.replica_pool"
+
+
+class MeteredAsyncQueuePool(AsyncAdaptedQueuePool):
+    def _do_get(self) -> ConnectionPoolEntry:
+        connection = timed_checkout("db.async_pool", super()._do_get)
+        metrics.set_gauge("db.async_pool.checked_out", self.checkedout())
+        return connection
+
+
+def engine_options(*, asynchronous: bool = False) -> dict[str, Any]:
+    """
+    Pool and connection settings; the async engine has a pool size of its own.
+    """
+    options = [
+        f"-c statement_timeout={settings.POSTGRES_STATEMENT_TIMEOUT_MS}",
+        "-c idle_in_transaction_session_timeout="
+        f"{settings.POSTGRES_IDLE_IN_TRANSACTION_TIMEOUT_MS}",
+    ]
+    return {
+        "pool_size": settings.POSTGRES_ASYNC_POOL_SIZE
+        if asynchronous
+        else settings.POSTGRES_POOL_SIZE,
+        "max_overflow": settings.POSTGRES_ASYNC_MAX_OVERFLOW
+        if asynchronous
+        else settings.POSTGRES_MAX_OVERFLOW,
+        "pool_timeout": settings.POSTGRES_POOL_TIMEOUT_SECONDS,
+        "pool_recycle": settings.POSTGRES_POOL_RECYCLE_SECONDS,
+        "pool_pre_ping": settings.POSTGRES_POOL_PRE_PING,
+        "connect_args": {
+            "application_name": settings.POSTGRES_APPLICATION_NAME,
+            "options": " ".join(options),
+        },
+    }
+
+
+engine = create_engine(
+    str(settings.SQLALCHEMY_DATABASE_URI),
+    poolclass=MeteredQueuePool,
+    **engine_options(),
+)
+async_engine = create_async_engine(
+    str(settings.SQLALCHEMY_DATABASE_URI),
+    poolclass=MeteredAsyncQueuePool,
+    **engine_options(asynchronous=True),
+)
 
 
 # make sure all SQLModel models are imported (app.models) before initializing DB
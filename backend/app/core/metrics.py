@@ -0,0 +1,37 @@
+"""
+In-process counters and gauges, e.g. cache hits or queue depth.
+
+Values are per worker process; they are exposed to superusers through
+``GET /utils/metrics/``.
+"""
+
+import threading
+from collections import defaultdict
+
+_lock = threading.Lock()
+_values: defaultdict[str, float] = defaultdict(float)
+
+
+def increment(name: str, value: float = 1) -> None:
+    with _lock:
+        _values[name] += value
+
+
+def set_gauge(name: str, value: float) -> None:
+    with _lock:
+        _values[name] = value
+
+
+def get(name: str) -> float:
+    with _lock:
+        return _values.get(name, 0)
+
+
+def snapshot() -> dict[str, float]:
+    with _lock:
+        return dict(sorted(_values.items()))
+
+
+def reset() -> None:
+    with _lock:
+        _values.clear()
@@ -0,0 +1,197 @@
+"""
+Routing of read-only requests to Postgres replicas.
+
+Handlers that only read take a session from :func:`ReplicaRouter.connect`,
+which picks the replicas round robin. Replicas lag behind the primary, so a
+client that wrote recently reads from the primary for
+``POSTGRES_READ_YOUR_WRITES_SECONDS``. :class:`WriteTrackingMiddleware`
+notes every request that may write in two places: under a hash of its
+``Authorization`` header in this process, and in a ``last_write`` cookie
+holding the time of the write, which any worker reads back.
+
+The cookie is what carries the marker across workers and hosts, so clients
+that drop cookies only get read-your-writes from the worker that served the
+write. The cookie is stamped when the response starts; a streamed response
+that writes at its end and outlasts the window is covered by the in-process
+marker alone. A replica that cannot be reached is skipped for
+``POSTGRES_REPLICA_RETRY_SECONDS``, and with no replica left reads fall back
+to the primary.
+"""
+
+import hashlib
+import math
+import threading
+import time
+from collections.abc import Callable, Sequence
+from http.cookies import SimpleCookie
+from itertools import count
+
+from sqlalchemy import Connection, Engine
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from sqlmodel import create_engine
+from starlette.datastructures import MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from app.core import metrics
+from app.core.cache import TTLCache
+from app.core.config import settings
+from app.core.db import MeteredReplicaQueuePool, engine, engine_options
+
+READ_METHODS = {"GET", "HEAD", "OPTIONS"}
+WRITE_COOKIE = "last_write"
+
+
+def writer_key(authorization: str | None) -> str | None:
+    if not authorization:
+        return None
+    return hashlib.sha256(authorization.encode()).hexdigest()
+
+
+def parse_write_time(value: str | None) -> float | None:
+    if not value:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        return None
+
+
+def write_cookie(written_at: float, max_age: float) -> str:
+    cookie: SimpleCookie = SimpleCookie()
+    cookie[WRITE_COOKIE] = f"{written_at:.3f}"
+    cookie[WRITE_COOKIE]["max-age"] = math.ceil(max_age)
+    cookie[WRITE_COOKIE]["path"] = "/"
+    cookie[WRITE_COOKIE]["httponly"] = True
+    cookie[WRITE_COOKIE]["samesite"] = "lax"
+    return cookie.output(header="").strip()
+
+
+class ReplicaRouter:
+    def __init__(
+        self,
+        primary: Engine,
+        replicas: Sequence[Engine],
+        *,
+        read_your_writes: float,
+        retry_after: float,
+        clock: Callable[[], float] = time.monotonic,
+        wall_clock: Callable[[], float] = time.time,
+    ) -> None:
+        self.primary = primary
+        self.replicas = list(replicas)
+        self.read_your_writes = read_your_writes
+        self.retry_after = retry_after
+        self.clock = clock
+        self.wall_clock = wall_clock
+        self.recent_writers: TTLCache[str, bool] = TTLCache(
+            maxsize=10_000, ttl=read_your_writes, timer=clock
+        )
+        self._down_until: dict[int, float] = {}
+        self._turn = count()
+        self._lock = threading.Lock()
+
+    def note_write(self, writer: str | None) -> None:
+        if writer is not None:
+            self.recent_writers.set(writer, True)
+
+    def wrote_recently(self, writer: str | None, last_write: float | None) -> bool:
+        """
+        Whether the client wrote within the window, by this process's marker
+        or by the write time from its cookie.
+        """
+        if writer is not None and self.recent_writers.get(writer):
+            return True
+        return (
+            last_write is not None
+            and self.wall_clock() - last_write < self.read_your_writes
+        )
+
+    def candidates(
+        self, writer: str | None = None, last_write: float | None = None
+    ) -> list[Engine]:
+        """
+        Replicas to try in order, none while the client must see its writes.
+        """
+        if not self.replicas:
+            return []
+        if self.wrote_recently(writer, last_write):
+            metrics.increment("db.replica.read_your_writes")
+            return []
+        now = self.clock()
+        with self._lock:
+            start = next(self._turn) % len(self.replicas)
+            healthy = [
+                replica
+                for replica in self.replicas[start:] + self.replicas[:start]
+                if self._down_until.get(id(replica), 0.0) <= now
+            ]
+        return healthy
+
+    def mark_down(self, replica: Engine) -> None:
+        metrics.increment("db.replica.failovers")
+        with self._lock:
+            self._down_until[id(replica)] = self.clock() + self.retry_after
+
+    def connect(
+        self, writer: str | None = None, last_write: float | None = None
+    ) -> Connection:
+        """
+        A connection to the first replica that answers, else to the primary.
+        """
+        for replica in self.candidates(writer, last_write):
+            try:
+                connection = replica.connect()
+            except (OperationalError, PoolTimeoutError):
+                self.mark_down(replica)
+                continue
+            metrics.increment("db.replica.reads")
+            return connection
+        metrics.increment("db.replica.primary_reads")
+        return self.primary.connect()
+
+
+class WriteTrackingMiddleware:
+    """
+    Notes the client of every request that may write, when it starts and
+    again when its response ends, streamed ones included. With replicas set
+    up, the response also sets the ``last_write`` cookie.
+    """
+
+    def __init__(self, app: ASGIApp) -> None:
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http" or scope["method"] in READ_METHODS:
+            await self.app(scope, receive, send)
+            return
+        router = replica_router
+        headers = dict(scope["headers"])
+        authorization = headers.get(b"authorization")
+        writer = writer_key(authorization.decode() if authorization else None)
+        router.note_write(writer)
+
+        async def send_and_note(message: Message) -> None:
+            if message["type"] == "http.response.start" and router.replicas:
+                MutableHeaders(scope=message).append(
+                    "set-cookie",
+                    write_cookie(router.wall_clock(), router.read_your_writes),
+                )
+            await send(message)
+            if message["type"] == "http.response.body" and not message.get(
+                "more_body", False
+            ):
+                router.note_write(writer)
+
+        await self.app(scope, receive, send_and_note)
+
+
+replica_router = ReplicaRouter(
+    engine,
+    [
+        create_engine(uri, poolclass=MeteredReplicaQueuePool, **engine_options())
+        for uri in settings.POSTGRES_REPLICA_URIS
+    ],
+    read_your_writes=settings.POSTGRES_READ_YOUR_WRITES_SECONDS,
+    retry_after=settings.POSTGRES_REPLICA_RETRY_SECONDS,
+)
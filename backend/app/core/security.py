@@ -1,17 +1,108 @@
+import asyncio
+import threading
+import time
+from collections.abc import Callable
+from concurrent.futures import Future, ThreadPoolExecutor
 from datetime import datetime, timedelta
-from typing import Any
+from typing import Any, TypeVar
 
 from jose import jwt
 from passlib.context import CryptContext
 
+from app.core import metrics
 from app.core.config import settings
 
+T = TypeVar("T")
+
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 
 
 ALGORITHM = "HS256"
 
 
+class PasswordHasherBusy(Exception):
+    def __init__(self, retry_after: float) -> None:
+        super().__init__(f"Password hashing queue full, retry in {retry_after:.1f}s")
+        self.retry_after = retry_after
+
+
+class PasswordHasher:
+    """
+    Runs bcrypt on a dedicated pool of ``workers`` threads.
+
+    Calls past ``max_queue`` waiting ones are refused with
+    :class:`PasswordHasherBusy` instead of queueing without bound. Queue
+    depth, waits and rejections go to ``app.core.metrics``.
+    """
+
+    def __init__(self, *, workers: int, max_queue: int) -> None:
+        self.workers = workers
+        self.max_pending = workers + max_queue
+        self.pending = 0
+        self.seconds = 0.2
+        self._executor = ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix="password-hash"
+        )
+        self._lock = threading.Lock()
+
+    def _retry_after(self) -> float:
+        """
+        How long the current queue takes to drain at the recent call time.
+        Called with the lock held.
+        """
+        return self.pending * self.seconds / self.workers
+
+    def _report_queue(self) -> None:
+        metrics.set_gauge(
+            "password_hash.queue_depth", max(0, self.pending - self.workers)
+        )
+
+    def _release(self, _future: "Future[Any]") -> None:
+        with self._lock:
+            self.pending -= 1
+        self._report_queue()
+
+    def _call(self, submitted: float, fn: Callable[..., T], *args: Any) -> T:
+        started = time.monotonic()
+        metrics.increment("password_hash.wait_seconds", started - submitted)
+        try:
+            return fn(*args)
+        finally:
+            seconds = time.monotonic() - started
+            with self._lock:
+                self.seconds = 0.9 * self.seconds + 0.1 * seconds
+            metrics.increment("password_hash.calls")
+
+    def submit(self, fn: Callable[..., T], *args: Any) -> "Future[T]":
+        with self._lock:
+            if self.pending >= self.max_pending:
+                metrics.increment("password_hash.rejected")
+                raise PasswordHasherBusy(self._retry_after())
+            self.pending += 1
+        self._report_queue()
+        future = self._executor.submit(self._call, time.monotonic(), fn, *args)
+        future.add_done_callback(self._release)
+        return future
+
+    def run(self, fn: Callable[..., T], *args: Any) -> T:
+        """
+        Block the calling thread until the call is done. Request handlers use
+        :meth:`run_async` instead.
+        """
+        return self.submit(fn, *args).result()
+
+    async def run_async(self, fn: Callable[..., T], *args: Any) -> T:
+        """
+        Wait for the call without holding a thread of the event loop's pool.
+        """
+        return await asyncio.wrap_future(self.submit(fn, *args))
+
+
+password_hasher = PasswordHasher(
+    workers=settings.PASSWORD_HASH_WORKERS, max_queue=settings.PASSWORD_HASH_MAX_QUEUE
+)
+
+
 def create_access_token(subject: str | Any, expires_delta: timedelta) -> str:
     expire = datetime.utcnow() + expires_delta
     to_encode = {"exp": expire, "sub": str(subject)}
@@ -19,9 +110,21 @@ def create_access_token(subject: str | Any, expires_delta: timedelta) -> str:
     return encoded_jwt
 
 
+# The sync helpers block their thread for the whole hash. Only startup code
+# (init_db) and tests call them; routes use the async ones below.
 def verify_password(plain_password: str, hashed_password: str) -> bool:
-    return pwd_context.verify(plain_password, hashed_password)
+    return password_hasher.run(pwd_context.verify, plain_password, hashed_password)
 
 
 def get_password_hash(password: str) -> str:
-    return pwd_context.hash(password)
+    return password_hasher.run(pwd_context.hash, password)
+
+
+async def verify_password_async(plain_password: str, hashed_password: str) -> bool:
+    return await password_hasher.run_async(
+        pwd_context.verify, plain_password, hashed_password
+    )
+
+
+async def get_password_hash_async(password: str) -> str:
+    return await password_hasher.run_async(pwd_context.hash, password)
@@ -0,0 +1,66 @@
+"""
+Decoded access tokens and the users they belong to, kept for a short while
+so authenticated requests skip the signature check and the user lookup.
+
+A token is cached by its hash until it expires. A user snapshot lives for
+``AUTH_CACHE_TTL_SECONDS`` and is dropped as soon as this process changes
+the user; other processes pick the change up once their snapshot expires.
+"""
+
+import hashlib
+import time
+from typing import Any
+
+from app.core import metrics
+from app.core.cache import TTLCache
+from app.core.config import settings
+from app.models import User
+
+
+def token_key(token: str) -> str:
+    return hashlib.sha256(token.encode()).hexdigest()
+
+
+class UserCache:
+    def __init__(self, *, maxsize: int, ttl: float) -> None:
+        self.tokens: TTLCache[str, int] = TTLCache(maxsize=maxsize, ttl=ttl)
+        self.users: TTLCache[int, dict[str, Any]] = TTLCache(maxsize=maxsize, ttl=ttl)
+
+    def get_user_id(self, token: str) -> int | None:
+        return self.tokens.get(token_key(token))
+
+    def set_user_id(self, token: str, user_id: int, expires_at: float) -> None:
+        """
+        Remember whose ``token`` is until ``expires_at``, a Unix timestamp.
+        """
+        ttl = expires_at - time.time()
+        if ttl > 0:
+            self.tokens.set(token_key(token), user_id, ttl=ttl)
+
+    def get_user(self, user_id: int) -> User | None:
+        """
+        A fresh, session-less copy of the cached user, safe to hand out.
+        """
+        snapshot = self.users.get(user_id)
+        if snapshot is None:
+            metrics.increment("user_cache.misses")
+            return None
+        metrics.increment("user_cache.hits")
+        return User(**snapshot)
+
+    def set_user(self, user: User) -> None:
+        if user.id is not None:
+            self.users.set(user.id, user.model_dump())
+
+    def invalidate(self, user_id: int | None) -> None:
+        if user_id is not None:
+            self.users.pop(user_id)
+
+    def clear(self) -> None:
+        self.tokens.clear()
+        self.users.clear()
+
+
+user_cache = UserCache(
+    maxsize=settings.AUTH_CACHE_SIZE, ttl=settings.AUTH_CACHE_TTL_SECONDS
+)
@@ -1,9 +1,22 @@
+from datetime import datetime, timedelta
 from typing import Any
+from uuid import uuid4
 
-from sqlmodel import Session, select
+from sqlalchemy import bindparam, case, delete, func, literal, or_, text, update
+from sqlalchemy.dialects.postgresql import insert
+from sqlmodel import Session, col, select
+from sqlmodel.ext.asyncio.session import AsyncSession
+from sqlmodel.sql.expression import SelectOfScalar
 
-from app.core.security import get_password_hash, verify_password
+from app.core.count_cache import count_cache
+from app.core.security import (
+    get_password_hash,
+    get_password_hash_async,
+    verify_password,
+    verify_password_async,
+)
 from app.models import (
+    CachedCompletion,
     CnvMessage,
     CnvMessageBase,
     Conversation,
@@ -11,9 +24,14 @@ from app.models import (
     ConversationUpdate,
     Item,
     ItemCreate,
+    Job,
+    ModerationVerdict,
+    RateLimitBucket,
+    RateLimitLease,
     User,
     UserCreate,
     UserUpdate,
+    utcnow,
 )
 
 
@@ -24,6 +42,7 @@ def create_user(*, session: Session, user_create: UserCreate) -> User:
     session.add(db_obj)
     session.commit()
     session.refresh(db_obj)
+    count_cache.invalidate(User)
     return db_obj
 
 
@@ -41,6 +60,36 @@ def update_user(*, session: Session, db_user: User, user_in: UserUpdate) -> Any:
     return db_user
 
 
+async def create_user_async(*, session: AsyncSession, user_create: UserCreate) -> User:
+    """
+    Same as ``create_user``; bcrypt runs without holding a request thread.
+    """
+    db_obj = User.model_validate(
+        user_create,
+        update={"hashed_password": await get_password_hash_async(user_create.password)},
+    )
+    session.add(db_obj)
+    await session.commit()
+    await session.refresh(db_obj)
+    count_cache.invalidate(User)
+    return db_obj
+
+
+async def update_user_async(
+    *, session: AsyncSession, db_user: User, user_in: UserUpdate
+) -> Any:
+    user_data = user_in.model_dump(exclude_unset=True)
+    extra_data = {}
+    if "password" in user_data:
+        password = user_data["password"]
+        extra_data["hashed_password"] = await get_password_hash_async(password)
+    db_user.sqlmodel_update(user_data, update=extra_data)
+    session.add(db_user)
+    await session.commit()
+    await session.refresh(db_user)
+    return db_user
+
+
 def get_user_by_email(*, session: Session, email: str) -> User | None:
     statement = select(User).where(User.email == email)
     session_user = session.exec(statement).first()
@@ -58,11 +107,32 @@ def authenticate(*, session: Session, email: str, password: str) -> User | None:
     return db_user
 
 
+async def get_user_by_email_async(*, session: AsyncSession, email: str) -> User | None:
+    statement = select(User).where(User.email == email)
+    result = await session.exec(statement)
+    return result.first()
+
+
+async def authenticate_async(
+    *, session: AsyncSession, email: str, password: str
+) -> User | None:
+    """
+    Same as ``authenticate``; bcrypt runs without holding a request thread.
+    """
+    db_user = await get_user_by_email_async(session=session, email=email)
+    if not db_user:
+        return None
+    if not await verify_password_async(password, db_user.hashed_password):
+        return None
+    return db_user
+
+
 def create_item(*, session: Session, item_in: ItemCreate, owner_id: int) -> Item:
     db_item = Item.model_validate(item_in, update={"owner_id": owner_id})
     session.add(db_item)
     session.commit()
     session.refresh(db_item)
+    count_cache.invalidate(Item, owner_id)
     return db_item
 
 
@@ -75,6 +145,7 @@ def create_conversation(
     session.add(conversation)
     session.commit()
     session.refresh(conversation)
+    count_cache.invalidate(Conversation, owner_id)
     return conversation
 
 
@@ -87,6 +158,8 @@ def update_conversation(
         return None
     if conversation_in.summary is not None:
         session_conversation.summary = conversation_in.summary
+    if conversation_in.summary_message_id is not None:
+        session_conversation.summary_message_id = conversation_in.summary_message_id
     session.commit()
     session.refresh(session_conversation)
     return session_conversation
@@ -102,3 +175,575 @@ def create_cnvmessage(
     session.commit()
     session.refresh(cnv_message)
     return cnv_message
+
+
+async def update_conversation_async(
+    *, session: AsyncSession, conversation_in: ConversationUpdate
+) -> Conversation | None:
+    statement = select(Conversation).where(Conversation.id == conversation_in.id)
+    session_conversation = (await session.exec(statement)).first()
+    if not session_conversation:
+        return None
+    if conversation_in.summary is not None:
+        session_conversation.summary = conversation_in.summary
+    if conversation_in.summary_message_id is not None:
+        session_conversation.summary_message_id = conversation_in.summary_message_id
+    await session.commit()
+    await session.refresh(session_conversation)
+    return session_conversation
+
+
+async def fill_conversation_summaries_async(
+    *, session: AsyncSession, conversations_in: list[ConversationUpdate]
+) -> int:
+    """
+    Store summaries in one executemany, skipping conversations that got one
+    in the meantime. Returns how many rows were updated.
+    """
+    if not conversations_in:
+        return 0
+    statement = (
+        update(Conversation)
+        .where(col(Conversation.id) == bindparam("conversation_id"))
+        .where(col(Conversation.summary).is_(None))
+        .values(
+            summary=bindparam("new_summary"),
+            summary_message_id=bindparam("new_summary_message_id"),
+        )
+    )
+    params = [
+        {
+            "conversation_id": conversation_in.id,
+            "new_summary": conversation_in.summary,
+            "new_summary_message_id": conversation_in.summary_message_id,
+        }
+        for conversation_in in conversations_in
+    ]
+    connection = await session.connection()
+    result = await connection.execute(statement, params)
+    await session.commit()
+    return result.rowcount
+
+
+class UnitOfWork:
+    """
+    Rows of one chat turn, written together with a single commit.
+
+    Nothing is sent until the session flushes, at the latest on ``commit``.
+    Inserts then go out in dependency order, and ids and defaults come back
+    through ``RETURNING``, so the rows need no refresh afterwards. For that
+    the session must not expire objects on commit.
+
+    Committing an answer also moves the conversation's ``modified_at``, which
+    orders the conversation list.
+    """
+
+    def __init__(self, session: AsyncSession) -> None:
+        self.session = session
+        self._new_conversation_owners: set[int] = set()
+        self._answered_conversations: dict[int, Conversation] = {}
+
+    def add_conversation(
+        self, conversation_in: ConversationBase, *, owner_id: int
+    ) -> Conversation:
+        conversation = Conversation.model_validate(
+            conversation_in, update={"owner_id": owner_id}
+        )
+        self.session.add(conversation)
+        self._new_conversation_owners.add(owner_id)
+        return conversation
+
+    def add_cnvmessage(
+        self, cnv_in: CnvMessageBase, *, owner_id: int, conversation: Conversation
+    ) -> CnvMessage:
+        if conversation.id is None:
+            # Not inserted yet; the flush fills in the id once it is
+            cnv_message = CnvMessage(
+                **cnv_in.model_dump(), owner_id=owner_id, conversation=conversation
+            )
+        else:
+            cnv_message = CnvMessage.model_validate(
+                cnv_in,
+                update={"owner_id": owner_id, "conversation_id": conversation.id},
+            )
+            if cnv_message.role == "assistant":
+                self._answered_conversations[conversation.id] = conversation
+        self.session.add(cnv_message)
+        return cnv_message
+
+    async def enqueue_job(
+        self,
+        *,
+        kind: str,
+        payload: dict[str, Any],
+        max_attempts: int,
+        dedup_key: str | None = None,
+    ) -> None:
+        """
+        Same as ``enqueue_job_async``, in the turn's transaction.
+        """
+        statement = enqueue_job_statement(
+            kind=kind, payload=payload, max_attempts=max_attempts, dedup_key=dedup_key
+        )
+        await self.session.execute(statement)
+
+    async def commit(self) -> None:
+        if self._answered_conversations:
+            # "evaluate" also gives the loaded conversations the new value,
+            # as already written, so the flush does not send it again
+            await self.session.execute(
+                update(Conversation)
+                .where(col(Conversation.id).in_(self._answered_conversations))
+                .values(modified_at=utcnow())
+                .execution_options(synchronize_session="evaluate")
+            )
+            self._answered_conversations.clear()
+        await self.session.commit()
+        for owner_id in self._new_conversation_owners:
+            count_cache.invalidate(Conversation, owner_id)
+        self._new_conversation_owners.clear()
+
+
+async def get_moderation_verdict_async(
+    *, session: AsyncSession, content_hash: str, max_age: timedelta
+) -> bool | None:
+    statement = select(ModerationVerdict.flagged).where(
+        ModerationVerdict.content_hash == content_hash,
+        ModerationVerdict.created_at > utcnow() - max_age,
+    )
+    return (await session.exec(statement)).first()
+
+
+async def save_moderation_verdict_async(
+    *, session: AsyncSession, content_hash: str, flagged: bool, max_age: timedelta
+) -> None:
+    await session.execute(delete_expired_verdicts_statement(max_age))
+    await session.execute(upsert_moderation_verdict_statement(content_hash, flagged))
+    await session.commit()
+
+
+def upsert_moderation_verdict_statement(content_hash: str, flagged: bool) -> Any:
+    statement = insert(ModerationVerdict).values(
+        content_hash=content_hash, flagged=flagged, created_at=utcnow()
+    )
+    return statement.on_conflict_do_update(
+        index_elements=[ModerationVerdict.content_hash],
+        set_={
+            "flagged": statement.excluded.flagged,
+            "created_at": statement.excluded.created_at,
+        },
+    )
+
+
+def delete_expired_verdicts_statement(max_age: timedelta, limit: int = 100) -> Any:
+    """
+    Same as ``delete_expired_completions_statement``, for moderation verdicts.
+    """
+    expired = (
+        select(ModerationVerdict.content_hash)
+        .where(ModerationVerdict.created_at <= utcnow() - max_age)
+        .limit(limit)
+        .with_for_update(skip_locked=True)
+    )
+    return delete(ModerationVerdict).where(
+        col(ModerationVerdict.content_hash).in_(expired.scalar_subquery())
+    )
+
+
+async def get_cached_completion_async(
+    *, session: AsyncSession, key: str, max_age: timedelta
+) -> str | None:
+    statement = select(CachedCompletion.content).where(
+        CachedCompletion.key == key, CachedCompletion.created_at > utcnow() - max_age
+    )
+    return (await session.exec(statement)).first()
+
+
+async def save_cached_completion_async(
+    *, session: AsyncSession, key: str, model: str, content: str, max_age: timedelta
+) -> None:
+    await session.execute(delete_expired_completions_statement(max_age))
+    await session.execute(upsert_cached_completion_statement(key, model, content))
+    await session.commit()
+
+
+def upsert_cached_completion_statement(key: str, model: str, content: str) -> Any:
+    statement = insert(CachedCompletion).values(
+        key=key, model=model, content=content, created_at=utcnow()
+    )
+    return statement.on_conflict_do_update(
+        index_elements=[CachedCompletion.key],
+        set_={
+            "content": statement.excluded.content,
+            "created_at": statement.excluded.created_at,
+        },
+    )
+
+
+def delete_expired_completions_statement(max_age: timedelta, limit: int = 100) -> Any:
+    """
+    Evict a bounded batch of expired entries, so every write pays a little.
+    """
+    expired = (
+        select(CachedCompletion.key)
+        .where(CachedCompletion.created_at <= utcnow() - max_age)
+        .limit(limit)
+        .with_for_update(skip_locked=True)
+    )
+    return delete(CachedCompletion).where(
+        col(CachedCompletion.key).in_(expired.scalar_subquery())
+    )
+
+
+async def acquire_rate_limit_async(
+    *,
+    session: AsyncSession,
+    buckets: list[RateLimitBucket],
+    name: str,
+    limit: int,
+    ttl: timedelta,
+) -> tuple[list[RateLimitBucket], int | None]:
+    """
+    Draw from the buckets and, unless that leaves one in debt, take one of
+    ``limit`` slots for ``name``, in a single transaction.
+
+    Pass each bucket as it would start out, i.e. with ``tokens`` set to its
+    capacity minus the cost; each is refilled for the time since its last
+    use first. Returns the buckets after the draw, where a negative balance
+    is the debt the caller has to wait out, and the lease id, or None when
+    there is debt or all slots are taken.
+    """
+    buckets_out: list[RateLimitBucket] = []
+    if buckets:
+        result = await session.scalars(reserve_rate_limit_tokens_statement(buckets))
+        buckets_out = list(result)
+    lease_id: int | None = None
+    if all(bucket.tokens >= 0 for bucket in buckets_out):
+        *setup, acquire = acquire_rate_limit_lease_statements(name, limit, ttl)
+        for statement in setup:
+            await session.execute(statement)
+        lease_id = await session.scalar(acquire)
+    await session.commit()
+    return buckets_out, lease_id
+
+
+def reserve_rate_limit_tokens_statement(buckets: list[RateLimitBucket]) -> Any:
+    now = func.clock_timestamp()
+    statement = insert(RateLimitBucket).values(
+        [
+            {
+                "name": bucket.name,
+                "capacity": bucket.capacity,
+                "rate": bucket.rate,
+                "tokens": bucket.tokens,
+                "updated_at": now,
+            }
+            # One lock order for every caller, so concurrent draws cannot deadlock
+            for bucket in sorted(buckets, key=lambda bucket: bucket.name)
+        ]
+    )
+    excluded = statement.excluded
+    elapsed = func.extract("epoch", excluded.updated_at - RateLimitBucket.updated_at)
+    refilled = func.least(
+        excluded.capacity, RateLimitBucket.tokens + elapsed * excluded.rate
+    )
+    cost = excluded.capacity - excluded.tokens
+    return statement.on_conflict_do_update(
+        index_elements=[RateLimitBucket.name],
+        set_={
+            "capacity": excluded.capacity,
+            "rate": excluded.rate,
+            "tokens": refilled - cost,
+            "updated_at": excluded.updated_at,
+        },
+    ).returning(RateLimitBucket)
+
+
+async def refund_rate_limit_tokens_async(
+    *, session: AsyncSession, costs: dict[str, float]
+) -> None:
+    connection = await session.connection()
+    await connection.execute(refund_rate_limit_tokens_statement(), refund_params(costs))
+    await session.commit()
+
+
+def refund_rate_limit_tokens_statement() -> Any:
+    return (
+        update(RateLimitBucket)
+        .where(col(RateLimitBucket.name) == bindparam("bucket_name"))
+        .values(tokens=col(RateLimitBucket.tokens) + bindparam("cost"))
+    )
+
+
+def refund_params(costs: dict[str, float]) -> list[dict[str, Any]]:
+    return [{"bucket_name": name, "cost": cost} for name, cost in sorted(costs.items())]
+
+
+def acquire_rate_limit_lease_statements(
+    name: str, limit: int, ttl: timedelta
+) -> list[Any]:
+    """
+    A transaction-scoped advisory lock serializes the count and the insert
+    across processes; expired leases are dropped on the way.
+    """
+    now = func.clock_timestamp()
+    in_flight = (
+        select(func.count())
+        .select_from(RateLimitLease)
+        .where(RateLimitLease.name == name)
+        .scalar_subquery()
+    )
+    return [
+        select(func.pg_advisory_xact_lock(func.hashtext(f"ratelimitlease:{name}"))),
+        delete(RateLimitLease).where(
+            col(RateLimitLease.name) == name, col(RateLimitLease.expires_at) <= now
+        ),
+        insert(RateLimitLease)
+        .from_select(
+            ["name", "expires_at"],
+            select(literal(name), now + ttl).where(in_flight < limit),
+        )
+        .returning(col(RateLimitLease.id)),
+    ]
+
+
+async def release_rate_limit_lease_async(
+    *, session: AsyncSession, lease_id: int
+) -> None:
+    await session.execute(
+        delete(RateLimitLease).where(col(RateLimitLease.id) == lease_id)
+    )
+    await session.commit()
+
+
+def cnvmessages_statement(conv_id: int) -> SelectOfScalar[CnvMessage]:
+    return select(CnvMessage).where(CnvMessage.conversation_id == conv_id)
+
+
+def get_cnvmessages(*, session: Session, conv_id: int) -> list[CnvMessage]:
+    statement = cnvmessages_statement(conv_id).order_by(
+        col(CnvMessage.created_at), col(CnvMessage.id)
+    )
+    return list(session.exec(statement).all())
+
+
+def get_last_cnvmessages(
+    *, session: Session, conv_id: int, limit: int
+) -> list[CnvMessage]:
+    """
+    The newest ``limit`` messages of a conversation, oldest first.
+    """
+    statement = (
+        cnvmessages_statement(conv_id)
+        .order_by(col(CnvMessage.created_at).desc(), col(CnvMessage.id).desc())
+        .limit(limit)
+    )
+    return list(reversed(session.exec(statement).all()))
+
+
+def cnvmessages_after_statement(
+    conv_id: int, after_id: int | None, limit: int | None
+) -> SelectOfScalar[CnvMessage]:
+    statement = cnvmessages_statement(conv_id)
+    if after_id is not None:
+        statement = statement.where(col(CnvMessage.id) > after_id)
+    return statement.order_by(col(CnvMessage.created_at), col(CnvMessage.id)).limit(
+        limit
+    )
+
+
+def get_cnvmessages_after(
+    *, session: Session, conv_id: int, after_id: int | None, limit: int | None = None
+) -> list[CnvMessage]:
+    """
+    Messages that follow the message ``after_id``, oldest first.
+
+    With ``after_id`` None this pages from the start of the conversation.
+    """
+    statement = cnvmessages_after_statement(conv_id, after_id, limit)
+    return list(session.exec(statement).all())
+
+
+async def get_cnvmessages_after_async(
+    *,
+    session: AsyncSession,
+    conv_id: int,
+    after_id: int | None,
+    limit: int | None = None,
+) -> list[CnvMessage]:
+    statement = cnvmessages_after_statement(conv_id, after_id, limit)
+    return list((await session.exec(statement)).all())
+
+
+async def get_last_cnvmessages_async(
+    *, session: AsyncSession, conv_id: int, limit: int
+) -> list[CnvMessage]:
+    statement = (
+        cnvmessages_statement(conv_id)
+        .order_by(col(CnvMessage.created_at).desc(), col(CnvMessage.id).desc())
+        .limit(limit)
+    )
+    return list(reversed((await session.exec(statement)).all()))
+
+
+async def enqueue_job_async(
+    *,
+    session: AsyncSession,
+    kind: str,
+    payload: dict[str, Any],
+    max_attempts: int,
+    dedup_key: str | None = None,
+) -> None:
+    """
+    Queue a job, or coalesce it with the active job for the same ``dedup_key``.
+
+    A queued duplicate is dropped. A running duplicate is flagged to run once
+    more when it finishes, so it picks up whatever changed meanwhile.
+    """
+    statement = enqueue_job_statement(
+        kind=kind, payload=payload, max_attempts=max_attempts, dedup_key=dedup_key
+    )
+    await session.execute(statement)
+    await session.commit()
+
+
+def enqueue_job_statement(
+    *, kind: str, payload: dict[str, Any], max_attempts: int, dedup_key: str | None
+) -> Any:
+    statement = insert(Job).values(
+        kind=kind,
+        dedup_key=dedup_key,
+        payload=payload,
+        max_attempts=max_attempts,
+        run_at=utcnow(),
+    )
+    return statement.on_conflict_do_update(
+        index_elements=[col(Job.dedup_key)],
+        # Literal, not bound values: a prepared statement with parameters in
+        # the predicate no longer matches the partial index
+        index_where=text("status IN ('queued', 'running')"),
+        set_={"rerun": Job.status == "running"},
+    )
+
+
+async def claim_jobs_async(
+    *, session: AsyncSession, limit: int, lease: timedelta
+) -> list[Job]:
+    """
+    Lease up to ``limit`` due jobs, including running ones whose lease expired.
+
+    Rows locked by another worker's claim are skipped instead of waited on.
+    Each claim stamps its jobs with a new ``locked_by`` token.
+    """
+    now = utcnow()
+    due = (
+        select(Job.id)
+        .where(
+            or_(
+                (col(Job.status) == "queued") & (col(Job.run_at) <= now),
+                (col(Job.status) == "running") & (col(Job.locked_until) < now),
+            )
+        )
+        .order_by(col(Job.run_at))
+        .limit(limit)
+        .with_for_update(skip_locked=True)
+    )
+    statement = (
+        update(Job)
+        .where(col(Job.id).in_(due.scalar_subquery()))
+        .values(
+            status="running",
+            attempts=Job.attempts + 1,
+            locked_until=now + lease,
+            locked_by=uuid4().hex,
+        )
+        .returning(Job)
+        .execution_options(synchronize_session=False)
+    )
+    jobs = list((await session.execute(statement)).scalars().all())
+    await session.commit()
+    return jobs
+
+
+def claimed_job(job: Job) -> Any:
+    """
+    Matches ``job`` only while the claim that returned it still holds it. Once
+    its lease expired and another claim took the job over, it matches nothing.
+    """
+    return (
+        (col(Job.id) == job.id)
+        & (col(Job.status) == "running")
+        & (col(Job.locked_by) == job.locked_by)
+    )
+
+
+async def complete_job_async(
+    *, session: AsyncSession, job: Job, retention: timedelta
+) -> bool:
+    """
+    Mark a claimed job done, or queue it again if it was asked to rerun.
+
+    Returns False when the claim was lost and nothing changed. Also prunes a
+    bounded batch of jobs that finished more than ``retention`` ago.
+    """
+    rerun = col(Job.rerun)
+    statement = (
+        update(Job)
+        .where(claimed_job(job))
+        .values(
+            status=case((rerun, "queued"), else_="done"),
+            attempts=case((rerun, 0), else_=Job.attempts),
+            run_at=utcnow(),
+            rerun=False,
+            locked_until=None,
+            locked_by=None,
+            last_error=None,
+        )
+    )
+    result = await session.execute(statement)
+    await session.execute(delete_finished_jobs_statement(retention))
+    await session.commit()
+    return bool(result.rowcount)  # type: ignore[attr-defined]
+
+
+async def fail_job_async(
+    *, session: AsyncSession, job: Job, error: str, retry_at: datetime | None
+) -> bool:
+    """
+    Record a failed attempt of a claimed job: queue it for ``retry_at``, or
+    give up on it when that is None.
+
+    Returns False when the claim was lost and nothing changed.
+    """
+    values: dict[str, Any] = {
+        "locked_until": None,
+        "locked_by": None,
+        "last_error": error,
+    }
+    if retry_at is None:
+        values.update(status="failed", rerun=False, run_at=utcnow())
+    else:
+        values.update(status="queued", rerun=False, run_at=retry_at)
+    statement = update(Job).where(claimed_job(job)).values(**values)
+    result = await session.execute(statement)
+    await session.commit()
+    return bool(result.rowcount)  # type: ignore[attr-defined]
+
+
+def delete_finished_jobs_statement(max_age: timedelta, limit: int = 100) -> Any:
+    """
+    Delete a bounded batch of done and failed jobs older than ``max_age``,
+    so every completion pays a little.
+
+    A finished job's ``run_at`` is when it finished.
+    """
+    finished = (
+        select(Job.id)
+        .where(
+            col(Job.status).in_(("done", "failed")),
+            col(Job.run_at) <= utcnow() - max_age,
+        )
+        .limit(limit)
+        .with_for_update(skip_locked=True)
+    )
+    return delete(Job).where(col(Job.id).in_(finished.scalar_subquery()))
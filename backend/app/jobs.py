@@ -0,0 +1,199 @@
+"""
+Background jobs stored in Postgres and run by ``app/worker.py``.
+
+API handlers only insert a row. Workers lease due rows with
+``FOR UPDATE SKIP LOCKED``, so any number of them can poll the same table
+without handing out a job twice. A failed job is retried with jittered
+exponential backoff until it runs out of attempts. A worker that dies
+mid-job loses its lease, and the job is picked up again once the lease
+expires; should the first worker come back after all, its outcome is
+dropped. Finished jobs are deleted after ``JOBS_RETENTION_SECONDS``.
+"""
+
+import asyncio
+import logging
+import random
+from collections.abc import Awaitable, Callable
+from datetime import timedelta
+from typing import Any
+
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from app import crud
+from app.ai import assistant
+from app.core import metrics
+from app.core.config import settings
+from app.core.db import async_engine
+from app.models import Conversation, Job, utcnow
+
+logger = logging.getLogger(__name__)
+
+JobHandler = Callable[[dict[str, Any]], Awaitable[None]]
+
+handlers: dict[str, JobHandler] = {}
+
+CONVERSATION_SUMMARY = "conversation_summary"
+
+
+def job_handler(kind: str) -> Callable[[JobHandler], JobHandler]:
+    def register(handler: JobHandler) -> JobHandler:
+        handlers[kind] = handler
+        return handler
+
+    return register
+
+
+def retry_delay(attempts: int) -> float:
+    """
+    Seconds to wait before the next attempt, doubling per attempt with jitter.
+    """
+    delay = settings.JOBS_RETRY_BASE_SECONDS * 2.0 ** (attempts - 1)
+    return min(delay, settings.JOBS_RETRY_MAX_SECONDS) * random.uniform(0.5, 1.0)
+
+
+async def enqueue_summary_if_due(
+    *, unit: crud.UnitOfWork, conversation: Conversation
+) -> None:
+    """
+    Queue a summary refresh, as part of the chat turn in ``unit``, when
+    enough unsummarized messages built up.
+
+    Reads at most ``AI_SUMMARY_REFRESH_MESSAGES`` rows past the watermark, so
+    calling it on every turn stays cheap.
+    """
+    if conversation.id is None:
+        return
+    pending = await crud.get_cnvmessages_after_async(
+        session=unit.session,
+        conv_id=conversation.id,
+        after_id=conversation.summary_message_id,
+        limit=settings.AI_SUMMARY_REFRESH_MESSAGES,
+    )
+    if not assistant.summary_is_due(conversation.summary, pending):
+        return
+    await unit.enqueue_job(
+        kind=CONVERSATION_SUMMARY,
+        payload={"conversation_id": conversation.id},
+        max_attempts=settings.JOBS_MAX_ATTEMPTS,
+        dedup_key=f"{CONVERSATION_SUMMARY}:{conversation.id}",
+    )
+
+
+@job_handler(CONVERSATION_SUMMARY)
+async def update_conversation_summary(payload: dict[str, Any]) -> None:
+    conv_id = payload["conversation_id"]
+    async with AsyncSession(async_engine, expire_on_commit=False) as session:
+        if await session.get(Conversation, conv_id) is None:
+            logger.info("Conversation %s is gone, skipping its summary", conv_id)
+            return
+        conversation_in = await assistant.generate_summary_async(
+            session=session, conv_id=conv_id
+        )
+        if conversation_in is not None:
+            await crud.update_conversation_async(
+                session=session, conversation_in=conversation_in
+            )
+
+
+async def run_job(job: Job) -> None:
+    if job.id is None:
+        return
+    handler = handlers.get(job.kind)
+    try:
+        if handler is None:
+            raise LookupError(f"No handler for job kind {job.kind!r}")
+        if job.attempts > job.max_attempts:
+            raise TimeoutError("Lease expired on the last attempt")
+        await handler(job.payload)
+    except Exception as e:
+        retry_at = None
+        if handler is not None and job.attempts < job.max_attempts:
+            retry_at = utcnow() + timedelta(seconds=retry_delay(job.attempts))
+        logger.exception(
+            "Job %s (%s) failed on attempt %s", job.id, job.kind, job.attempts
+        )
+        metrics.increment("jobs.retried" if retry_at else "jobs.failed")
+        async with AsyncSession(async_engine) as session:
+            recorded = await crud.fail_job_async(
+                session=session, job=job, error=repr(e), retry_at=retry_at
+            )
+        if not recorded:
+            lease_lost(job)
+        return
+    async with AsyncSession(async_engine) as session:
+        recorded = await crud.complete_job_async(
+            session=session,
+            job=job,
+            retention=timedelta(seconds=settings.JOBS_RETENTION_SECONDS),
+        )
+    if not recorded:
+        lease_lost(job)
+        return
+    metrics.increment("jobs.completed")
+
+
+def lease_lost(job: Job) -> None:
+    logger.warning(
+        "Job %s (%s) was claimed again before attempt %s finished",
+        job.id,
+        job.kind,
+        job.attempts,
+    )
+    metrics.increment("jobs.lease_lost")
+
+
+async def claim_jobs(limit: int) -> list[Job]:
+    async with AsyncSession(async_engine, expire_on_commit=False) as session:
+        return await crud.claim_jobs_async(
+            session=session,
+            limit=limit,
+            lease=timedelta(seconds=settings.JOBS_LEASE_SECONDS),
+        )
+
+
+async def run_once(*, limit: int | None = None) -> int:
+    """
+    Run the jobs that are due now, at most ``limit`` at a time.
+
+    Returns how many jobs ran. Meant for tests and one-off draining.
+    """
+    limit = limit or settings.JOBS_WORKER_CONCURRENCY
+    total = 0
+    while jobs := await claim_jobs(limit):
+        await asyncio.gather(*(run_job(job) for job in jobs))
+        total += len(jobs)
+    return total
+
+
+async def run_worker(
+    *, concurrency: int, poll_interval: float, stop: asyncio.Event
+) -> None:
+    """
+    Keep up to ``concurrency`` jobs running until ``stop`` is set.
+
+    The table is polled every ``poll_interval`` seconds while idle, and
+    right away whenever a slot frees up. Running jobs finish before return.
+    """
+    in_flight: set[asyncio.Task[None]] = set()
+    while not stop.is_set():
+        free = concurrency - len(in_flight)
+        claimed = await claim_jobs(free) if free else []
+        in_flight.update(asyncio.create_task(run_job(job)) for job in claimed)
+        metrics.set_gauge("jobs.in_flight", len(in_flight))
+        if claimed and len(in_flight) < concurrency:
+            continue
+        if in_flight:
+            done, in_flight = await asyncio.wait(
+                in_flight, timeout=poll_interval, return_when=asyncio.FIRST_COMPLETED
+            )
+            for task in done:
+                if task.exception() is not None:
+                    # Recording the outcome failed; the lease expiry retries it
+                    logger.error("Job bookkeeping failed: %r", task.exception())
+        else:
+            try:
+                await asyncio.wait_for(stop.wait(), timeout=poll_interval)
+            except asyncio.TimeoutError:
+                pass
+    if in_flight:
+        await asyncio.wait(in_flight)
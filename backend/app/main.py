@@ -1,10 +1,21 @@
+import math
+from collections.abc import AsyncIterator
+from contextlib import asynccontextmanager
+
 import sentry_sdk
-from fastapi import FastAPI
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
 from fastapi.routing import APIRoute
 from starlette.middleware.cors import CORSMiddleware
 
+from app.ai.assistant import reset_async_llm_controller
+from app.ai.rate_limit import RateLimitTimeout
+from app.ai.resilience import ProviderUnavailable, breaker, moderation_breaker
 from app.api.main import api_router
 from app.core.config import settings
+from app.core.db import async_engine
+from app.core.replicas import WriteTrackingMiddleware
+from app.core.security import PasswordHasherBusy
 
 
 def custom_generate_unique_id(route: APIRoute) -> str:
@@ -14,10 +25,19 @@ def custom_generate_unique_id(route: APIRoute) -> str:
 if settings.SENTRY_DSN and settings.ENVIRONMENT != "local":
     sentry_sdk.init(dsn=str(settings.SENTRY_DSN), enable_tracing=True)
 
+
+@asynccontextmanager
+async def lifespan(_app: FastAPI) -> AsyncIterator[None]:
+    yield
+    await reset_async_llm_controller()
+    await async_engine.dispose()
+
+
 app = FastAPI(
     title=settings.PROJECT_NAME,
     openapi_url=f"{settings.API_V1_STR}/openapi.json",
     generate_unique_id_function=custom_generate_unique_id,
+    lifespan=lifespan,
 )
 
 # Set all CORS enabled origins
@@ -32,4 +52,47 @@ if settings.BACKEND_CORS_ORIGINS:
         allow_headers=["*"],
     )
 
+app.add_middleware(WriteTrackingMiddleware)
+
 app.include_router(api_router, prefix=settings.API_V1_STR)
+
+
+@app.exception_handler(RateLimitTimeout)
+async def rate_limit_timeout_handler(
+    _request: Request, exc: RateLimitTimeout
+) -> JSONResponse:
+    return JSONResponse(
+        status_code=503,
+        content={"detail": "The assistant is busy, try again shortly"},
+        headers={"Retry-After": str(max(1, math.ceil(exc.retry_after)))},
+    )
+
+
+@app.exception_handler(ProviderUnavailable)
+async def provider_unavailable_handler(
+    _request: Request, _exc: ProviderUnavailable
+) -> JSONResponse:
+    return JSONResponse(
+        status_code=503,
+        content={"detail": "The assistant is unavailable, try again shortly"},
+        headers={
+            "Retry-After": str(
+                max(
+                    1,
+                    math.ceil(breaker.retry_after()),
+                    math.ceil(moderation_breaker.retry_after()),
+                )
+            )
+        },
+    )
+
+
+@app.exception_handler(PasswordHasherBusy)
+async def password_hasher_busy_handler(
+    _request: Request, exc: PasswordHasherBusy
+) -> JSONResponse:
+    return JSONResponse(
+        status_code=503,
+        content={"detail": "Too many sign-ins at once, try again shortly"},
+        headers={"Retry-After": str(max(1, math.ceil(exc.retry_after)))},
+    )
@@ -1,8 +1,35 @@
-from datetime import datetime
+from datetime import datetime, timezone
+from typing import Annotated, Any
 
+from pydantic import PlainSerializer
+from sqlalchemy import DateTime, Index, text
+from sqlalchemy.dialects.postgresql import JSONB
 from sqlmodel import Field, Relationship, SQLModel
 
 
+def utcnow() -> datetime:
+    return datetime.now(timezone.utc)
+
+
+def format_timestamp(value: datetime) -> str:
+    # Naive UTC ISO 8601, the format these fields had as string columns
+    if value.tzinfo is not None:
+        value = value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value.isoformat()
+
+
+ApiTimestamp = Annotated[datetime, PlainSerializer(format_timestamp, return_type=str)]
+
+
+def TimestampField() -> datetime:
+    return Field(  # type: ignore[no-any-return]
+        default_factory=utcnow,
+        sa_type=DateTime(timezone=True),  # type: ignore[call-overload]
+        sa_column_kwargs={"server_default": text("now()")},
+        nullable=False,
+    )
+
+
 # Shared properties
 # TODO replace email str with EmailStr when sqlmodel supports it
 class UserBase(SQLModel):
@@ -58,7 +85,8 @@ class UserPublic(UserBase):
 
 class UsersPublic(SQLModel):
     data: list[UserPublic]
-    count: int
+    count: int | None = None
+    next_cursor: str | None = None
 
 
 # Shared properties
@@ -79,6 +107,8 @@ class ItemUpdate(ItemBase):
 
 # Database model, database table inferred from class name
 class Item(ItemBase, table=True):
+    __table_args__ = (Index("ix_item_owner_id_id", "owner_id", "id"),)
+
     id: int | None = Field(default=None, primary_key=True)
     title: str
     owner_id: int | None = Field(default=None, foreign_key="user.id", nullable=False)
@@ -93,7 +123,8 @@ class ItemPublic(ItemBase):
 
 class ItemsPublic(SQLModel):
     data: list[ItemPublic]
-    count: int
+    count: int | None = None
+    next_cursor: str | None = None
 
 
 # Generic message
@@ -124,14 +155,21 @@ class ConversationBase(SQLModel):
 
 class ConversationUpdate(ConversationBase):
     summary: str
+    summary_message_id: int | None = None
 
 
 # Database model, database table inferred from class name
 class Conversation(ConversationBase, table=True):
+    __table_args__ = (
+        Index("ix_conversation_owner_id_modified_at", "owner_id", "modified_at", "id"),
+    )
+
     id: int | None = Field(default=None, primary_key=True)
     summary: str | None = None
-    created_at: str = Field(default_factory=lambda: datetime.utcnow().isoformat())
-    modified_at: str = Field(default_factory=lambda: datetime.utcnow().isoformat())
+    # Newest message folded into summary; later ones are not summarized yet
+    summary_message_id: int | None = None
+    created_at: datetime = TimestampField()
+    modified_at: datetime = TimestampField()
     messages: list["CnvMessage"] = Relationship(back_populates="conversation")
     owner_id: int = Field(foreign_key="user.id", nullable=False)
     owner: User = Relationship(back_populates="user_conversations")
@@ -140,8 +178,8 @@ class Conversation(ConversationBase, table=True):
 class ConversationPublic(ConversationBase):
     id: int
     summary: str | None = None
-    created_at: str
-    modified_at: str
+    created_at: ApiTimestamp
+    modified_at: ApiTimestamp
 
 
 class ConversationDetailPublic(ConversationPublic):
@@ -150,7 +188,8 @@ class ConversationDetailPublic(ConversationPublic):
 
 class ConversationsPublic(SQLModel):
     data: list[ConversationPublic]
-    count: int
+    count: int | None = None
+    next_cursor: str | None = None
 
 
 class CnvMessageBase(SQLModel):
@@ -172,12 +211,22 @@ class CnvMessageSystemCreate(CnvMessageBase):
 class CnvMessagePublic(CnvMessageBase):
     id: int
     role: str
-    created_at: str
+    created_at: ApiTimestamp
 
 
 class CnvMessage(CnvMessageBase, table=True):
+    __table_args__ = (
+        Index(
+            "ix_cnvmessage_conversation_id_created_at",
+            "conversation_id",
+            "created_at",
+            "id",
+        ),
+        Index("ix_cnvmessage_owner_id", "owner_id"),
+    )
+
     id: int | None = Field(default=None, primary_key=True)
-    created_at: str = Field(default_factory=lambda: datetime.utcnow().isoformat())
+    created_at: datetime = TimestampField()
     role: str
     content: str
     conversation_id: int = Field(foreign_key="conversation.id", nullable=False)
@@ -191,3 +240,75 @@ class ChatPublic(SQLModel):
     content: str
     question_id: int
     answer_id: int
+
+
+# Database model for cached moderation results, keyed by normalized content hash
+class ModerationVerdict(SQLModel, table=True):
+    __table_args__ = (Index("ix_moderationverdict_created_at", "created_at"),)
+
+    content_hash: str = Field(primary_key=True, max_length=64)
+    flagged: bool
+    created_at: datetime = TimestampField()
+
+
+# Database model for background jobs, claimed by workers with SKIP LOCKED.
+# At most one queued or running job exists per dedup_key; enqueueing while it
+# runs sets rerun so the job goes back to the queue when it finishes.
+class Job(SQLModel, table=True):
+    __table_args__ = (
+        Index("ix_job_status_run_at", "status", "run_at"),
+        Index(
+            "ix_job_dedup_key_active",
+            "dedup_key",
+            unique=True,
+            postgresql_where=text("status IN ('queued', 'running')"),
+        ),
+    )
+
+    id: int | None = Field(default=None, primary_key=True)
+    kind: str = Field(max_length=64)
+    dedup_key: str | None = Field(default=None, max_length=255)
+    payload: dict[str, Any] = Field(default_factory=dict, sa_type=JSONB)
+    status: str = Field(default="queued", max_length=16)
+    attempts: int = 0
+    max_attempts: int
+    rerun: bool = False
+    run_at: datetime = TimestampField()
+    locked_until: datetime | None = Field(
+        default=None,
+        sa_type=DateTime(timezone=True),  # type: ignore[call-overload]
+    )
+    # Set afresh by every claim, so only the latest claim can record an outcome
+    locked_by: str | None = Field(default=None, max_length=32)
+    last_error: str | None = None
+    created_at: datetime = TimestampField()
+
+
+# Database model for cached completions, keyed by a hash of the whole request
+class CachedCompletion(SQLModel, table=True):
+    __table_args__ = (Index("ix_cachedcompletion_created_at", "created_at"),)
+
+    key: str = Field(primary_key=True, max_length=64)
+    model: str
+    content: str
+    created_at: datetime = TimestampField()
+
+
+# Database model for provider rate limit token buckets shared by all processes.
+# Tokens may go negative: a caller that overdraws waits until they refill.
+class RateLimitBucket(SQLModel, table=True):
+    name: str = Field(primary_key=True, max_length=64)
+    capacity: float
+    rate: float
+    tokens: float
+    updated_at: datetime = TimestampField()
+
+
+# Database model for provider calls in flight, one row per call. A lease left
+# behind by a crashed process stops counting once it expires.
+class RateLimitLease(SQLModel, table=True):
+    id: int | None = Field(default=None, primary_key=True)
+    name: str = Field(max_length=64, index=True)
+    expires_at: datetime = Field(
+        sa_type=DateTime(timezone=True),  # type: ignore[call-overload]
+    )
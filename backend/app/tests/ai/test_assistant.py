@@ -0,0 +1,193 @@
+import asyncio
+
+import pytest
+from sqlmodel import Session
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from app import crud
+from app.ai import assistant
+from app.ai.assistant import (
+    AsyncLLMController,
+    StaticAnswers,
+    SystemPrompts,
+    generate_summary_async,
+    moderated_completion_async,
+    summary_is_due,
+)
+from app.ai.context import MESSAGE_OVERHEAD_TOKENS, approximate_token_count
+from app.core.config import settings
+from app.core.db import async_engine
+from app.models import (
+    CnvMessage,
+    CnvMessageUserCreate,
+    Conversation,
+    ConversationUpdate,
+)
+from app.tests.utils.conversation import create_random_conversation
+
+
+class DelayedLLM(AsyncLLMController):
+    def __init__(self, *, flagged: bool, moderation_delay: float = 0.0) -> None:
+        self.flagged = flagged
+        self.moderation_delay = moderation_delay
+        self.completion_started = False
+        self.completion_cancelled = False
+
+    async def moderate_input_is_flagged(self, text_to_validate: str) -> bool:  # noqa: ARG002
+        await asyncio.sleep(self.moderation_delay)
+        return self.flagged
+
+    async def single_completion(self, *args: object, **kwargs: object) -> str | None:  # noqa: ARG002
+        self.completion_started = True
+        try:
+            await asyncio.sleep(0.05)
+        except asyncio.CancelledError:
+            self.completion_cancelled = True
+            raise
+        return "Generated answer"
+
+
+def complete(llm: AsyncLLMController, *, concurrent: bool) -> str | None:
+    messages = [CnvMessage(role="user", content="Hello world!")]
+    return asyncio.run(
+        moderated_completion_async(
+            llm,
+            system_input=SystemPrompts.assistant,
+            messages_list=messages,
+            concurrent=concurrent,
+        )
+    )
+
+
+def test_sequential_moderation_skips_completion_when_flagged() -> None:
+    llm = DelayedLLM(flagged=True)
+    assert complete(llm, concurrent=False) == StaticAnswers.unsafe_mes
+    assert not llm.completion_started
+
+
+def test_concurrent_moderation_returns_completion() -> None:
+    llm = DelayedLLM(flagged=False, moderation_delay=0.01)
+    assert complete(llm, concurrent=True) == "Generated answer"
+
+
+def test_concurrent_moderation_cancels_completion_when_flagged() -> None:
+    llm = DelayedLLM(flagged=True, moderation_delay=0.01)
+    assert complete(llm, concurrent=True) == StaticAnswers.unsafe_mes
+    assert llm.completion_started
+    assert llm.completion_cancelled
+
+
+class RecordingLLM(AsyncLLMController):
+    def __init__(self) -> None:
+        self.calls: list[tuple[str, list[str]]] = []
+
+    async def single_completion(
+        self,
+        system_input: str,
+        messages_list: list[CnvMessage],
+        *args: object,  # noqa: ARG002
+        **kwargs: object,  # noqa: ARG002
+    ) -> str | None:
+        self.calls.append((system_input, [m.content for m in messages_list]))
+        return f"Summary {len(self.calls)}"
+
+
+def add_messages(db: Session, conversation: Conversation, count: int) -> None:
+    assert conversation.id is not None
+    for i in range(count):
+        crud.create_cnvmessage(
+            session=db,
+            cnv_in=CnvMessageUserCreate(content=f"message {i}"),
+            owner_id=conversation.owner_id,
+            conv_id=conversation.id,
+        )
+
+
+def summarize(conversation: Conversation) -> ConversationUpdate | None:
+    async def run() -> ConversationUpdate | None:
+        assert conversation.id is not None
+        async with AsyncSession(async_engine) as session:
+            return await generate_summary_async(
+                session=session, conv_id=conversation.id
+            )
+
+    return asyncio.run(run())
+
+
+def test_summary_is_due() -> None:
+    message = CnvMessage(role="user", content="Hello world!")
+    assert not summary_is_due(None, [])
+    assert summary_is_due(None, [message])
+    assert not summary_is_due("Summary", [message])
+    assert summary_is_due("Summary", [message] * settings.AI_SUMMARY_REFRESH_MESSAGES)
+    long_message = CnvMessage(
+        role="user", content="word " * settings.AI_SUMMARY_REFRESH_TOKENS
+    )
+    assert summary_is_due("Summary", [long_message])
+
+
+def test_generate_summary_folds_only_new_messages(
+    db: Session, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    llm = RecordingLLM()
+    monkeypatch.setattr(assistant, "get_async_llm_controller", lambda: llm)
+    monkeypatch.setattr(settings, "AI_SUMMARY_REFRESH_MESSAGES", 3)
+    conversation = create_random_conversation(db)
+    add_messages(db, conversation, 2)
+
+    first = summarize(conversation)
+    assert first is not None
+    assert llm.calls[0] == (SystemPrompts.summary_generator, ["message 0", "message 1"])
+    crud.update_conversation(session=db, conversation_in=first)
+
+    add_messages(db, conversation, 2)
+    assert summarize(conversation) is None
+
+    add_messages(db, conversation, 1)
+    second = summarize(conversation)
+    assert second is not None
+    system_input, contents = llm.calls[1]
+    assert system_input == SystemPrompts.summary_update.format(summary="Summary 1")
+    assert contents == ["message 0", "message 1", "message 0"]
+    assert second.summary == "Summary 2"
+    assert second.summary_message_id is not None
+    assert first.summary_message_id is not None
+    assert second.summary_message_id > first.summary_message_id
+
+
+def test_generate_summary_stops_watermark_at_last_message_that_fit(
+    db: Session, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    llm = RecordingLLM()
+    monkeypatch.setattr(assistant, "get_async_llm_controller", lambda: llm)
+    monkeypatch.setattr(settings, "AI_SUMMARY_REFRESH_MESSAGES", 1)
+    conversation = create_random_conversation(db)
+    add_messages(db, conversation, 3)
+    # Room for the system prompt and two of the three messages
+    system_tokens = approximate_token_count(SystemPrompts.summary_generator)
+    message_tokens = approximate_token_count("message 0") + MESSAGE_OVERHEAD_TOKENS
+    budget = system_tokens + MESSAGE_OVERHEAD_TOKENS + 2 * message_tokens
+    monkeypatch.setattr(settings, "AI_CONTEXT_MAX_TOKENS", budget)
+
+    first = summarize(conversation)
+    assert first is not None
+    assert llm.calls[0][1] == ["message 0", "message 1"]
+    crud.update_conversation(session=db, conversation_in=first)
+
+    second = summarize(conversation)
+    assert second is not None
+    assert llm.calls[1][1] == ["message 2"]
+    assert first.summary_message_id is not None
+    assert second.summary_message_id == first.summary_message_id + 1
+
+
+def test_mock_provider_answers_summaries_with_mock_summary(
+    db: Session, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    monkeypatch.setattr(settings, "AI_PROVIDER", "mock")
+    monkeypatch.setattr(assistant, "_async_llm_controller", None)
+    conversation = create_random_conversation(db)
+    add_messages(db, conversation, 1)
+    update = summarize(conversation)
+    assert update is not None
+    assert update.summary == StaticAnswers.mock_summary
@@ -0,0 +1,96 @@
+import asyncio
+
+import pytest
+
+from app.ai import assistant, clients
+from app.ai.assistant import (
+    AsyncLLMController,
+    SystemPrompts,
+    get_async_llm_controller,
+    reset_async_llm_controller,
+)
+from app.ai.moderation_cache import ModerationCache
+from app.ai.providers import AsyncOpenAIProvider
+from app.ai.stub_server import StubProviderServer
+from app.core.config import settings
+from app.models import CnvMessage
+
+
+def test_get_llm_controller_is_shared(monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(settings, "AI_PROVIDER", "openai")
+
+    async def run() -> None:
+        await reset_async_llm_controller()
+        llm = get_async_llm_controller()
+        assert get_async_llm_controller() is llm
+        assert isinstance(llm.provider, AsyncOpenAIProvider)
+        assert llm.provider.client is clients.get_async_openai_client()
+        await reset_async_llm_controller()
+        assert get_async_llm_controller() is not llm
+        await reset_async_llm_controller()
+
+    asyncio.run(run())
+
+
+def test_pooled_client_reuses_connection(monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(
+        assistant,
+        "moderation_cache",
+        ModerationCache(maxsize=0, ttl=0, persistent=False),
+    )
+    messages = [CnvMessage(role="user", content="Hello world!")]
+
+    async def run_turns(base_url: str) -> None:
+        llm = AsyncLLMController(
+            openai_client=clients.get_async_openai_client(base_url)
+        )
+        for _ in range(3):
+            assert not await llm.moderate_input_is_flagged(messages[-1].content)
+            answer = await llm.single_completion(
+                system_input=SystemPrompts.assistant, messages_list=messages
+            )
+            assert answer == "Pooled answer"
+        await clients.aclose_clients()
+
+    with StubProviderServer(answer="Pooled answer") as stub:
+        asyncio.run(run_turns(stub.base_url))
+    assert stub.requests == 6
+    assert stub.connections == 1
+
+
+def test_stub_provider_flags_unsafe_input() -> None:
+    async def run(base_url: str) -> bool:
+        llm = AsyncLLMController(
+            openai_client=clients.get_async_openai_client(base_url)
+        )
+        try:
+            return await llm.moderate_input_is_flagged("something unsafe")
+        finally:
+            await clients.aclose_clients()
+
+    with StubProviderServer() as stub:
+        assert asyncio.run(run(stub.base_url))
+
+
+def test_async_controller_shares_pool() -> None:
+    messages = [CnvMessage(role="user", content="Hello world!")]
+
+    async def run_turns(base_url: str) -> list[str | None]:
+        llm = AsyncLLMController(
+            openai_client=clients.get_async_openai_client(base_url)
+        )
+        answers = await asyncio.gather(
+            *(
+                llm.single_completion(
+                    system_input=SystemPrompts.assistant, messages_list=messages
+                )
+                for _ in range(5)
+            )
+        )
+        await clients.aclose_clients()
+        return list(answers)
+
+    with StubProviderServer(answer="Async answer", completion_latency=0.05) as stub:
+        answers = asyncio.run(run_turns(stub.base_url))
+    assert answers == ["Async answer"] * 5
+    assert stub.requests == 5
@@ -0,0 +1,107 @@
+import asyncio
+
+import pytest
+from sqlmodel import Session, select
+
+from app.ai import assistant, clients
+from app.ai.assistant import AsyncLLMController, OpenAIModels, SystemPrompts
+from app.ai.completion_cache import CompletionCache, completion_key
+from app.ai.stub_server import StubProviderServer
+from app.core import metrics
+from app.models import CachedCompletion, CnvMessage
+from app.tests.utils.utils import random_lower_string
+
+MODEL = OpenAIModels.gpt_35_turbo
+
+
+def question(content: str = "Explain list comprehension") -> list[CnvMessage]:
+    return [CnvMessage(role="user", content=content)]
+
+
+def test_completion_key_covers_the_whole_request() -> None:
+    base = {
+        "model": MODEL,
+        "max_tokens": 100,
+        "temperature": None,
+        "system_input": SystemPrompts.assistant,
+        "messages": question(),
+    }
+    key = completion_key(**base)  # type: ignore[arg-type]
+    assert completion_key(**base) == key  # type: ignore[arg-type]
+    for field, value in [
+        ("model", "gpt-4"),
+        ("max_tokens", 20),
+        ("temperature", 0.0),
+        ("system_input", SystemPrompts.summary_generator),
+        ("messages", question("Explain dict comprehension")),
+    ]:
+        assert completion_key(**{**base, field: value}) != key  # type: ignore[arg-type]
+
+
+def test_cache_accepts_first_turns_and_deterministic_requests() -> None:
+    cache = CompletionCache(models=[MODEL], maxsize=10, ttl=60, persistent=False)
+    assert cache.accepts(model=MODEL, first_turn=True, temperature=None)
+    assert not cache.accepts(model=MODEL, first_turn=False, temperature=None)
+    assert cache.accepts(model=MODEL, first_turn=False, temperature=0)
+    assert not cache.accepts(model="gpt-4", first_turn=True, temperature=0)
+    disabled = CompletionCache(models=[MODEL], maxsize=0, ttl=60, persistent=False)
+    assert not disabled.accepts(model=MODEL, first_turn=True, temperature=0)
+
+
+def test_first_turn_completion_is_served_from_cache(
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    cache = CompletionCache(models=[MODEL], maxsize=10, ttl=60, persistent=False)
+    monkeypatch.setattr(assistant, "completion_cache", cache)
+    hits = metrics.get("completion_cache.hits")
+    history = question() + [
+        CnvMessage(role="assistant", content="Answer"),
+        CnvMessage(role="user", content="And dicts?"),
+    ]
+
+    async def run(base_url: str) -> None:
+        llm = AsyncLLMController(
+            openai_client=clients.get_async_openai_client(base_url)
+        )
+        for _ in range(3):
+            answer = await llm.single_completion(SystemPrompts.assistant, question())
+            assert answer == "Cached answer"
+        await llm.single_completion(SystemPrompts.assistant, history)
+        await llm.single_completion(SystemPrompts.assistant, history)
+        # The last turn of a trimmed history looks like a first turn
+        for _ in range(2):
+            await llm.single_completion(
+                SystemPrompts.assistant, question("And sets?"), first_turn=False
+            )
+        await clients.aclose_clients()
+
+    with StubProviderServer(answer="Cached answer") as stub:
+        asyncio.run(run(stub.base_url))
+    assert stub.requests == 5
+    assert metrics.get("completion_cache.hits") == hits + 2
+    assert 0 < metrics.get("completion_cache.hit_rate") <= 1
+
+
+def test_completion_cache_persistent_tier(db: Session) -> None:
+    key = random_lower_string()
+
+    async def run() -> None:
+        await CompletionCache(
+            models=[MODEL], maxsize=10, ttl=60, persistent=True
+        ).set_async(key, MODEL, "Shared answer")
+        other_worker = CompletionCache(
+            models=[MODEL], maxsize=10, ttl=60, persistent=True
+        )
+        assert await other_worker.get_async(key) == "Shared answer"
+        assert other_worker.memory.get(key) == "Shared answer"
+
+        expired = CompletionCache(models=[MODEL], maxsize=10, ttl=0, persistent=True)
+        assert await expired.get_async(key) is None
+        await expired.set_async(random_lower_string(), MODEL, "Newer answer")
+
+    asyncio.run(run())
+    db.expire_all()
+    assert (
+        db.exec(select(CachedCompletion).where(CachedCompletion.key == key)).first()
+        is None
+    )
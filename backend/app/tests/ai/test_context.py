@@ -0,0 +1,91 @@
+from app.ai.context import (
+    MESSAGE_OVERHEAD_TOKENS,
+    build_context,
+    build_oldest_context,
+)
+from app.models import CnvMessage
+
+
+def count_words(text: str) -> int:
+    return len(text.split())
+
+
+def make_messages(count: int) -> list[CnvMessage]:
+    roles = ("user", "assistant")
+    return [
+        CnvMessage(role=roles[i % 2], content=f"message {i} " + "word " * 8)
+        for i in range(count)
+    ]
+
+
+def test_build_context_keeps_everything_within_budget() -> None:
+    messages = make_messages(4)
+    context = build_context(
+        system_input="system",
+        messages=messages,
+        max_tokens=1000,
+        count_tokens=count_words,
+    )
+    assert context.messages == messages
+    assert context.system_input == "system"
+    assert context.trimmed == 0
+    assert context.tokens == 1 + 4 * 10 + 5 * MESSAGE_OVERHEAD_TOKENS
+
+
+def test_build_context_keeps_newest_messages() -> None:
+    messages = make_messages(10)
+    # system prompt (5) + three messages (14 each)
+    context = build_context(
+        system_input="system",
+        messages=messages,
+        max_tokens=50,
+        count_tokens=count_words,
+    )
+    assert context.messages == messages[-3:]
+    assert context.trimmed == 7
+    assert context.tokens <= 50
+
+
+def test_build_context_adds_summary_of_trimmed_prefix() -> None:
+    messages = make_messages(10)
+    context = build_context(
+        system_input="system",
+        messages=messages,
+        max_tokens=50,
+        count_tokens=count_words,
+        summary="a longer rolling summary",
+        summary_template="{system_input} {summary}",
+    )
+    assert context.system_input == "system a longer rolling summary"
+    assert context.messages == messages[-2:]
+    assert context.tokens <= 50
+
+
+def test_build_context_always_keeps_last_message() -> None:
+    messages = make_messages(3)
+    context = build_context(
+        system_input="system", messages=messages, max_tokens=1, count_tokens=count_words
+    )
+    assert context.messages == messages[-1:]
+
+
+def test_build_oldest_context_keeps_oldest_messages() -> None:
+    messages = make_messages(6)
+    context = build_oldest_context(
+        system_input="system",
+        messages=messages,
+        max_tokens=5 + 3 * 14,
+        count_tokens=count_words,
+    )
+    assert context.messages == messages[:3]
+    assert context.trimmed == 3
+    assert context.tokens == 5 + 3 * 14
+
+
+def test_build_oldest_context_always_keeps_first_message() -> None:
+    messages = make_messages(2)
+    context = build_oldest_context(
+        system_input="system", messages=messages, max_tokens=1, count_tokens=count_words
+    )
+    assert context.messages == messages[:1]
+    assert context.trimmed == 1
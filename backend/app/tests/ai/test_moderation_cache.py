@@ -0,0 +1,59 @@
+import asyncio
+
+import pytest
+from sqlmodel import Session
+
+from app.ai import assistant, clients
+from app.ai.assistant import AsyncLLMController
+from app.ai.moderation_cache import ModerationCache, content_hash
+from app.ai.stub_server import StubProviderServer
+from app.core import metrics
+from app.models import ModerationVerdict
+from app.tests.utils.utils import random_lower_string
+
+
+def test_content_hash_ignores_case_and_whitespace() -> None:
+    assert content_hash("Explain  list comprehension\n") == content_hash(
+        "explain list COMPREHENSION"
+    )
+    assert content_hash("explain list comprehension") != content_hash(
+        "explain dict comprehension"
+    )
+
+
+def test_moderation_is_served_from_cache(monkeypatch: pytest.MonkeyPatch) -> None:
+    cache = ModerationCache(maxsize=100, ttl=60, persistent=False)
+    monkeypatch.setattr(assistant, "moderation_cache", cache)
+    hits = metrics.get("moderation_cache.hits")
+
+    async def run(base_url: str) -> None:
+        llm = AsyncLLMController(
+            openai_client=clients.get_async_openai_client(base_url)
+        )
+        assert not await llm.moderate_input_is_flagged("Explain list comprehension")
+        assert not await llm.moderate_input_is_flagged("explain list  comprehension ")
+        assert await llm.moderate_input_is_flagged("Something unsafe")
+        assert await llm.moderate_input_is_flagged("something UNSAFE")
+        await clients.aclose_clients()
+
+    with StubProviderServer() as stub:
+        asyncio.run(run(stub.base_url))
+    assert stub.requests == 2
+    assert metrics.get("moderation_cache.hits") == hits + 2
+
+
+def test_moderation_cache_persistent_tier(db: Session) -> None:
+    key = content_hash(random_lower_string())
+
+    async def run() -> None:
+        await ModerationCache(maxsize=100, ttl=60, persistent=True).set_async(key, True)
+        other_worker = ModerationCache(maxsize=100, ttl=60, persistent=True)
+        assert await other_worker.get_async(key) is True
+        assert other_worker.memory.get(key) is True
+        expired = ModerationCache(maxsize=100, ttl=0, persistent=True)
+        assert await expired.get_async(key) is None
+        await expired.set_async(content_hash(random_lower_string()), False)
+
+    asyncio.run(run())
+    db.expire_all()
+    assert db.get(ModerationVerdict, key) is None
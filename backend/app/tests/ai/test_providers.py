@@ -0,0 +1,161 @@
+import asyncio
+import random
+import time
+from dataclasses import replace
+
+import pytest
+from openai import AsyncOpenAI, InternalServerError, RateLimitError
+
+from app.ai import assistant, clients, providers
+from app.ai.assistant import AsyncLLMController, SystemPrompts
+from app.ai.providers import (
+    AsyncMockProvider,
+    AsyncOpenAIProvider,
+    CompletionRequest,
+)
+from app.ai.stub_server import Latency, StubProviderServer
+from app.core.config import settings
+from app.models import CnvMessage
+
+
+def request(max_tokens: int = 2000) -> CompletionRequest:
+    return CompletionRequest(
+        system_input=SystemPrompts.assistant,
+        messages=[CnvMessage(role="user", content="Hello world!")],
+        model="gpt-3.5-turbo",
+        max_tokens=max_tokens,
+    )
+
+
+def bare_provider(stub: StubProviderServer) -> AsyncOpenAIProvider:
+    client = AsyncOpenAI(api_key="NoKey", base_url=stub.base_url, max_retries=0)
+    return AsyncOpenAIProvider(client)
+
+
+def test_mock_provider_answers_within_max_tokens() -> None:
+    provider = AsyncMockProvider("One two three four", flagged_words=("unsafe",))
+
+    async def run() -> None:
+        assert await provider.complete(request()) == "One two three four"
+        assert await provider.complete(request(max_tokens=2)) == "One two "
+        chunks = [chunk async for chunk in provider.stream(request())]
+        assert chunks == ["One ", "two ", "three ", "four"]
+        assert await provider.moderate("Something UNSAFE")
+        assert not await provider.moderate("Hello world!")
+        summary = replace(request(), summary=True)
+        assert await provider.complete(summary) == "One two three four"
+        with_summary = AsyncMockProvider("One two three four", summary="Summary")
+        assert await with_summary.complete(summary) == "Summary"
+        assert await with_summary.complete(request()) == "One two three four"
+
+    asyncio.run(run())
+
+
+def test_async_mock_provider() -> None:
+    async def run() -> tuple[str | None, list[str]]:
+        llm = AsyncLLMController(provider=AsyncMockProvider("One two"))
+        answer = await llm.single_completion(
+            SystemPrompts.assistant, request().messages
+        )
+        chunks = [
+            chunk
+            async for chunk in llm.stream_completion(
+                SystemPrompts.assistant, request().messages
+            )
+        ]
+        return answer, chunks
+
+    assert asyncio.run(run()) == ("One two", ["One ", "two"])
+
+
+def test_provider_follows_settings(monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(settings, "AI_PROVIDER", "mock")
+    assert isinstance(AsyncLLMController().provider, AsyncMockProvider)
+    monkeypatch.setattr(settings, "AI_PROVIDER", "stub")
+    provider = AsyncLLMController().provider
+    assert isinstance(provider, AsyncOpenAIProvider)
+    assert str(provider.client.base_url) == providers.get_stub_server().base_url + "/"
+
+    async def run() -> str | None:
+        try:
+            return await provider.complete(request())
+        finally:
+            await clients.aclose_clients()
+
+    assert asyncio.run(run()) == settings.AI_STUB_ANSWER
+
+
+def test_latency_parse_and_sample() -> None:
+    rng = random.Random(1)
+    assert Latency.parse(0.2) == Latency("fixed", 0.2)
+    assert Latency.parse("0.2") == Latency("fixed", 0.2)
+    assert Latency.parse("fixed:0.3").sample(rng) == 0.3
+    assert 0.1 <= Latency.parse("uniform:0.1,0.5").sample(rng) <= 0.5
+    samples = [Latency.parse("lognormal:0.2,0.5").sample(rng) for _ in range(1000)]
+    assert 0.15 < sorted(samples)[500] < 0.25
+    assert max(samples) > 0.4
+    with pytest.raises(ValueError):
+        Latency.parse("pareto:1,2")
+    with pytest.raises(ValueError):
+        Latency.parse("lognormal:0")
+
+
+def test_stub_injects_errors_and_rate_limits() -> None:
+    with StubProviderServer(error_rate=1.0) as stub:
+        with pytest.raises(InternalServerError):
+            asyncio.run(bare_provider(stub).complete(request()))
+        assert stub.failed == 1
+    with StubProviderServer(rate_limit_rate=1.0) as stub:
+        with pytest.raises(RateLimitError) as excinfo:
+            asyncio.run(bare_provider(stub).moderate("Hello world!"))
+        assert excinfo.value.response.headers["Retry-After"] == "1.000"
+        assert stub.rate_limited == 1
+
+
+def test_stub_requests_per_minute_budget() -> None:
+    async def run(provider: AsyncOpenAIProvider) -> None:
+        assert not await provider.moderate("Hello world!")
+        assert not await provider.moderate("Hello world!")
+        await provider.moderate("Hello world!")
+
+    with StubProviderServer(requests_per_minute=2) as stub:
+        with pytest.raises(RateLimitError) as excinfo:
+            asyncio.run(run(bare_provider(stub)))
+        retry_after = float(excinfo.value.response.headers["Retry-After"])
+        assert 25 < retry_after <= 30
+        assert stub.rate_limited == 1
+
+
+def test_stub_token_rate_and_max_tokens() -> None:
+    async def run(provider: AsyncOpenAIProvider) -> None:
+        start = time.perf_counter()
+        assert await provider.complete(request()) == "a b c d e f g h i j"
+        assert time.perf_counter() - start >= 0.1
+        assert await provider.complete(request(max_tokens=3)) == "a b c "
+        chunks = [chunk async for chunk in provider.stream(request(max_tokens=4))]
+        assert "".join(chunks) == "a b c d "
+
+    with StubProviderServer(
+        answer="a b c d e f g h i j", tokens_per_second=100
+    ) as stub:
+        asyncio.run(run(bare_provider(stub)))
+
+
+def test_stream_answer_through_stub_provider(monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(settings, "AI_PROVIDER", "stub")
+    monkeypatch.setattr(assistant, "_async_llm_controller", None)
+    messages = [CnvMessage(role="user", content="Hello world!")]
+
+    async def run() -> str:
+        try:
+            chunks = [
+                chunk
+                async for chunk in assistant.stream_answer_async(messages_list=messages)
+            ]
+            return "".join(chunks)
+        finally:
+            await clients.aclose_clients()
+
+    requests = providers.get_stub_server().requests
+    assert asyncio.run(run()) == settings.AI_STUB_ANSWER
+    assert providers.get_stub_server().requests == requests + 2
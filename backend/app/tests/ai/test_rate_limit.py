@@ -0,0 +1,280 @@
+import asyncio
+import time
+from datetime import timedelta
+from typing import Any
+
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import event
+from sqlmodel import Session, select
+
+from app.ai import assistant
+from app.ai.rate_limit import (
+    Bucket,
+    MemoryBackend,
+    PostgresBackend,
+    ProviderLimiter,
+    RateLimitTimeout,
+)
+from app.core import metrics
+from app.core.config import settings
+from app.core.db import async_engine
+from app.models import RateLimitBucket
+from app.tests.utils.utils import random_lower_string
+
+
+def make_limiter(
+    backend: MemoryBackend | PostgresBackend,
+    *,
+    per_minute: float = 600,
+    burst_seconds: float = 0.2,
+    max_in_flight: int = 10,
+    max_wait: float = 5.0,
+    name: str = "test:rpm",
+    pool: str = "test",
+) -> ProviderLimiter:
+    return ProviderLimiter(
+        backend=backend,
+        buckets=[Bucket(name, per_minute, burst_seconds)],
+        pool=pool,
+        max_in_flight=max_in_flight,
+        max_wait=max_wait,
+    )
+
+
+async def call(limiter: ProviderLimiter, *costs: float) -> None:
+    async with limiter.limit_async(*costs):
+        pass
+
+
+def test_bucket_lets_a_burst_through_then_paces_calls() -> None:
+    limiter = make_limiter(MemoryBackend())
+
+    async def run() -> None:
+        start = time.monotonic()
+        for _ in range(2):
+            await call(limiter, 1)
+        assert time.monotonic() - start < 0.05
+        await call(limiter, 1)
+        assert time.monotonic() - start >= 0.08
+
+    asyncio.run(run())
+
+
+def test_wait_past_deadline_fails_and_refunds() -> None:
+    backend = MemoryBackend()
+    limiter = make_limiter(backend, max_wait=0.05)
+    timeouts = metrics.get("rate_limit.timeouts")
+    asyncio.run(call(limiter, 2))
+    with pytest.raises(RateLimitTimeout) as excinfo:
+        asyncio.run(call(limiter, 5))
+    assert excinfo.value.retry_after > 0.05
+    assert metrics.get("rate_limit.timeouts") == timeouts + 1
+    tokens, _ = backend.tokens["test:rpm"]
+    assert tokens > -0.1
+
+
+def test_without_backend_calls_go_straight_through() -> None:
+    limiter = ProviderLimiter(
+        backend=None,
+        buckets=[Bucket("test:rpm", 1, 1)],
+        pool="test",
+        max_in_flight=0,
+        max_wait=0,
+    )
+    for _ in range(3):
+        asyncio.run(call(limiter, 100))
+
+
+def test_max_in_flight_queues_calls() -> None:
+    limiter = make_limiter(MemoryBackend(), per_minute=0, max_in_flight=2)
+    in_flight = 0
+    peak = 0
+
+    async def call() -> None:
+        nonlocal in_flight, peak
+        async with limiter.limit_async(1):
+            in_flight += 1
+            peak = max(peak, in_flight)
+            await asyncio.sleep(0.02)
+            in_flight -= 1
+
+    async def run() -> None:
+        await asyncio.gather(*(call() for _ in range(6)))
+
+    asyncio.run(run())
+    assert peak == 2
+
+
+def test_max_in_flight_wait_has_a_deadline() -> None:
+    limiter = make_limiter(MemoryBackend(), per_minute=0, max_in_flight=1)
+    short = make_limiter(
+        limiter.backend,  # type: ignore[arg-type]
+        per_minute=0,
+        max_in_flight=1,
+        max_wait=0.05,
+    )
+
+    async def run() -> None:
+        async with limiter.limit_async(1):
+            with pytest.raises(RateLimitTimeout):
+                await call(short, 1)
+        await call(short, 1)
+
+    asyncio.run(run())
+
+
+def test_postgres_buckets_are_shared_between_processes(db: Session) -> None:
+    name = f"test:{random_lower_string()}"
+    # Two backends stand in for two worker processes
+    first = make_limiter(PostgresBackend(timedelta(seconds=60)), name=name)
+    second = make_limiter(PostgresBackend(timedelta(seconds=60)), name=name)
+
+    async def run() -> None:
+        start = time.monotonic()
+        await call(first, 1)
+        await call(second, 1)
+        assert time.monotonic() - start < 0.08
+        await call(first, 1)
+        assert time.monotonic() - start >= 0.08
+
+    asyncio.run(run())
+    bucket = db.exec(select(RateLimitBucket).where(RateLimitBucket.name == name)).one()
+    assert bucket.capacity == pytest.approx(2)
+    assert bucket.rate == pytest.approx(10)
+
+    too_costly = make_limiter(second.backend, name=name, max_wait=0.01)  # type: ignore[arg-type]
+    with pytest.raises(RateLimitTimeout):
+        asyncio.run(call(too_costly, 10))
+    db.refresh(bucket)
+    assert bucket.tokens > -1
+
+
+def test_postgres_leases_cap_concurrency_across_connections() -> None:
+    pool = f"test:{random_lower_string()}"
+    backend = PostgresBackend(timedelta(seconds=60))
+    in_flight = 0
+    peak = 0
+
+    async def hold() -> None:
+        nonlocal in_flight, peak
+        limiter = make_limiter(
+            PostgresBackend(timedelta(seconds=60)),
+            per_minute=0,
+            max_in_flight=3,
+            pool=pool,
+        )
+        async with limiter.limit_async(1):
+            in_flight += 1
+            peak = max(peak, in_flight)
+            await asyncio.sleep(0.02)
+            in_flight -= 1
+
+    async def run() -> int | None:
+        await asyncio.gather(*(hold() for _ in range(12)))
+        _, lease = await backend.acquire_async({}, pool, 3)
+        return lease
+
+    assert asyncio.run(run()) is not None
+    assert peak == 3
+
+
+def test_expired_postgres_lease_stops_counting() -> None:
+    pool = f"test:{random_lower_string()}"
+
+    async def run() -> None:
+        crashed = PostgresBackend(timedelta(seconds=0))
+        assert (await crashed.acquire_async({}, pool, 1))[1] is not None
+        fresh = PostgresBackend(timedelta(seconds=60))
+        assert (await fresh.acquire_async({}, pool, 1))[1] is not None
+
+    asyncio.run(run())
+
+
+def test_postgres_draw_and_lease_share_one_transaction() -> None:
+    name = f"test:{random_lower_string()}"
+    backend = PostgresBackend(timedelta(seconds=60))
+    bucket = Bucket(name, 600, 0.2)
+    commits = 0
+
+    def count_commit(_conn: Any) -> None:
+        nonlocal commits
+        commits += 1
+
+    async def run() -> tuple[float, int | None]:
+        event.listen(async_engine.sync_engine, "commit", count_commit)
+        try:
+            return await backend.acquire_async({bucket: 1}, name, 1)
+        finally:
+            event.remove(async_engine.sync_engine, "commit", count_commit)
+
+    wait, lease = asyncio.run(run())
+    assert wait == 0
+    assert lease is not None
+    assert commits == 1
+    # In debt, the slot stays free for callers that can go now
+    wait, lease = asyncio.run(backend.acquire_async({bucket: 5}, name, 1))
+    assert wait > 0
+    assert lease is None
+
+
+class SlowMemoryBackend(MemoryBackend):
+    """
+    A backend whose answers take a while to come back, like a remote one.
+    """
+
+    async def acquire_async(
+        self, costs: dict[Bucket, float], name: str, limit: int
+    ) -> tuple[float, int | None]:
+        taken = await super().acquire_async(costs, name, limit)
+        await asyncio.sleep(0.05)
+        return taken
+
+    async def release_async(self, lease: int) -> None:
+        await asyncio.sleep(0.05)
+        await super().release_async(lease)
+
+
+def test_cancelled_calls_give_their_slot_back() -> None:
+    backend = SlowMemoryBackend()
+    limiter = make_limiter(backend, per_minute=0, max_in_flight=1)
+
+    async def hold() -> None:
+        async with limiter.limit_async(1):
+            await asyncio.sleep(1)
+
+    async def cancel_after(delay: float) -> None:
+        task = asyncio.create_task(hold())
+        await asyncio.sleep(delay)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    async def run() -> None:
+        # While the lease is on its way back from the backend
+        await cancel_after(0.01)
+        await asyncio.sleep(0.1)
+        assert backend.leases == {}
+        # While holding the slot; the release outlives the cancellation
+        await cancel_after(0.1)
+        assert backend.leases == {}
+
+    asyncio.run(run())
+
+
+def test_chat_answers_503_when_provider_queue_times_out(
+    client: TestClient,
+    normal_user_token_headers: dict[str, str],
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    backend = MemoryBackend()
+    limiter = make_limiter(backend, per_minute=60, burst_seconds=1, max_wait=0.01)
+    monkeypatch.setattr(assistant, "moderation_limiter", limiter)
+    asyncio.run(call(limiter, 1))
+    response = client.post(
+        f"{settings.API_V1_STR}/chat",
+        headers=normal_user_token_headers,
+        json={"content": random_lower_string()},
+    )
+    assert response.status_code == 503
+    assert response.headers["Retry-After"] == "1"
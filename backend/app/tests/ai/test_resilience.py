@@ -0,0 +1,335 @@
+import asyncio
+import time
+
+import httpx
+import openai
+import pytest
+from fastapi.testclient import TestClient
+
+from app.ai import assistant, clients
+from app.ai.assistant import AsyncLLMController, StaticAnswers
+from app.ai.moderation_cache import ModerationCache
+from app.ai.providers import AsyncMockProvider, AsyncOpenAIProvider, CompletionRequest
+from app.ai.rate_limit import MemoryBackend, ProviderLimiter, RateLimitTimeout
+from app.ai.resilience import CircuitBreaker, CompletionPolicy, ProviderUnavailable
+from app.ai.stub_server import StubProviderServer
+from app.core import metrics
+from app.core.config import settings
+from app.models import CnvMessage
+from app.tests.utils.utils import random_lower_string
+
+REQUEST = httpx.Request("POST", "http://provider/v1/chat/completions")
+
+
+class FakeClock:
+    def __init__(self) -> None:
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def state(breaker: CircuitBreaker) -> str:
+    return breaker.state
+
+
+def make_policy(
+    *,
+    failure_threshold: int = 5,
+    timeout: float = 5.0,
+    max_attempts: int = 3,
+    hedge_percentile: float | None = None,
+) -> CompletionPolicy:
+    return CompletionPolicy(
+        breaker=CircuitBreaker(failure_threshold=failure_threshold, reset_timeout=30),
+        timeout=timeout,
+        max_attempts=max_attempts,
+        retry_base=0.01,
+        retry_max=0.02,
+        hedge_percentile=hedge_percentile,
+        hedge_min_samples=5,
+    )
+
+
+def rate_limit_error(retry_after: str) -> openai.RateLimitError:
+    response = httpx.Response(
+        429, headers={"retry-after": retry_after}, request=REQUEST
+    )
+    return openai.RateLimitError("Too many requests", response=response, body=None)
+
+
+def test_breaker_opens_then_lets_one_trial_through() -> None:
+    clock = FakeClock()
+    breaker = CircuitBreaker(failure_threshold=2, reset_timeout=10, clock=clock)
+    breaker.record_failure()
+    assert breaker.allow()
+    breaker.record_failure()
+    assert state(breaker) == "open"
+    assert not breaker.allow()
+    assert breaker.retry_after() == 10
+
+    clock.now = 10
+    assert breaker.allow()
+    assert state(breaker) == "half_open"
+    assert not breaker.allow()
+    breaker.record_failure()
+    assert state(breaker) == "open"
+
+    clock.now = 20
+    assert breaker.allow()
+    breaker.record_success()
+    assert state(breaker) == "closed"
+    assert breaker.allow()
+
+
+def test_breaker_guard_counts_only_provider_errors() -> None:
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=10)
+    with pytest.raises(ValueError):
+        with breaker.guard():
+            raise ValueError
+    assert state(breaker) == "closed"
+    with pytest.raises(ProviderUnavailable):
+        with breaker.guard():
+            raise openai.APIConnectionError(request=REQUEST)
+    assert state(breaker) == "open"
+    with pytest.raises(ProviderUnavailable):
+        with breaker.guard():
+            pass
+
+
+def test_policy_retries_retryable_errors() -> None:
+    policy = make_policy()
+    errors: list[Exception] = [
+        openai.APIConnectionError(request=REQUEST),
+        rate_limit_error("0"),
+    ]
+    retries = metrics.get("completion.retries")
+
+    async def attempt(_timeout: float) -> str:
+        if errors:
+            raise errors.pop(0)
+        return "answer"
+
+    assert asyncio.run(policy.run_async(attempt)) == "answer"
+    assert metrics.get("completion.retries") == retries + 2
+    assert policy.breaker.failures == 0
+
+
+def test_policy_does_not_retry_other_errors() -> None:
+    policy = make_policy()
+    calls = []
+
+    async def attempt(_timeout: float) -> str:
+        calls.append(1)
+        raise openai.BadRequestError(
+            "Bad request", response=httpx.Response(400, request=REQUEST), body=None
+        )
+
+    with pytest.raises(openai.BadRequestError):
+        asyncio.run(policy.run_async(attempt))
+    assert len(calls) == 1
+    assert state(policy.breaker) == "closed"
+
+
+def test_policy_honours_retry_after() -> None:
+    policy = make_policy()
+    assert policy.retry_delay(1, rate_limit_error("0.3")) == 0.3
+    assert 0.005 <= policy.retry_delay(1, TimeoutError()) <= 0.01
+    assert policy.retry_delay(5, TimeoutError()) <= 0.02
+
+
+def test_policy_gives_up_at_the_deadline() -> None:
+    policy = make_policy(timeout=0.1, max_attempts=10)
+    timeouts = metrics.get("completion.timeouts")
+
+    async def attempt(_timeout: float) -> str:
+        await asyncio.sleep(1)
+        return "late"
+
+    start = time.monotonic()
+    with pytest.raises(ProviderUnavailable):
+        asyncio.run(policy.run_async(attempt))
+    assert time.monotonic() - start < 0.5
+    assert metrics.get("completion.timeouts") == timeouts + 1
+
+
+def test_policy_hedges_slow_attempts() -> None:
+    policy = make_policy(hedge_percentile=90)
+    for _ in range(5):
+        policy.latencies.add(0.02)
+    delays = [1.0, 0.0]
+    hedge_wins = metrics.get("completion.hedge_wins")
+
+    async def attempt(_timeout: float) -> float:
+        delay = delays.pop(0)
+        await asyncio.sleep(delay)
+        return delay
+
+    start = time.monotonic()
+    assert asyncio.run(policy.run_async(attempt)) == 0.0
+    assert time.monotonic() - start < 0.5
+    assert metrics.get("completion.hedge_wins") == hedge_wins + 1
+
+
+def test_rate_limiter_queue_is_not_provider_time_or_failure() -> None:
+    policy = make_policy(failure_threshold=1, timeout=0.1, max_attempts=1)
+    backend = MemoryBackend()
+    limiter = ProviderLimiter(
+        backend=backend, buckets=[], pool="test", max_in_flight=1, max_wait=1.0
+    )
+    impatient = ProviderLimiter(
+        backend=backend, buckets=[], pool="test", max_in_flight=1, max_wait=0.01
+    )
+    timeouts = metrics.get("completion.timeouts")
+
+    async def attempt(_timeout: float) -> str:
+        return "answer"
+
+    async def hold_slot() -> None:
+        async with limiter.limit_async():
+            await asyncio.sleep(0.2)
+
+    async def run() -> str:
+        holder = asyncio.create_task(hold_slot())
+        await asyncio.sleep(0)
+        with pytest.raises(RateLimitTimeout):
+            await policy.run_async(attempt, impatient.limit_async)
+        # Queued past the 0.1s deadline, yet the provider call still goes out
+        answer = await policy.run_async(attempt, limiter.limit_async)
+        await holder
+        return answer
+
+    assert asyncio.run(run()) == "answer"
+    assert state(policy.breaker) == "closed"
+    assert policy.breaker.failures == 0
+    assert metrics.get("completion.timeouts") == timeouts
+
+
+class FailingModerationProvider(AsyncMockProvider):
+    async def moderate(self, text: str) -> bool:
+        raise openai.APIConnectionError(request=REQUEST)
+
+
+def test_moderation_failures_have_a_breaker_of_their_own(
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    policy = make_policy(failure_threshold=1)
+    moderation_breaker = CircuitBreaker(failure_threshold=1, reset_timeout=30)
+    monkeypatch.setattr(assistant, "completion_policy", policy)
+    monkeypatch.setattr(assistant, "moderation_breaker", moderation_breaker)
+    monkeypatch.setattr(
+        assistant,
+        "moderation_cache",
+        ModerationCache(maxsize=0, ttl=0, persistent=False),
+    )
+    llm = AsyncLLMController(provider=FailingModerationProvider("Answer"))
+    messages = [CnvMessage(role="user", content="Hello world!")]
+
+    async def run() -> str | None:
+        for _ in range(2):
+            with pytest.raises(ProviderUnavailable):
+                await llm.moderate_input_is_flagged("Hello world!")
+        return await llm.single_completion("System", messages)
+
+    assert asyncio.run(run()) == "Answer"
+    assert state(moderation_breaker) == "open"
+    assert state(policy.breaker) == "closed"
+
+
+class TimingOutProvider(AsyncMockProvider):
+    def __init__(self) -> None:
+        super().__init__("Never sent")
+        self.calls = 0
+
+    async def complete(self, request: CompletionRequest) -> str | None:
+        self.calls += 1
+        await asyncio.wait_for(asyncio.sleep(1), 0.01)
+        return None
+
+
+def test_chat_retries_wait_for_timeouts_then_falls_back(
+    client: TestClient,
+    normal_user_token_headers: dict[str, str],
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    provider = TimingOutProvider()
+    monkeypatch.setattr(
+        assistant, "_async_llm_controller", AsyncLLMController(provider=provider)
+    )
+    monkeypatch.setattr(assistant, "completion_policy", make_policy(max_attempts=2))
+    retries = metrics.get("completion.retries")
+    timeouts = metrics.get("completion.timeouts")
+    response = client.post(
+        f"{settings.API_V1_STR}/chat",
+        headers=normal_user_token_headers,
+        json={"content": random_lower_string()},
+    )
+    assert response.status_code == 200
+    assert response.json()["content"] == StaticAnswers.unavailable
+    assert provider.calls == 2
+    assert metrics.get("completion.retries") == retries + 1
+    assert metrics.get("completion.timeouts") == timeouts + 2
+
+
+def test_open_circuit_fails_fast_without_provider_calls() -> None:
+    policy = make_policy(failure_threshold=2, max_attempts=2)
+    messages = [CnvMessage(role="user", content="Hello world!")]
+
+    async def run(stub: StubProviderServer) -> None:
+        client = openai.AsyncOpenAI(api_key="NoKey", base_url=stub.base_url)
+        llm = AsyncLLMController(provider=AsyncOpenAIProvider(client))
+        try:
+            for _ in range(2):
+                with pytest.raises(ProviderUnavailable):
+                    await llm.single_completion("System", messages)
+        finally:
+            await client.close()
+
+    with StubProviderServer(error_rate=1.0) as stub, pytest.MonkeyPatch.context() as m:
+        m.setattr(assistant, "completion_policy", policy)
+        asyncio.run(run(stub))
+        assert stub.requests == 2
+        assert state(policy.breaker) == "open"
+
+
+def test_stream_falls_back_while_provider_is_down(
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    policy = make_policy(failure_threshold=1)
+    policy.breaker.record_failure()
+    monkeypatch.setattr(assistant, "completion_policy", policy)
+    monkeypatch.setattr(settings, "AI_PROVIDER", "stub")
+    monkeypatch.setattr(assistant, "_async_llm_controller", None)
+    messages = [CnvMessage(role="user", content=random_lower_string())]
+    fallbacks = metrics.get("completion.fallbacks")
+
+    async def run() -> list[str]:
+        try:
+            return [
+                chunk
+                async for chunk in assistant.stream_answer_async(messages_list=messages)
+            ]
+        finally:
+            await clients.aclose_clients()
+
+    assert asyncio.run(run()) == [StaticAnswers.unavailable]
+    assert metrics.get("completion.fallbacks") == fallbacks + 1
+
+
+def test_chat_answers_503_without_fallback(
+    client: TestClient,
+    normal_user_token_headers: dict[str, str],
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    policy = make_policy(failure_threshold=1)
+    policy.breaker.record_failure()
+    monkeypatch.setattr(assistant, "completion_policy", policy)
+    monkeypatch.setattr("app.main.breaker", policy.breaker)
+    monkeypatch.setattr(settings, "AI_COMPLETION_FALLBACK", False)
+    response = client.post(
+        f"{settings.API_V1_STR}/chat",
+        headers=normal_user_token_headers,
+        json={"content": random_lower_string()},
+    )
+    assert response.status_code == 503
+    assert response.headers["Retry-After"] == "30"
@@ -0,0 +1,142 @@
+import asyncio
+
+import numpy as np
+import pytest
+
+from app.ai import assistant, clients
+from app.ai.assistant import AsyncLLMController, StaticAnswers, SystemPrompts
+from app.ai.semantic_cache import (
+    BruteForceIndex,
+    HashingEmbedder,
+    SemanticCache,
+    first_question,
+)
+from app.ai.stub_server import StubProviderServer
+from app.core.config import settings
+from app.models import CnvMessage
+
+
+def make_cache(threshold: float = 0.9) -> SemanticCache:
+    return SemanticCache(
+        embedder=HashingEmbedder(256),
+        index_factory=lambda: BruteForceIndex(256, 10),
+        threshold=threshold,
+    )
+
+
+def test_embedder_is_deterministic_and_normalized() -> None:
+    embedder = HashingEmbedder(256)
+    vector = embedder.embed("Explain list comprehension")
+    assert vector.shape == (256,)
+    assert np.isclose(np.linalg.norm(vector), 1.0)
+    assert np.array_equal(vector, embedder.embed("Explain list comprehension"))
+    assert not embedder.embed("").any()
+
+
+def test_embedder_scores_paraphrases_above_unrelated_questions() -> None:
+    embedder = HashingEmbedder()
+    question = embedder.embed("Explain list comprehension")
+    assert question @ embedder.embed("explain list comprehensions?") > 0.9
+    assert question @ embedder.embed("Explain dict comprehension") < 0.9
+    assert question @ embedder.embed("What is a Python decorator?") < 0.2
+
+
+def test_brute_force_index_replaces_oldest_entry() -> None:
+    embedder = HashingEmbedder(64)
+    index = BruteForceIndex(64, capacity=2)
+    assert index.search(embedder.embed("first")) is None
+    for text in ["first", "second", "third"]:
+        index.add(embedder.embed(text), text)
+    assert len(index) == 2
+    assert index.values == ["third", "second"]
+    score, value = index.search(embedder.embed("second")) or (0.0, "")
+    assert value == "second"
+    assert np.isclose(score, 1.0)
+
+
+def test_semantic_cache_threshold_and_scopes() -> None:
+    cache = make_cache()
+    cache.store("Explain list comprehension", "Lists", scope="assistant")
+    assert cache.lookup("explain list comprehensions", scope="assistant") == "Lists"
+    assert cache.lookup("Explain dict comprehension", scope="assistant") is None
+    assert cache.lookup("Explain list comprehension", scope="other") is None
+    assert make_cache(threshold=1.01).lookup("x", scope="assistant") is None
+
+
+def test_first_question() -> None:
+    question = CnvMessage(role="user", content="Question")
+    answer = CnvMessage(role="assistant", content="Answer")
+    assert first_question([question]) == "Question"
+    assert first_question([question, answer, question]) is None
+    assert first_question([answer]) is None
+    assert first_question([question], summary="Earlier turns") is None
+
+
+def test_semantic_cache_keeps_most_recently_used_scopes() -> None:
+    cache = make_cache()
+    cache.max_scopes = 2
+    cache.store("Explain list comprehension", "Lists", scope="first")
+    cache.store("Explain list comprehension", "Lists", scope="second")
+    cache.lookup("Explain list comprehension", scope="first")
+    cache.store("Explain list comprehension", "Lists", scope="third")
+    assert list(cache.indexes) == ["first", "third"]
+
+
+def test_trimmed_later_turn_is_not_a_first_turn(
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    # The long last message pushes the rest of the history out of the context
+    monkeypatch.setattr(settings, "AI_CONTEXT_MAX_TOKENS", 50)
+    cache = make_cache()
+    monkeypatch.setattr(assistant, "semantic_cache", cache)
+    question = "Explain list comprehension " * 20
+    cache.store(question, "Someone else's answer", scope=SystemPrompts.assistant)
+    messages = [
+        CnvMessage(role="user", content="Earlier question"),
+        CnvMessage(role="assistant", content="Earlier answer"),
+        CnvMessage(role="user", content=question),
+    ]
+
+    async def ask() -> str:
+        chunks = [
+            chunk
+            async for chunk in assistant.stream_answer_async(messages_list=messages)
+        ]
+        return "".join(chunks)
+
+    assert asyncio.run(ask()) != "Someone else's answer"
+
+
+async def collect(question: str) -> str:
+    messages = [CnvMessage(role="user", content=question)]
+    chunks = [
+        chunk async for chunk in assistant.stream_answer_async(messages_list=messages)
+    ]
+    return "".join(chunks)
+
+
+def test_stream_answer_serves_paraphrased_question_from_cache(
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    monkeypatch.setattr(assistant, "semantic_cache", make_cache())
+    with StubProviderServer(answer="Use brackets around a for loop") as stub:
+        llm = AsyncLLMController(
+            openai_client=clients.get_async_openai_client(stub.base_url)
+        )
+        monkeypatch.setattr(assistant, "get_async_llm_controller", lambda: llm)
+
+        async def ask() -> list[str]:
+            try:
+                return [
+                    await collect("Explain list comprehension"),
+                    await collect("explain list comprehensions?"),
+                    await collect("unsafe: explain list comprehension"),
+                ]
+            finally:
+                await clients.aclose_clients()
+
+        first, second, flagged = asyncio.run(ask())
+    assert first == second == "Use brackets around a for loop"
+    assert flagged == StaticAnswers.unsafe_mes
+    # Neither the repeat nor the flagged question reached the completion API
+    assert stub.requests == 2 + 1 + 1
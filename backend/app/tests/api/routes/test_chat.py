@@ -1,9 +1,28 @@
+import asyncio
+import json
+from collections.abc import AsyncIterator
+from dataclasses import replace
+from typing import Any
+
+import httpx
+import openai
+import pytest
 from fastapi.testclient import TestClient
+from sqlalchemy import event
 from sqlmodel import Session
 
+from app import jobs
+from app.ai import assistant
+from app.ai.assistant import AsyncLLMController, StaticAnswers
+from app.ai.providers import AsyncMockProvider, CompletionRequest
+from app.ai.resilience import CircuitBreaker, completion_policy
+from app.core import metrics
 from app.core.config import settings
-from app.models import User
+from app.core.db import async_engine, engine
+from app.core.user_cache import user_cache
+from app.models import CnvMessage, Conversation, User
 from app.tests.utils.conversation import create_random_conversation
+from app.tests.utils.utils import random_lower_string
 
 
 def test_post_initial_message(
@@ -21,6 +40,85 @@ def test_post_initial_message(
     assert "content" in content
 
 
+def test_post_initial_message_sets_summary(
+    client: TestClient, normal_user_token_headers: dict[str, str], db: Session
+) -> None:
+    data = {"content": "Hello world!"}
+    response = client.post(
+        f"{settings.API_V1_STR}/chat",
+        headers=normal_user_token_headers,
+        json=data,
+    )
+    assert response.status_code == 200
+    conversation = db.get(Conversation, response.json()["conversation_id"])
+    assert conversation
+    assert conversation.summary is None
+    assert asyncio.run(jobs.run_once()) >= 1
+    db.refresh(conversation)
+    assert conversation.summary == StaticAnswers.mock_summary
+
+
+def test_chat_turn_commits_question_and_answer_once_each(
+    client: TestClient, normal_user_token_headers: dict[str, str], db: Session
+) -> None:
+    statements: list[str] = []
+    commits: list[None] = []
+
+    def record(_conn: Any, _cursor: Any, statement: str, *_args: Any) -> None:
+        statements.append(statement)
+
+    def record_commit(_conn: Any) -> None:
+        commits.append(None)
+
+    sync_engine = async_engine.sync_engine
+    event.listen(sync_engine, "before_cursor_execute", record)
+    event.listen(sync_engine, "commit", record_commit)
+    try:
+        response = client.post(
+            f"{settings.API_V1_STR}/chat",
+            headers=normal_user_token_headers,
+            json={"content": random_lower_string()},
+        )
+    finally:
+        event.remove(sync_engine, "before_cursor_execute", record)
+        event.remove(sync_engine, "commit", record_commit)
+    assert response.status_code == 200
+    content = response.json()
+    assert len(commits) == 2
+    inserts = [statement for statement in statements if statement.startswith("INSERT")]
+    assert all("RETURNING" in statement for statement in inserts[:3])
+    # The context for the provider and the summary check; no refreshes
+    assert sum(statement.startswith("SELECT") for statement in statements) == 2
+    question = db.get(CnvMessage, content["question_id"])
+    answer = db.get(CnvMessage, content["answer_id"])
+    assert question and answer
+    assert question.conversation_id == answer.conversation_id
+    assert answer.conversation_id == content["conversation_id"]
+
+
+def test_chat_turn_moves_conversation_to_the_top(
+    client: TestClient,
+    normal_user_token_headers: dict[str, str],
+    db: Session,
+    current_user: User,
+) -> None:
+    older = create_random_conversation(db, current_user)
+    newer = create_random_conversation(db, current_user)
+    response = client.post(
+        f"{settings.API_V1_STR}/chat/{older.id}",
+        headers=normal_user_token_headers,
+        json={"content": random_lower_string()},
+    )
+    assert response.status_code == 200
+    response = client.get(
+        f"{settings.API_V1_STR}/conversations/", headers=normal_user_token_headers
+    )
+    assert response.status_code == 200
+    ids = [conversation["id"] for conversation in response.json()["data"]]
+    assert ids.index(older.id) < ids.index(newer.id)
+    assert ids[0] == older.id
+
+
 def test_post_unable_to_pass_different_role(
     client: TestClient, normal_user_token_headers: dict[str, str]
 ) -> None:
@@ -81,3 +179,182 @@ def test_post_second_message_not_allowed(
     assert response.status_code == 403
     content = response.json()
     assert content["detail"] == "You are not allowed to perform this action"
+
+
+def read_sse_events(body: str) -> list[tuple[str, dict[str, Any]]]:
+    events = []
+    for block in body.strip().split("\n\n"):
+        event, data = block.split("\n", 1)
+        events.append((event.removeprefix("event: "), json.loads(data[6:])))
+    return events
+
+
+def test_post_initial_message_stream(
+    client: TestClient, normal_user_token_headers: dict[str, str], db: Session
+) -> None:
+    data = {"content": "Hello world!"}
+    response = client.post(
+        f"{settings.API_V1_STR}/chat/stream",
+        headers=normal_user_token_headers,
+        json=data,
+    )
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/event-stream")
+    events = read_sse_events(response.text)
+    assert events[0][0] == "conversation"
+    assert events[-1][0] == "done"
+    tokens = [payload["content"] for event, payload in events if event == "token"]
+    assert len(tokens) > 1
+    done = events[-1][1]
+    assert done["conversation_id"] == events[0][1]["conversation_id"]
+    assert done["content"] == "".join(tokens)
+    answer = db.get(CnvMessage, done["answer_id"])
+    assert answer
+    assert answer.role == "assistant"
+    assert answer.content == done["content"]
+
+
+def test_post_second_message_stream(
+    client: TestClient,
+    normal_user_token_headers: dict[str, str],
+    db: Session,
+    current_user: User,
+) -> None:
+    conversation = create_random_conversation(db, current_user)
+    data = {"content": "Hello world!"}
+    response = client.post(
+        f"{settings.API_V1_STR}/chat/{conversation.id}/stream",
+        headers=normal_user_token_headers,
+        json=data,
+    )
+    assert response.status_code == 200
+    events = read_sse_events(response.text)
+    assert events[-1][0] == "done"
+    assert events[-1][1]["conversation_id"] == conversation.id
+
+
+class InterruptedStreamProvider(AsyncMockProvider):
+    """
+    Streams a few chunks, then loses the connection.
+    """
+
+    def __init__(self) -> None:
+        super().__init__("Partial answer that never ends")
+
+    async def stream(self, request: CompletionRequest) -> AsyncIterator[str]:
+        async for chunk in super().stream(replace(request, max_tokens=2)):
+            yield chunk
+        raise openai.APIConnectionError(
+            request=httpx.Request("POST", "http://provider/v1/chat/completions")
+        )
+
+
+def test_stream_ends_with_error_event_when_provider_fails_midway(
+    client: TestClient,
+    normal_user_token_headers: dict[str, str],
+    db: Session,
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    monkeypatch.setattr(
+        assistant,
+        "_async_llm_controller",
+        AsyncLLMController(provider=InterruptedStreamProvider()),
+    )
+    monkeypatch.setattr(
+        completion_policy,
+        "breaker",
+        CircuitBreaker(failure_threshold=5, reset_timeout=30),
+    )
+    failures = metrics.get("chat.stream_failures")
+    response = client.post(
+        f"{settings.API_V1_STR}/chat/stream",
+        headers=normal_user_token_headers,
+        json={"content": random_lower_string()},
+    )
+    assert response.status_code == 200
+    events = read_sse_events(response.text)
+    assert [event for event, _ in events] == ["conversation", "token", "token", "error"]
+    error = events[-1][1]
+    assert error["content"] == "Partial answer "
+    assert error["conversation_id"] == events[0][1]["conversation_id"]
+    assert metrics.get("chat.stream_failures") == failures + 1
+    answer = db.get(CnvMessage, error["answer_id"])
+    assert answer
+    assert answer.role == "assistant"
+    assert answer.content == "Partial answer "
+
+
+def test_post_second_message_stream_not_allowed(
+    client: TestClient, normal_user_token_headers: dict[str, str], db: Session
+) -> None:
+    conversation = create_random_conversation(db)
+    data = {"content": "Hello world!"}
+    response = client.post(
+        f"{settings.API_V1_STR}/chat/{conversation.id}/stream",
+        headers=normal_user_token_headers,
+        json=data,
+    )
+    assert response.status_code == 403
+
+
+class PoolRecordingProvider(AsyncMockProvider):
+    """
+    Records how many pooled connections are checked out during each call.
+    """
+
+    def __init__(self) -> None:
+        super().__init__("Pooled answer")
+        self.checked_out: list[tuple[int, int]] = []
+
+    def record(self) -> None:
+        self.checked_out.append(
+            (engine.pool.checkedout(), async_engine.pool.checkedout())  # type: ignore[attr-defined]
+        )
+
+    async def moderate(self, text: str) -> bool:
+        self.record()
+        return await super().moderate(text)
+
+    async def complete(self, request: CompletionRequest) -> str | None:
+        self.record()
+        return await super().complete(request)
+
+    async def stream(self, request: CompletionRequest) -> AsyncIterator[str]:
+        async for chunk in super().stream(request):
+            self.record()
+            yield chunk
+
+
+def test_no_connection_is_held_during_provider_calls(
+    client: TestClient,
+    normal_user_token_headers: dict[str, str],
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    provider = PoolRecordingProvider()
+    monkeypatch.setattr(
+        assistant, "_async_llm_controller", AsyncLLMController(provider=provider)
+    )
+    user_cache.clear()
+    baseline = (engine.pool.checkedout(), async_engine.pool.checkedout())  # type: ignore[attr-defined]
+    response = client.post(
+        f"{settings.API_V1_STR}/chat",
+        headers=normal_user_token_headers,
+        json={"content": random_lower_string()},
+    )
+    assert response.status_code == 200
+    user_cache.clear()
+    response = client.post(
+        f"{settings.API_V1_STR}/chat/{response.json()['conversation_id']}",
+        headers=normal_user_token_headers,
+        json={"content": random_lower_string()},
+    )
+    assert response.status_code == 200
+    assert response.json()["content"] == "Pooled answer"
+    user_cache.clear()
+    response = client.post(
+        f"{settings.API_V1_STR}/chat/{response.json()['conversation_id']}/stream",
+        headers=normal_user_token_headers,
+        json={"content": random_lower_string()},
+    )
+    assert response.status_code == 200
+    assert provider.checked_out == [baseline] * 7
@@ -1,9 +1,12 @@
+from datetime import datetime, timedelta
+
 from fastapi.testclient import TestClient
 from sqlmodel import Session
 
 from app.core.config import settings
-from app.models import User
+from app.models import Conversation, User, utcnow
 from app.tests.utils.conversation import (
+    create_random_conversation,
     create_random_conversation_with_random_messages,
 )
 
@@ -33,6 +36,11 @@ def test_read_conversation(
     assert "content" in message
     assert "conversation_id" not in message
     assert "owner_id" not in message
+    # Timestamps keep the naive UTC ISO format of the former string columns
+    created_at = datetime.fromisoformat(content["created_at"])
+    assert created_at.tzinfo is None
+    assert content["created_at"] == created_at.isoformat()
+    assert message["created_at"] <= content["messages"][1]["created_at"]
 
 
 def test_read_conversation_not_found(
@@ -116,3 +124,103 @@ def test_delete_conversation_not_enough_permissions(
     assert response.status_code == 403
     content = response.json()
     assert content["detail"] == "Not enough permissions"
+
+
+def test_read_conversation_last_messages(
+    client: TestClient,
+    normal_user_token_headers: dict[str, str],
+    db: Session,
+    current_user: User,
+) -> None:
+    conversation = create_random_conversation_with_random_messages(db, current_user)
+    response = client.get(
+        f"{settings.API_V1_STR}/conversations/{conversation.id}",
+        headers=normal_user_token_headers,
+        params={"limit": 1},
+    )
+    assert response.status_code == 200
+    messages = response.json()["messages"]
+    assert len(messages) == 1
+    assert messages[0]["content"] == "hello_from_assistant"
+
+
+def test_read_conversation_messages_after_cursor(
+    client: TestClient,
+    normal_user_token_headers: dict[str, str],
+    db: Session,
+    current_user: User,
+) -> None:
+    conversation = create_random_conversation_with_random_messages(db, current_user)
+    response = client.get(
+        f"{settings.API_V1_STR}/conversations/{conversation.id}",
+        headers=normal_user_token_headers,
+    )
+    first, second = response.json()["messages"]
+    assert first["content"] == "hello_from_user"
+    response = client.get(
+        f"{settings.API_V1_STR}/conversations/{conversation.id}",
+        headers=normal_user_token_headers,
+        params={"after_id": first["id"]},
+    )
+    assert response.status_code == 200
+    assert response.json()["messages"] == [second]
+
+
+def test_read_conversations_with_cursor(
+    client: TestClient,
+    normal_user_token_headers: dict[str, str],
+    db: Session,
+    current_user: User,
+) -> None:
+    created = {create_random_conversation(db, current_user).id for _ in range(3)}
+    keys: list[tuple[str, int]] = []
+    params: dict[str, str | int] = {"limit": 2}
+    while True:
+        response = client.get(
+            f"{settings.API_V1_STR}/conversations/",
+            headers=normal_user_token_headers,
+            params=params,
+        )
+        assert response.status_code == 200
+        content = response.json()
+        keys.extend((item["modified_at"], item["id"]) for item in content["data"])
+        if content["next_cursor"] is None:
+            break
+        params["cursor"] = content["next_cursor"]
+    assert keys == sorted(set(keys), reverse=True)
+    assert created <= {id for _, id in keys}
+
+
+def test_read_conversations_cursor_skips_conversation_modified_mid_walk(
+    client: TestClient,
+    normal_user_token_headers: dict[str, str],
+    db: Session,
+    current_user: User,
+) -> None:
+    url = f"{settings.API_V1_STR}/conversations/"
+    for _ in range(3):
+        create_random_conversation(db, current_user)
+    response = client.get(url, headers=normal_user_token_headers, params={"limit": 1})
+    content = response.json()
+    (first,) = content["data"]
+    response = client.get(url, headers=normal_user_token_headers, params={"limit": 100})
+    rest = [item["id"] for item in response.json()["data"][1:]]
+
+    # An answer lands on a conversation that is past the cursor
+    moved = db.get(Conversation, rest[-1])
+    assert moved is not None
+    moved.modified_at = utcnow() + timedelta(minutes=1)
+    db.add(moved)
+    db.commit()
+
+    response = client.get(
+        url,
+        headers=normal_user_token_headers,
+        params={"limit": 100, "cursor": content["next_cursor"]},
+    )
+    walked = [item["id"] for item in response.json()["data"]]
+    assert first["id"] not in walked
+    assert walked == rest[:-1]
+
+    response = client.get(url, headers=normal_user_token_headers, params={"limit": 1})
+    assert response.json()["data"][0]["id"] == moved.id
@@ -1,8 +1,18 @@
+from collections.abc import Iterator
+from contextlib import contextmanager
+from typing import Any
+
 from fastapi.testclient import TestClient
+from sqlalchemy import event
 from sqlmodel import Session
 
+from app import crud
 from app.core.config import settings
+from app.core.db import engine
+from app.models import UserCreate
 from app.tests.utils.item import create_random_item
+from app.tests.utils.user import user_authentication_headers
+from app.tests.utils.utils import random_email, random_lower_string
 
 
 def test_create_item(
@@ -77,6 +87,105 @@ def test_read_items(
     assert len(content["data"]) >= 2
 
 
+def test_read_items_with_cursor(
+    client: TestClient, superuser_token_headers: dict[str, str], db: Session
+) -> None:
+    created = {create_random_item(db).id for _ in range(3)}
+    ids: list[int] = []
+    params: dict[str, str | int] = {"limit": 2}
+    while True:
+        response = client.get(
+            f"{settings.API_V1_STR}/items/",
+            headers=superuser_token_headers,
+            params=params,
+        )
+        assert response.status_code == 200
+        content = response.json()
+        assert len(content["data"]) <= 2
+        if "cursor" in params:
+            assert content["count"] is None
+        else:
+            assert content["count"] >= 3
+        ids.extend(item["id"] for item in content["data"])
+        if content["next_cursor"] is None:
+            break
+        params["cursor"] = content["next_cursor"]
+    assert ids == sorted(set(ids))
+    assert created <= set(ids)
+
+
+@contextmanager
+def item_queries() -> Iterator[list[str]]:
+    statements: list[str] = []
+
+    def record(_conn: Any, _cursor: Any, statement: str, *_args: Any) -> None:
+        if "FROM item" in statement:
+            statements.append(statement)
+
+    event.listen(engine, "before_cursor_execute", record)
+    try:
+        yield statements
+    finally:
+        event.remove(engine, "before_cursor_execute", record)
+
+
+def test_read_items_counts_short_first_page_without_count_query(
+    client: TestClient, db: Session
+) -> None:
+    email, password = random_email(), random_lower_string()
+    crud.create_user(session=db, user_create=UserCreate(email=email, password=password))
+    headers = user_authentication_headers(client=client, email=email, password=password)
+    for _ in range(3):
+        response = client.post(
+            f"{settings.API_V1_STR}/items/",
+            headers=headers,
+            json={"title": random_lower_string()},
+        )
+        assert response.status_code == 200
+
+    def read(**params: Any) -> Any:
+        response = client.get(
+            f"{settings.API_V1_STR}/items/", headers=headers, params=params
+        )
+        assert response.status_code == 200
+        return response.json()
+
+    with item_queries() as statements:
+        page = read(limit=10)
+    assert page["count"] == 3
+    assert len(statements) == 1
+    assert "count(" not in statements[0]
+
+    item_id = page["data"][0]["id"]
+    client.delete(f"{settings.API_V1_STR}/items/{item_id}", headers=headers)
+    with item_queries() as statements:
+        page = read(limit=1)
+    assert page["count"] == 2
+    assert len(statements) == 2
+    assert all("OVER" not in statement for statement in statements)
+
+    client.post(
+        f"{settings.API_V1_STR}/items/",
+        headers=headers,
+        json={"title": random_lower_string()},
+    )
+    assert read(skip=5, with_count=True)["count"] == 3
+    cursor = read(limit=1, with_count=False)["next_cursor"]
+    assert read(cursor=cursor, with_count=True)["count"] == 3
+
+
+def test_read_items_invalid_cursor(
+    client: TestClient, superuser_token_headers: dict[str, str]
+) -> None:
+    response = client.get(
+        f"{settings.API_V1_STR}/items/",
+        headers=superuser_token_headers,
+        params={"cursor": "not-a-cursor"},
+    )
+    assert response.status_code == 400
+    assert response.json()["detail"] == "Invalid cursor"
+
+
 def test_update_item(
     client: TestClient, superuser_token_headers: dict[str, str], db: Session
 ) -> None:
@@ -102,3 +102,22 @@ def test_reset_password_invalid_token(
     assert "detail" in response
     assert r.status_code == 400
     assert response["detail"] == "Invalid token"
+
+
+def test_known_token_skips_decode_and_user_lookup(
+    client: TestClient, normal_user_token_headers: dict[str, str]
+) -> None:
+    client.post(
+        f"{settings.API_V1_STR}/login/test-token", headers=normal_user_token_headers
+    )
+    with patch("app.api.deps.jwt.decode") as decode, patch(
+        "app.api.deps.Session.get"
+    ) as get:
+        r = client.post(
+            f"{settings.API_V1_STR}/login/test-token",
+            headers=normal_user_token_headers,
+        )
+    assert r.status_code == 200
+    assert r.json()["email"] == settings.EMAIL_TEST_USER
+    decode.assert_not_called()
+    get.assert_not_called()
@@ -7,6 +7,7 @@ from app import crud
 from app.core.config import settings
 from app.core.security import verify_password
 from app.models import User, UserCreate
+from app.tests.utils.user import user_authentication_headers
 from app.tests.utils.utils import random_email, random_lower_string
 
 
@@ -167,6 +168,34 @@ def test_retrieve_users(
         assert "email" in item
 
 
+def test_retrieve_users_with_cursor(
+    client: TestClient, superuser_token_headers: dict[str, str], db: Session
+) -> None:
+    for _ in range(2):
+        user_in = UserCreate(email=random_email(), password=random_lower_string())
+        crud.create_user(session=db, user_create=user_in)
+
+    r = client.get(
+        f"{settings.API_V1_STR}/users/",
+        headers=superuser_token_headers,
+        params={"limit": 1, "with_count": False},
+    )
+    first_page = r.json()
+    assert len(first_page["data"]) == 1
+    assert first_page["count"] is None
+    assert first_page["next_cursor"]
+
+    r = client.get(
+        f"{settings.API_V1_STR}/users/",
+        headers=superuser_token_headers,
+        params={"limit": 1, "cursor": first_page["next_cursor"], "with_count": True},
+    )
+    second_page = r.json()
+    assert len(second_page["data"]) == 1
+    assert second_page["data"][0]["id"] > first_page["data"][0]["id"]
+    assert second_page["count"] > 2
+
+
 def test_update_user_me(
     client: TestClient, normal_user_token_headers: dict[str, str], db: Session
 ) -> None:
@@ -366,6 +395,31 @@ def test_update_user(
     assert user_db.full_name == "Updated_full_name"
 
 
+def test_create_and_update_user_hash_off_the_request_thread(
+    client: TestClient, superuser_token_headers: dict[str, str], db: Session
+) -> None:
+    username = random_email()
+    password = random_lower_string()
+    with patch("app.crud.get_password_hash", side_effect=AssertionError):
+        r = client.post(
+            f"{settings.API_V1_STR}/users/",
+            headers=superuser_token_headers,
+            json={"email": username, "password": password},
+        )
+        assert r.status_code == 200
+        new_password = random_lower_string()
+        r = client.patch(
+            f"{settings.API_V1_STR}/users/{r.json()['id']}",
+            headers=superuser_token_headers,
+            json={"password": new_password},
+        )
+        assert r.status_code == 200
+    user = crud.get_user_by_email(session=db, email=username)
+    assert user
+    db.refresh(user)
+    assert verify_password(new_password, user.hashed_password)
+
+
 def test_update_user_not_exists(
     client: TestClient, superuser_token_headers: dict[str, str]
 ) -> None:
@@ -492,3 +546,27 @@ def test_delete_user_without_privileges(
     )
     assert r.status_code == 403
     assert r.json()["detail"] == "The user doesn't have enough privileges"
+
+
+def test_deactivated_user_is_rejected_right_away(
+    client: TestClient, superuser_token_headers: dict[str, str], db: Session
+) -> None:
+    username = random_email()
+    password = random_lower_string()
+    user = crud.create_user(
+        session=db, user_create=UserCreate(email=username, password=password)
+    )
+    headers = user_authentication_headers(
+        client=client, email=username, password=password
+    )
+    r = client.get(f"{settings.API_V1_STR}/users/me", headers=headers)
+    assert r.status_code == 200
+
+    r = client.patch(
+        f"{settings.API_V1_STR}/users/{user.id}",
+        headers=superuser_token_headers,
+        json={"is_active": False},
+    )
+    assert r.status_code == 200
+    r = client.get(f"{settings.API_V1_STR}/users/me", headers=headers)
+    assert r.status_code == 400
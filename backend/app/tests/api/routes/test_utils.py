@@ -0,0 +1,24 @@
+from fastapi.testclient import TestClient
+
+from app.core import metrics
+from app.core.config import settings
+
+
+def test_read_metrics(
+    client: TestClient, superuser_token_headers: dict[str, str]
+) -> None:
+    metrics.increment("test.counter")
+    response = client.get(
+        f"{settings.API_V1_STR}/utils/metrics/", headers=superuser_token_headers
+    )
+    assert response.status_code == 200
+    assert response.json()["test.counter"] >= 1
+
+
+def test_read_metrics_normal_user(
+    client: TestClient, normal_user_token_headers: dict[str, str]
+) -> None:
+    response = client.get(
+        f"{settings.API_V1_STR}/utils/metrics/", headers=normal_user_token_headers
+    )
+    assert response.status_code == 400
@@ -0,0 +1,22 @@
+from datetime import timedelta
+
+from sqlmodel import Session
+
+from app.api.deps import get_current_user
+from app.core.db import engine
+from app.core.security import create_access_token
+from app.core.user_cache import user_cache
+from app.tests.utils.user import create_random_user
+
+
+def test_current_user_lookup_gives_its_connection_back(db: Session) -> None:
+    user = create_random_user(db)
+    token = create_access_token(user.id, timedelta(minutes=5))
+    user_cache.invalidate(user.id)
+    checked_out = engine.pool.checkedout()  # type: ignore[attr-defined]
+
+    current = get_current_user(token)
+
+    assert current.id == user.id
+    assert current.email == user.email
+    assert engine.pool.checkedout() == checked_out  # type: ignore[attr-defined]
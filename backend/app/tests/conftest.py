@@ -8,7 +8,17 @@ from app import crud
 from app.core.config import settings
 from app.core.db import engine, init_db
 from app.main import app
-from app.models import CnvMessage, Conversation, Item, User
+from app.models import (
+    CachedCompletion,
+    CnvMessage,
+    Conversation,
+    Item,
+    Job,
+    ModerationVerdict,
+    RateLimitBucket,
+    RateLimitLease,
+    User,
+)
 from app.tests.utils.user import authentication_token_from_email
 from app.tests.utils.utils import get_superuser_token_headers
 
@@ -26,6 +36,16 @@ def db() -> Generator[Session, None, None]:
         session.execute(statement)
         statement = delete(User)
         session.execute(statement)
+        statement = delete(ModerationVerdict)
+        session.execute(statement)
+        statement = delete(Job)
+        session.execute(statement)
+        statement = delete(CachedCompletion)
+        session.execute(statement)
+        statement = delete(RateLimitBucket)
+        session.execute(statement)
+        statement = delete(RateLimitLease)
+        session.execute(statement)
         session.commit()
 
 
@@ -0,0 +1,39 @@
+from app.core.cache import TTLCache
+
+
+class FakeTimer:
+    def __init__(self) -> None:
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def test_ttl_cache_evicts_least_recently_used() -> None:
+    cache: TTLCache[str, int] = TTLCache(maxsize=2, ttl=60)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    assert cache.get("a") == 1
+    cache.set("c", 3)
+    assert cache.get("b") is None
+    assert cache.get("a") == 1
+    assert cache.get("c") == 3
+    assert len(cache) == 2
+
+
+def test_ttl_cache_expires_entries() -> None:
+    timer = FakeTimer()
+    cache: TTLCache[str, int] = TTLCache(maxsize=10, ttl=60, timer=timer)
+    cache.set("a", 1)
+    cache.set("b", 2, ttl=10)
+    timer.now = 30
+    assert cache.get("a") == 1
+    assert cache.get("b") is None
+    timer.now = 61
+    assert cache.get("a") is None
+
+
+def test_ttl_cache_disabled_with_zero_size() -> None:
+    cache: TTLCache[str, int] = TTLCache(maxsize=0, ttl=60)
+    cache.set("a", 1)
+    assert cache.get("a") is None
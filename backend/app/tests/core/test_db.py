@@ -0,0 +1,60 @@
+import asyncio
+
+import pytest
+from sqlalchemy import text
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from sqlmodel import create_engine
+
+from app.core import metrics
+from app.core.config import settings
+from app.core.db import MeteredQueuePool, async_engine, engine, engine_options
+
+
+def test_connections_carry_server_settings() -> None:
+    with engine.connect() as connection:
+        rows = connection.execute(
+            text(
+                "SELECT name, setting FROM pg_settings WHERE name IN "
+                "('statement_timeout', 'idle_in_transaction_session_timeout', "
+                "'application_name')"
+            )
+        )
+        server_settings = {row.name: row.setting for row in rows}
+    assert server_settings == {
+        "statement_timeout": str(settings.POSTGRES_STATEMENT_TIMEOUT_MS),
+        "idle_in_transaction_session_timeout": str(
+            settings.POSTGRES_IDLE_IN_TRANSACTION_TIMEOUT_MS
+        ),
+        "application_name": settings.POSTGRES_APPLICATION_NAME,
+    }
+
+    async def async_application_name() -> str | None:
+        async with async_engine.connect() as connection:
+            name: str | None = await connection.scalar(text("SHOW application_name"))
+            return name
+
+    assert asyncio.run(async_application_name()) == settings.POSTGRES_APPLICATION_NAME
+
+
+def test_pool_counts_checkouts_waits_and_timeouts() -> None:
+    options = engine_options() | {
+        "pool_size": 1,
+        "max_overflow": 0,
+        "pool_timeout": 0.1,
+    }
+    small_engine = create_engine(
+        str(settings.SQLALCHEMY_DATABASE_URI), poolclass=MeteredQueuePool, **options
+    )
+    checkouts = metrics.get("db.pool.checkouts")
+    timeouts = metrics.get("db.pool.checkout_timeouts")
+    waited = metrics.get("db.pool.checkout_wait_seconds")
+    try:
+        with small_engine.connect():
+            assert metrics.get("db.pool.checked_out") == 1
+            with pytest.raises(PoolTimeoutError):
+                small_engine.connect()
+    finally:
+        small_engine.dispose()
+    assert metrics.get("db.pool.checkouts") == checkouts + 1
+    assert metrics.get("db.pool.checkout_timeouts") == timeouts + 1
+    assert metrics.get("db.pool.checkout_wait_seconds") > waited
@@ -0,0 +1,200 @@
+from collections.abc import Iterator
+
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import Engine, make_url, text
+from sqlmodel import create_engine
+
+from app.core import metrics
+from app.core.config import parse_replica_uris, settings
+from app.core.db import MeteredReplicaQueuePool, engine, engine_options
+from app.core.replicas import WRITE_COOKIE, ReplicaRouter, writer_key
+from app.tests.utils.utils import random_lower_string
+
+
+def test_parse_replica_uris() -> None:
+    assert parse_replica_uris("postgresql://r1/app, postgresql://r2/app") == [
+        "postgresql://r1/app",
+        "postgresql://r2/app",
+    ]
+    assert parse_replica_uris('["postgresql://r1,r2/app"]') == [
+        "postgresql://r1,r2/app"
+    ]
+    assert parse_replica_uris("") == []
+    with pytest.raises(ValueError):
+        parse_replica_uris(5)
+
+
+class FakeClock:
+    def __init__(self) -> None:
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def replica_engine(application_name: str, port: int | None = None) -> Engine:
+    """
+    The test database under another name, standing in for a replica.
+    """
+    url = make_url(str(settings.SQLALCHEMY_DATABASE_URI))
+    if port is not None:
+        url = url.set(port=port)
+    options = engine_options()
+    options["connect_args"] = options["connect_args"] | {
+        "application_name": application_name,
+        "connect_timeout": 1,
+    }
+    return create_engine(url, poolclass=MeteredReplicaQueuePool, **options)
+
+
+@pytest.fixture
+def replica() -> Iterator[Engine]:
+    replica = replica_engine("replica")
+    yield replica
+    replica.dispose()
+
+
+def application_name(
+    router: ReplicaRouter, writer: str | None = None, last_write: float | None = None
+) -> str:
+    with router.connect(writer, last_write) as connection:
+        name = connection.scalar(text("SHOW application_name"))
+        assert isinstance(name, str)
+        return name
+
+
+def test_router_sends_recent_writers_to_the_primary(replica: Engine) -> None:
+    clock = FakeClock()
+    router = ReplicaRouter(
+        engine, [replica], read_your_writes=5, retry_after=30, clock=clock
+    )
+    writer = writer_key("Bearer token")
+    reads = metrics.get("db.replica.reads")
+    assert application_name(router, writer) == "replica"
+    assert metrics.get("db.replica.reads") == reads + 1
+
+    router.note_write(writer)
+    assert application_name(router, writer) == settings.POSTGRES_APPLICATION_NAME
+    assert application_name(router, writer_key("Bearer other")) == "replica"
+
+    clock.now = 5
+    assert application_name(router, writer) == "replica"
+
+
+def test_router_sends_clients_with_a_recent_write_time_to_the_primary(
+    replica: Engine,
+) -> None:
+    wall_clock = FakeClock()
+    wall_clock.now = 1000.0
+    router = ReplicaRouter(
+        engine, [replica], read_your_writes=5, retry_after=30, wall_clock=wall_clock
+    )
+    assert application_name(router, last_write=None) == "replica"
+    assert (
+        application_name(router, last_write=998.0) == settings.POSTGRES_APPLICATION_NAME
+    )
+    assert application_name(router, last_write=995.0) == "replica"
+
+
+def test_router_takes_replicas_in_turn() -> None:
+    first, second = replica_engine("first"), replica_engine("second")
+    router = ReplicaRouter(engine, [first, second], read_your_writes=5, retry_after=30)
+    assert router.candidates() == [first, second]
+    assert router.candidates() == [second, first]
+    assert router.candidates() == [first, second]
+    assert (
+        ReplicaRouter(engine, [], read_your_writes=5, retry_after=30).candidates() == []
+    )
+
+
+def test_router_fails_over_from_unreachable_replica(replica: Engine) -> None:
+    clock = FakeClock()
+    broken = replica_engine("broken", port=1)
+    router = ReplicaRouter(
+        engine, [broken, replica], read_your_writes=5, retry_after=30, clock=clock
+    )
+    failovers = metrics.get("db.replica.failovers")
+    try:
+        assert application_name(router) == "replica"
+        assert metrics.get("db.replica.failovers") == failovers + 1
+        assert router.candidates() == [replica]
+        assert router.candidates() == [replica]
+
+        clock.now = 30
+        assert broken in router.candidates()
+    finally:
+        broken.dispose()
+
+    alone = ReplicaRouter(engine, [broken], read_your_writes=5, retry_after=30)
+    primary_reads = metrics.get("db.replica.primary_reads")
+    assert application_name(alone) == settings.POSTGRES_APPLICATION_NAME
+    assert metrics.get("db.replica.primary_reads") == primary_reads + 1
+    broken.dispose()
+
+
+def test_reads_after_a_write_go_to_the_primary(
+    client: TestClient,
+    normal_user_token_headers: dict[str, str],
+    replica: Engine,
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    router = ReplicaRouter(engine, [replica], read_your_writes=5, retry_after=30)
+    monkeypatch.setattr("app.api.deps.replica_router", router)
+    monkeypatch.setattr("app.core.replicas.replica_router", router)
+    reads = metrics.get("db.replica.reads")
+    response = client.get(
+        f"{settings.API_V1_STR}/items/", headers=normal_user_token_headers
+    )
+    assert response.status_code == 200
+    assert metrics.get("db.replica.reads") == reads + 1
+
+    response = client.post(
+        f"{settings.API_V1_STR}/items/",
+        headers=normal_user_token_headers,
+        json={"title": random_lower_string()},
+    )
+    assert response.status_code == 200
+    title = response.json()["title"]
+    primary_reads = metrics.get("db.replica.primary_reads")
+    response = client.get(
+        f"{settings.API_V1_STR}/items/", headers=normal_user_token_headers
+    )
+    assert metrics.get("db.replica.primary_reads") == primary_reads + 1
+    assert metrics.get("db.replica.reads") == reads + 1
+    assert title in [item["title"] for item in response.json()["data"]]
+
+
+def test_write_cookie_carries_reads_to_the_primary_across_workers(
+    client: TestClient,
+    normal_user_token_headers: dict[str, str],
+    replica: Engine,
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    router = ReplicaRouter(engine, [replica], read_your_writes=5, retry_after=30)
+    monkeypatch.setattr("app.api.deps.replica_router", router)
+    monkeypatch.setattr("app.core.replicas.replica_router", router)
+    client.cookies.clear()
+    response = client.post(
+        f"{settings.API_V1_STR}/items/",
+        headers=normal_user_token_headers,
+        json={"title": random_lower_string()},
+    )
+    assert response.status_code == 200
+    assert WRITE_COOKIE in response.cookies
+    # Another worker has no marker of its own for this client
+    router.recent_writers.clear()
+    primary_reads = metrics.get("db.replica.primary_reads")
+    response = client.get(
+        f"{settings.API_V1_STR}/items/", headers=normal_user_token_headers
+    )
+    assert response.status_code == 200
+    assert metrics.get("db.replica.primary_reads") == primary_reads + 1
+
+    client.cookies.clear()
+    reads = metrics.get("db.replica.reads")
+    response = client.get(
+        f"{settings.API_V1_STR}/items/", headers=normal_user_token_headers
+    )
+    assert response.status_code == 200
+    assert metrics.get("db.replica.reads") == reads + 1
@@ -0,0 +1,54 @@
+import asyncio
+import threading
+
+import pytest
+from fastapi.testclient import TestClient
+
+from app.core import metrics, security
+from app.core.config import settings
+from app.core.security import PasswordHasher, PasswordHasherBusy
+
+
+def test_password_hash_round_trip() -> None:
+    hashed = security.get_password_hash("secret")
+    assert security.verify_password("secret", hashed)
+    assert not asyncio.run(security.verify_password_async("wrong", hashed))
+
+
+def test_hasher_refuses_calls_past_the_queue_limit() -> None:
+    hasher = PasswordHasher(workers=1, max_queue=1)
+    release = threading.Event()
+    rejected = metrics.get("password_hash.rejected")
+    running = hasher.submit(release.wait)
+    queued = hasher.submit(release.wait)
+    assert metrics.get("password_hash.queue_depth") == 1
+    with pytest.raises(PasswordHasherBusy) as excinfo:
+        hasher.submit(release.wait)
+    assert excinfo.value.retry_after > 0
+    assert metrics.get("password_hash.rejected") == rejected + 1
+
+    release.set()
+    assert running.result() and queued.result()
+    assert hasher.run(sum, [1, 2]) == 3
+    assert hasher.pending == 0
+
+
+def test_login_answers_503_when_hashing_is_saturated(
+    client: TestClient, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    hasher = PasswordHasher(workers=1, max_queue=0)
+    monkeypatch.setattr(security, "password_hasher", hasher)
+    release = threading.Event()
+    hasher.submit(release.wait)
+    try:
+        r = client.post(
+            f"{settings.API_V1_STR}/login/access-token",
+            data={
+                "username": settings.FIRST_SUPERUSER,
+                "password": settings.FIRST_SUPERUSER_PASSWORD,
+            },
+        )
+    finally:
+        release.set()
+    assert r.status_code == 503
+    assert int(r.headers["Retry-After"]) >= 1
@@ -0,0 +1,38 @@
+import time
+
+from app.core import metrics
+from app.core.user_cache import UserCache
+from app.models import User
+
+
+def test_token_is_cached_until_it_expires() -> None:
+    cache = UserCache(maxsize=10, ttl=60)
+    cache.set_user_id("token", 1, time.time() + 60)
+    cache.set_user_id("expired", 2, time.time() - 1)
+    assert cache.get_user_id("token") == 1
+    assert cache.get_user_id("expired") is None
+
+
+def test_user_snapshot_is_a_copy_until_invalidated() -> None:
+    cache = UserCache(maxsize=10, ttl=60)
+    user = User(id=1, email="user@example.com", hashed_password="hash")
+    cache.set_user(user)
+    hits = metrics.get("user_cache.hits")
+
+    cached = cache.get_user(1)
+    assert cached is not None and cached is not user
+    assert cached.email == "user@example.com"
+    cached.email = "changed@example.com"
+    assert cache.get_user(1) == user
+    assert metrics.get("user_cache.hits") == hits + 2
+
+    cache.invalidate(1)
+    assert cache.get_user(1) is None
+
+
+def test_disabled_cache_keeps_nothing() -> None:
+    cache = UserCache(maxsize=0, ttl=60)
+    cache.set_user_id("token", 1, time.time() + 60)
+    cache.set_user(User(id=1, email="user@example.com", hashed_password="hash"))
+    assert cache.get_user_id("token") is None
+    assert cache.get_user(1) is None
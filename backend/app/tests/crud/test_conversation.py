@@ -0,0 +1,75 @@
+import asyncio
+
+from sqlmodel import Session
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from app import crud
+from app.core.db import async_engine
+from app.models import (
+    CnvMessageAssistantCreate,
+    CnvMessageUserCreate,
+    Conversation,
+    User,
+)
+from app.tests.utils.conversation import create_random_conversation
+
+
+def create_numbered_messages(db: Session, user: User, count: int) -> int:
+    conversation = create_random_conversation(db, user)
+    assert conversation.id is not None
+    assert user.id is not None
+    for i in range(count):
+        crud.create_cnvmessage(
+            session=db,
+            cnv_in=CnvMessageUserCreate(content=f"message {i}"),
+            owner_id=user.id,
+            conv_id=conversation.id,
+        )
+    return conversation.id
+
+
+def test_get_last_cnvmessages(db: Session, current_user: User) -> None:
+    conv_id = create_numbered_messages(db, current_user, 5)
+    messages = crud.get_last_cnvmessages(session=db, conv_id=conv_id, limit=3)
+    assert [m.content for m in messages] == ["message 2", "message 3", "message 4"]
+
+
+def test_get_cnvmessages_after(db: Session, current_user: User) -> None:
+    conv_id = create_numbered_messages(db, current_user, 5)
+    all_messages = crud.get_cnvmessages(session=db, conv_id=conv_id)
+    assert [m.content for m in all_messages] == [f"message {i}" for i in range(5)]
+    cursor = all_messages[1].id
+    assert cursor is not None
+    messages = crud.get_cnvmessages_after(
+        session=db, conv_id=conv_id, after_id=cursor, limit=2
+    )
+    assert [m.content for m in messages] == ["message 2", "message 3"]
+
+
+def test_unit_of_work_moves_modified_at_of_answered_conversation(
+    db: Session, current_user: User
+) -> None:
+    conv_id = create_numbered_messages(db, current_user, 1)
+    assert current_user.id is not None
+    owner_id = current_user.id
+
+    async def answer() -> Conversation:
+        async with AsyncSession(async_engine, expire_on_commit=False) as session:
+            unit = crud.UnitOfWork(session)
+            conversation = await session.get(Conversation, conv_id)
+            assert conversation is not None
+            before = conversation.modified_at
+            unit.add_cnvmessage(
+                CnvMessageAssistantCreate(content="answer"),
+                owner_id=owner_id,
+                conversation=conversation,
+            )
+            await unit.commit()
+            assert conversation.modified_at > before
+            assert conversation not in session.dirty
+            return conversation
+
+    answered = asyncio.run(answer())
+    stored = db.get(Conversation, conv_id, populate_existing=True)
+    assert stored is not None
+    assert stored.modified_at == answered.modified_at
@@ -0,0 +1,64 @@
+from datetime import datetime, timezone
+from typing import Any
+
+import pytest
+from sqlalchemy import text
+from sqlmodel import Session, col, func, select, tuple_
+
+from app import crud
+from app.core.db import engine
+from app.models import CnvMessage, Conversation, Item, User
+
+STATEMENTS = {
+    "read_conversations": select(Conversation)
+    .where(Conversation.owner_id == 1)
+    .order_by(col(Conversation.modified_at).desc(), col(Conversation.id).desc())
+    .limit(101),
+    "read_conversations_after_cursor": select(Conversation)
+    .where(Conversation.owner_id == 1)
+    .where(
+        tuple_(col(Conversation.modified_at), col(Conversation.id))
+        < (datetime(2024, 1, 1, tzinfo=timezone.utc), 1)
+    )
+    .order_by(col(Conversation.modified_at).desc(), col(Conversation.id).desc())
+    .limit(101),
+    "count_conversations": select(func.count())
+    .select_from(Conversation)
+    .where(Conversation.owner_id == 1),
+    "read_items_after_cursor": select(Item)
+    .where(Item.owner_id == 1)
+    .where(col(Item.id) > 1)
+    .order_by(col(Item.id))
+    .limit(101),
+    "read_users_after_cursor": select(User)
+    .where(col(User.id) > 1)
+    .order_by(col(User.id))
+    .limit(101),
+    "count_items": select(func.count()).select_from(Item).where(Item.owner_id == 1),
+    "last_messages": crud.cnvmessages_statement(1)
+    .order_by(col(CnvMessage.created_at).desc(), col(CnvMessage.id).desc())
+    .limit(50),
+    "messages_after": crud.cnvmessages_statement(1)
+    .where(col(CnvMessage.id) > 1)
+    .order_by(col(CnvMessage.created_at), col(CnvMessage.id)),
+    "messages_by_owner": select(CnvMessage).where(CnvMessage.owner_id == 1),
+    "user_by_email": select(User).where(User.email == "test@example.com"),
+}
+
+
+def explain(statement: Any) -> str:
+    with Session(engine) as session:
+        sql = statement.compile(
+            dialect=engine.dialect, compile_kwargs={"literal_binds": True}
+        )
+        # Tables are tiny in tests, so make the planner pick an index if any fits
+        session.execute(text("SET LOCAL enable_seqscan = off"))
+        plan = session.execute(text(f"EXPLAIN {sql}")).scalars().all()
+        session.rollback()
+    return "\n".join(plan)
+
+
+@pytest.mark.parametrize("name", STATEMENTS)
+def test_query_uses_index(name: str) -> None:
+    plan = explain(STATEMENTS[name])
+    assert "Seq Scan" not in plan, plan
@@ -0,0 +1,206 @@
+import asyncio
+from collections.abc import Generator
+from datetime import timedelta
+from typing import Any
+
+import pytest
+from sqlmodel import Session, delete, select
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from app import crud, jobs
+from app.core.db import async_engine, engine
+from app.models import Job, utcnow
+
+FAILING = "test_failing"
+
+
+@jobs.job_handler(FAILING)
+async def fail(payload: dict[str, Any]) -> None:  # noqa: ARG001
+    raise RuntimeError("boom")
+
+
+@pytest.fixture(autouse=True)
+def empty_queue(db: Session) -> Generator[None, None, None]:
+    db.execute(delete(Job))
+    db.commit()
+    yield
+    db.execute(delete(Job))
+    db.commit()
+
+
+def enqueue(kind: str = "test_noop", max_attempts: int = 3) -> None:
+    async def run() -> None:
+        async with AsyncSession(async_engine) as session:
+            await crud.enqueue_job_async(
+                session=session,
+                kind=kind,
+                payload={},
+                max_attempts=max_attempts,
+                dedup_key=f"{kind}:1",
+            )
+
+    asyncio.run(run())
+
+
+def claim(limit: int = 10) -> list[Job]:
+    return asyncio.run(jobs.claim_jobs(limit))
+
+
+def complete(job: Job, retention: timedelta = timedelta(days=1)) -> bool:
+    async def run() -> bool:
+        async with AsyncSession(async_engine) as session:
+            return await crud.complete_job_async(
+                session=session, job=job, retention=retention
+            )
+
+    return asyncio.run(run())
+
+
+def all_jobs(db: Session) -> list[Job]:
+    db.expire_all()
+    return list(db.exec(select(Job)).all())
+
+
+def test_enqueue_deduplicates_queued_jobs(db: Session) -> None:
+    enqueue()
+    enqueue()
+    assert len(all_jobs(db)) == 1
+
+
+def test_enqueue_survives_prepared_statements(db: Session) -> None:
+    # psycopg prepares a statement after a few runs on one connection; the
+    # ON CONFLICT target must still match the partial index then
+    async def run() -> None:
+        async with AsyncSession(async_engine) as session:
+            for i in range(20):
+                await crud.enqueue_job_async(
+                    session=session,
+                    kind="test_noop",
+                    payload={},
+                    max_attempts=3,
+                    dedup_key=f"test_noop:{i % 2}",
+                )
+
+    asyncio.run(run())
+    assert len(all_jobs(db)) == 2
+
+
+def test_enqueue_while_running_queues_a_rerun(db: Session) -> None:
+    enqueue()
+    (job,) = claim()
+    assert job.status == "running"
+    assert job.attempts == 1
+    enqueue()
+    (stored,) = all_jobs(db)
+    assert stored.rerun
+
+    complete(job)
+    (stored,) = all_jobs(db)
+    assert stored.status == "queued"
+    assert stored.attempts == 0
+    (job,) = claim()
+    complete(job)
+    (stored,) = all_jobs(db)
+    assert stored.status == "done"
+
+
+def test_claim_skips_locked_jobs() -> None:
+    enqueue()
+    with Session(engine) as other:
+        other.exec(select(Job).with_for_update()).one()
+        assert claim() == []
+    assert len(claim()) == 1
+
+
+def test_failed_job_is_retried_with_backoff(db: Session) -> None:
+    enqueue(kind=FAILING, max_attempts=2)
+    assert asyncio.run(jobs.run_once()) == 1
+    (stored,) = all_jobs(db)
+    assert stored.status == "queued"
+    assert stored.run_at > utcnow()
+    assert stored.last_error and "boom" in stored.last_error
+
+    stored.run_at = utcnow() - timedelta(seconds=1)
+    db.add(stored)
+    db.commit()
+    assert asyncio.run(jobs.run_once()) == 1
+    (stored,) = all_jobs(db)
+    assert stored.status == "failed"
+    assert stored.attempts == 2
+
+
+def test_expired_lease_is_claimed_again(db: Session) -> None:
+    enqueue()
+    (job,) = claim()
+    assert claim() == []
+    (stored,) = all_jobs(db)
+    stored.locked_until = utcnow() - timedelta(seconds=1)
+    db.add(stored)
+    db.commit()
+    (job,) = claim()
+    assert job.attempts == 2
+
+
+def test_outcome_of_a_lost_claim_is_dropped(db: Session) -> None:
+    enqueue()
+    (stale,) = claim()
+    (stored,) = all_jobs(db)
+    stored.locked_until = utcnow() - timedelta(seconds=1)
+    db.add(stored)
+    db.commit()
+    (current,) = claim()
+    assert current.locked_by != stale.locked_by
+
+    assert not complete(stale)
+    (stored,) = all_jobs(db)
+    assert stored.status == "running"
+    assert stored.locked_by == current.locked_by
+
+    async def fail_stale() -> bool:
+        async with AsyncSession(async_engine) as session:
+            return await crud.fail_job_async(
+                session=session, job=stale, error="late", retry_at=None
+            )
+
+    assert not asyncio.run(fail_stale())
+    assert complete(current)
+    (stored,) = all_jobs(db)
+    assert stored.status == "done"
+    assert stored.locked_by is None
+
+
+def test_completion_prunes_old_finished_jobs(db: Session) -> None:
+    enqueue(kind="test_old")
+    (old,) = claim()
+    assert complete(old)
+    (stored,) = all_jobs(db)
+    stored.run_at = utcnow() - timedelta(days=2)
+    db.add(stored)
+    db.commit()
+
+    enqueue()
+    (job,) = claim()
+    assert complete(job)
+    (stored,) = all_jobs(db)
+    assert stored.id == job.id
+
+
+def test_run_worker_drains_queue_until_stopped(db: Session) -> None:
+    enqueue()
+
+    @jobs.job_handler("test_noop")
+    async def noop(payload: dict[str, Any]) -> None:  # noqa: ARG001
+        pass
+
+    async def run() -> None:
+        stop = asyncio.Event()
+        worker = asyncio.create_task(
+            jobs.run_worker(concurrency=2, poll_interval=0.01, stop=stop)
+        )
+        await asyncio.sleep(0.2)
+        stop.set()
+        await worker
+
+    asyncio.run(run())
+    (stored,) = all_jobs(db)
+    assert stored.status == "done"
@@ -0,0 +1,76 @@
+import asyncio
+from collections.abc import Generator
+from pathlib import Path
+
+import pytest
+from sqlmodel import Session
+
+from app.ai import clients
+from app.ai.assistant import AsyncLLMController
+from app.ai.stub_server import StubProviderServer
+from app.backfill_summaries import BackfillStats, backfill, read_checkpoint
+from app.models import Conversation
+from app.tests.utils.conversation import (
+    create_random_conversation,
+    create_random_conversation_with_random_messages,
+)
+
+
+@pytest.fixture(scope="module")
+def stub() -> Generator[StubProviderServer, None, None]:
+    with StubProviderServer(answer="Backfilled summary") as server:
+        yield server
+
+
+def run_backfill(
+    stub: StubProviderServer, checkpoint: Path | None, dry_run: bool = False
+) -> BackfillStats:
+    async def run() -> BackfillStats:
+        llm = AsyncLLMController(
+            openai_client=clients.get_async_openai_client(stub.base_url)
+        )
+        try:
+            return await backfill(
+                llm=llm, checkpoint=checkpoint, chunk_size=2, rate=0, dry_run=dry_run
+            )
+        finally:
+            await clients.aclose_clients()
+
+    return asyncio.run(run())
+
+
+def test_backfill_fills_missing_summaries_and_resumes(
+    db: Session, stub: StubProviderServer, tmp_path: Path
+) -> None:
+    conversations = [
+        create_random_conversation_with_random_messages(db) for _ in range(3)
+    ]
+    empty = create_random_conversation(db)
+    checkpoint = tmp_path / "checkpoint"
+
+    stats = run_backfill(stub, checkpoint)
+    assert stats.updated >= 3
+    assert stats.skipped >= 1
+    assert stats.failed == 0
+    for conversation in conversations:
+        db.refresh(conversation)
+        assert conversation.summary == "Backfilled summary"
+        assert conversation.summary_message_id is not None
+    db.refresh(empty)
+    assert empty.summary is None
+    assert read_checkpoint(checkpoint) >= (empty.id or 0)
+
+    stats = run_backfill(stub, checkpoint)
+    assert stats.conversations == 0
+
+
+def test_backfill_dry_run_writes_nothing(db: Session, stub: StubProviderServer) -> None:
+    conversation = create_random_conversation_with_random_messages(db)
+    requests = stub.requests
+
+    stats = run_backfill(stub, None, dry_run=True)
+    assert stats.updated >= 1
+    assert stub.requests > requests
+    db.refresh(conversation)
+    assert db.get(Conversation, conversation.id)
+    assert conversation.summary is None
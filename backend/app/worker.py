@@ -0,0 +1,37 @@
+import asyncio
+import logging
+import signal
+
+from app import jobs
+from app.ai.assistant import reset_async_llm_controller
+from app.core.config import settings
+from app.core.db import async_engine
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+async def serve() -> None:
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(signum, stop.set)
+    try:
+        await jobs.run_worker(
+            concurrency=settings.JOBS_WORKER_CONCURRENCY,
+            poll_interval=settings.JOBS_POLL_INTERVAL_SECONDS,
+            stop=stop,
+        )
+    finally:
+        await reset_async_llm_controller()
+        await async_engine.dispose()
+
+
+def main() -> None:
+    logger.info("Starting job worker")
+    asyncio.run(serve())
+    logger.info("Job worker stopped")
+
+
+if __name__ == "__main__":
+    main()